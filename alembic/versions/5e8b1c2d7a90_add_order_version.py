@@ -0,0 +1,27 @@
+"""add orders.version for order card cache
+
+Revision ID: 5e8b1c2d7a90
+Revises: 9c3e5a7d2f41
+Create Date: 2026-10-19 13:40:05.551204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e8b1c2d7a90'
+down_revision: Union[str, None] = '9c3e5a7d2f41'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('orders', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('orders') as batch_op:
+        batch_op.drop_column('version')
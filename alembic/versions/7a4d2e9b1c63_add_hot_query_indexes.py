@@ -0,0 +1,41 @@
+"""add composite and partial indexes for hot order queries
+
+Revision ID: 7a4d2e9b1c63
+Revises: 5e8b1c2d7a90
+Create Date: 2026-10-19 14:22:31.904117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7a4d2e9b1c63'
+down_revision: Union[str, None] = '5e8b1c2d7a90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # selectinload(Order.items) и подзапрос замен: WHERE order_id IN (...)
+    op.create_index('ix_order_items_order_id', 'order_items', ['order_id'], unique=False)
+    op.create_index(
+        'ix_order_items_pending_replacement', 'order_items', ['order_id'], unique=False,
+        postgresql_where=sa.text('need_replacement AND replacement_sku IS NULL'),
+        sqlite_where=sa.text('need_replacement = 1 AND replacement_sku IS NULL'),
+    )
+    op.create_index('ix_orders_status_delivery_type', 'orders', ['status', 'delivery_type'], unique=False)
+    op.create_index('ix_orders_manager_id_created_at', 'orders', ['manager_id', 'created_at', 'id'], unique=False)
+    op.create_index(
+        'ix_orders_status_is_urgent_created_at', 'orders', ['status', 'is_urgent', 'created_at'], unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_orders_status_is_urgent_created_at', table_name='orders')
+    op.drop_index('ix_orders_manager_id_created_at', table_name='orders')
+    op.drop_index('ix_orders_status_delivery_type', table_name='orders')
+    op.drop_index('ix_order_items_pending_replacement', table_name='order_items')
+    op.drop_index('ix_order_items_order_id', table_name='order_items')
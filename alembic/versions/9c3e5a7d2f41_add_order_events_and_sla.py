@@ -0,0 +1,85 @@
+"""add order_events log and order_sla rollup
+
+Revision ID: 9c3e5a7d2f41
+Revises: 4164886bde77
+Create Date: 2026-10-19 10:12:40.118305
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9c3e5a7d2f41'
+down_revision: Union[str, None] = '4164886bde77'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Типы уже созданы baseline-миграцией (create_all) — не пересоздаём
+order_status_enum = postgresql.ENUM(
+    'NEW', 'ASSEMBLY', 'READY_FOR_PICKUP', 'DELIVERING', 'DELIVERED', 'CANCELED',
+    name='order_status_enum', create_type=False,
+)
+delivery_type_enum = postgresql.ENUM('COURIER', 'TAXI', name='delivery_type_enum', create_type=False)
+
+
+def upgrade() -> None:
+    op.create_table('order_events',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('order_id', sa.Integer(), nullable=False),
+    sa.Column('from_status', order_status_enum, nullable=True),
+    sa.Column('to_status', order_status_enum, nullable=False),
+    sa.Column('actor_telegram_id', sa.BigInteger(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=False),
+    sa.ForeignKeyConstraint(['order_id'], ['orders.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    comment='Журнал событий заказов'
+    )
+    op.create_index('ix_order_events_order_id_created_at', 'order_events', ['order_id', 'created_at'], unique=False)
+
+    op.create_table('order_sla',
+    sa.Column('order_id', sa.Integer(), nullable=False),
+    sa.Column('is_urgent', sa.Boolean(), nullable=False),
+    sa.Column('delivery_type', delivery_type_enum, nullable=False),
+    sa.Column('created_ts', sa.Float(), nullable=False),
+    sa.Column('assembly_started_ts', sa.Float(), nullable=True),
+    sa.Column('ready_ts', sa.Float(), nullable=True),
+    sa.Column('pickup_ts', sa.Float(), nullable=True),
+    sa.Column('delivered_ts', sa.Float(), nullable=True),
+    sa.Column('queue_wait_s', sa.Float(), nullable=True),
+    sa.Column('assembly_s', sa.Float(), nullable=True),
+    sa.Column('pickup_wait_s', sa.Float(), nullable=True),
+    sa.Column('delivery_s', sa.Float(), nullable=True),
+    sa.Column('total_s', sa.Float(), nullable=True),
+    sa.ForeignKeyConstraint(['order_id'], ['orders.id'], ),
+    sa.PrimaryKeyConstraint('order_id'),
+    comment='SLA-тайминги заказов (rollup)'
+    )
+    op.create_index(op.f('ix_order_sla_created_ts'), 'order_sla', ['created_ts'], unique=False)
+    op.create_index(op.f('ix_order_sla_delivered_ts'), 'order_sla', ['delivered_ts'], unique=False)
+
+    # Backfill из существующих заказов: известны только created/assembled/delivered
+    if op.get_bind().dialect.name == 'postgresql':
+        epoch = "EXTRACT(EPOCH FROM {})"
+    else:
+        epoch = "((julianday({}) - 2440587.5) * 86400.0)"
+    created, ready, delivered = (epoch.format(c) for c in ('created_at', 'assembled_at', 'delivered_at'))
+    op.execute(
+        f"""
+        INSERT INTO order_sla (order_id, is_urgent, delivery_type, created_ts, ready_ts, delivered_ts, total_s)
+        SELECT id, is_urgent, delivery_type, {created}, {ready}, {delivered}, {delivered} - {created}
+        FROM orders
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_order_sla_delivered_ts'), table_name='order_sla')
+    op.drop_index(op.f('ix_order_sla_created_ts'), table_name='order_sla')
+    op.drop_table('order_sla')
+    op.drop_index('ix_order_events_order_id_created_at', table_name='order_events')
+    op.drop_table('order_events')
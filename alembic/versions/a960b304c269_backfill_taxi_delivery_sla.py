@@ -0,0 +1,33 @@
+"""backfill order_sla.delivery_s for taxi orders
+
+Revision ID: a960b304c269
+Revises: d4e8a1f6c372
+Create Date: 2026-10-19 21:40:12.507381
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a960b304c269'
+down_revision: Union[str, None] = 'd4e8a1f6c372'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Такси идёт ASSEMBLY -> DELIVERED без pickup_ts: delivery_s — от последней
+    # известной метки (как в OrderService._record_transitions)
+    op.execute(
+        """
+        UPDATE order_sla
+        SET delivery_s = delivered_ts - COALESCE(pickup_ts, ready_ts, assembly_started_ts)
+        WHERE delivery_type = 'TAXI' AND delivery_s IS NULL AND delivered_ts IS NOT NULL
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute("UPDATE order_sla SET delivery_s = NULL WHERE delivery_type = 'TAXI' AND pickup_ts IS NULL")
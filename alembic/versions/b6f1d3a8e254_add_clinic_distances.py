@@ -0,0 +1,36 @@
+"""add clinic_distances matrix
+
+Revision ID: b6f1d3a8e254
+Revises: 7a4d2e9b1c63
+Create Date: 2026-10-19 15:20:08.441930
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b6f1d3a8e254'
+down_revision: Union[str, None] = '7a4d2e9b1c63'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Таблица заполняется при старте бота (clinic_matrix.ensure) — миграция только создаёт её
+    op.create_table('clinic_distances',
+    sa.Column('from_id', sa.Integer(), nullable=False),
+    sa.Column('to_id', sa.Integer(), nullable=False),
+    sa.Column('km', sa.Float(), nullable=False),
+    sa.Column('minutes', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('from_id', 'to_id'),
+    comment='Расстояния между клиниками и складом'
+    )
+    op.create_index('ix_clinic_distances_to_id', 'clinic_distances', ['to_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_clinic_distances_to_id', table_name='clinic_distances')
+    op.drop_table('clinic_distances')
@@ -0,0 +1,30 @@
+"""add clinic coordinates index for courier radius lookup
+
+Revision ID: d4e8a1f6c372
+Revises: b6f1d3a8e254
+Create Date: 2026-10-19 17:05:43.218604
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd4e8a1f6c372'
+down_revision: Union[str, None] = 'b6f1d3a8e254'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # courier.process_location_search: клиники в квадрате вокруг курьера -> их готовые заказы
+    op.create_index('ix_clinics_geo_lat_geo_lon', 'clinics', ['geo_lat', 'geo_lon'], unique=False)
+    op.create_index(
+        'ix_orders_clinic_id_status_delivery_type', 'orders', ['clinic_id', 'status', 'delivery_type'], unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_orders_clinic_id_status_delivery_type', table_name='orders')
+    op.drop_index('ix_clinics_geo_lat_geo_lon', table_name='clinics')
@@ -0,0 +1,611 @@
+"""
+Бенчмарк маршрутизации курьеров (services.routing).
+
+Сравнивает текущую реализацию (кластеры по сетке, матрица расстояний NumPy,
+улучшение 2-opt / Or-opt) с прежней скалярной (двойные циклы haversine_distance)
+на случайных точках по Ташкенту: кластеры, отдельные заказы и порядок Nearest
+Neighbor должны совпадать, групповой маршрут — состоять из тех же заказов;
+печатается длина маршрута до и после улучшения. Этап «с матрицей клиник»
+сравнивает маршрут с готовой матрицей между остановками и без неё.
+
+--property N дополнительно прогоняет N случайных раскладок (равномерные,
+сгустки, дубликаты точек, цепочки с шагом на пороге радиуса, высокие широты)
+и сверяет кластеризацию по сетке с полной матрицей и прежним Union-Find.
+
+Для каждого размера и для --urgent-sets наборов размера одного курьера
+(5–25 заказов) сравнивается порядок со срочными заказами (URGENT_SHARE
+заказов с приоритетом и окном доставки): только по км и по взвешенной
+цели — длина, среднее прибытие к срочным, опоздания.
+--orders FILE — то же на записанных наборах заказов (JSON: список
+{"start": [lat, lon], "orders": [{"id", "lat", "lon", "is_urgent", "waited_min"}]}).
+
+--suite — набор сценариев против эталона (bench_baseline.json): клиники
+по Ташкенту uniform / clustered / ring (вдоль кольцевой) и записанные дни
+(--orders). Метрики: время build_clusters, _optimize_route_sync
+и optimize_route_with_clusters (медиана), км маршрута и доля срочных
+в первой половине (при улучшениях до сходимости — не зависят от машины).
+--save-baseline записывает эталон, --check завершает с кодом 1 при регрессии
+(для CI). Записанный день выгружается из БД: --export-day 2026-05-04 --out day.json
+(id перенумерованы, координаты округлены, без имён).
+
+Использование: python bench_routing.py [-n 10,100,1000] [--repeat 3] [--seed 1] [--property 300]
+               [--urgent-sets 100] [--orders day.json]
+               python bench_routing.py --suite [--orders day.json] [--check | --save-baseline]
+               python bench_routing.py --export-day YYYY-MM-DD [--out day.json]
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import sys
+import time
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from services import routing
+
+# Центр Ташкента и разброс точек (~ ±25 км)
+CENTER = (41.3111, 69.2797)
+SPREAD_DEG = (0.22, 0.30)
+# Доля срочных заказов и окно доставки срочного (мин) в сценариях с приоритетами
+URGENT_SHARE = 0.2
+URGENT_DUE_MIN = 90.0
+
+# Сценарии набора (--suite) и их форма
+SCENARIOS = ("uniform", "clustered", "ring")
+# Размеры по умолчанию: курьерские наборы и «весь день» — км считаются до
+# сходимости улучшений, на сотнях точек это уже десятки секунд
+SUITE_SIZES = "10,25,100"
+CLUSTERED_CENTERS = 6
+CLUSTER_SIGMA_KM = 1.5
+RING_RADIUS_KM = 10.0
+RING_WIDTH_KM = 0.5
+RING_CENTER_SHARE = 0.15
+# Допуски сверки с эталоном: время — в разы (шум CI) плюс запас на мелкие
+# сценарии, км — доля, срочные в первой половине — абсолютная доля
+TIME_TOLERANCE = 1.0
+TIME_SLACK_MS = 5.0
+KM_TOLERANCE = 0.03
+URGENT_TOLERANCE = 0.05
+# Бюджет улучшений при замере км и срочных (с запасом до сходимости)
+QUALITY_BUDGET_S = 30.0
+# Знаков после запятой в координатах выгрузки (~100 м)
+EXPORT_DIGITS = 3
+DEFAULT_BASELINE = "bench_baseline.json"
+
+
+# --- Прежняя реализация (эталон для сравнения) ---
+
+@lru_cache(maxsize=1000)
+def legacy_haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = math.radians(lat2 - lat1)
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2)**2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2)**2
+    return 6371 * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+def legacy_nn(current_location: Tuple[float, float], orders_data: List[Dict]) -> Tuple[List[Dict], float]:
+    unvisited = orders_data[:]
+    visited = []
+    total_dist = 0.0
+    current_lat, current_lon = current_location
+    while unvisited:
+        nearest_order = None
+        min_dist = float('inf')
+        for order in unvisited:
+            dist = legacy_haversine(current_lat, current_lon, order['lat'], order['lon'])
+            if dist < min_dist:
+                min_dist = dist
+                nearest_order = order
+        visited.append(nearest_order)
+        unvisited.remove(nearest_order)
+        total_dist += min_dist
+        current_lat, current_lon = nearest_order['lat'], nearest_order['lon']
+    return visited, total_dist
+
+
+def legacy_clusters(orders_data: List[Dict], max_dist_km: float) -> List[List[Dict]]:
+    n = len(orders_data)
+    parent = list(range(n))
+
+    def find(x: int) -> int:
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for i in range(n):
+        for j in range(i + 1, n):
+            if legacy_haversine(
+                orders_data[i]['lat'], orders_data[i]['lon'],
+                orders_data[j]['lat'], orders_data[j]['lon'],
+            ) <= max_dist_km:
+                pi, pj = find(i), find(j)
+                if pi != pj:
+                    parent[pi] = pj
+    clusters: Dict[int, List[Dict]] = {}
+    for i in range(n):
+        clusters.setdefault(find(i), []).append(orders_data[i])
+    return list(clusters.values())
+
+
+def legacy_route_with_clusters(current_location, orders_data):
+    clusters = legacy_clusters(orders_data, routing.CLUSTER_RADIUS_KM)
+    grouped, distant = [], []
+    for idx, cluster in enumerate(clusters):
+        if len(cluster) == 1:
+            point = cluster[0]
+            min_d = min(
+                (legacy_haversine(point['lat'], point['lon'], o['lat'], o['lon'])
+                 for j, c in enumerate(clusters) if j != idx for o in c),
+                default=float('inf'),
+            )
+            (distant if min_d >= routing.DISTANT_THRESHOLD_KM else grouped).append(cluster)
+        else:
+            grouped.append(cluster)
+    route, total = [], 0.0
+    lat, lon = current_location
+    for cluster in sorted(grouped, key=lambda c: legacy_haversine(lat, lon, *routing._cluster_centroid(c))):
+        ordered, seg = legacy_nn((lat, lon), cluster)
+        route.extend(ordered)
+        total += seg
+        lat, lon = ordered[-1]['lat'], ordered[-1]['lon']
+    distant_orders = sorted(
+        (c[0] for c in distant),
+        key=lambda o: legacy_haversine(current_location[0], current_location[1], o['lat'], o['lon']),
+    )
+    return route, distant_orders, total
+
+
+# --- Бенчмарк ---
+
+def make_orders(n: int, rng: random.Random) -> List[Dict]:
+    return [
+        {
+            'id': i + 1,
+            'lat': CENTER[0] + rng.uniform(-SPREAD_DEG[0], SPREAD_DEG[0]),
+            'lon': CENTER[1] + rng.uniform(-SPREAD_DEG[1], SPREAD_DEG[1]),
+        }
+        for i in range(n)
+    ]
+
+
+def random_layout(rng: random.Random) -> Tuple[List[Dict], float]:
+    """Случайная раскладка точек и радиус для проверки свойств кластеризации."""
+    n = rng.choice([0, 1, 2, 3, 5, 10, 50, 200, 400])
+    radius = rng.choice([0.05, 0.5, 1.0, routing.CLUSTER_RADIUS_KM, routing.DISTANT_THRESHOLD_KM, 25.0])
+    lat0 = rng.choice([CENTER[0], 0.0, -33.9, 64.1, 78.2])
+    lon0 = rng.choice([CENTER[1], 0.0, 179.5, -70.6])
+    kind = rng.choice(["uniform", "blobs", "duplicates", "chain"])
+    points = []
+    if kind == "uniform":
+        points = [(lat0 + rng.uniform(-0.3, 0.3), lon0 + rng.uniform(-0.3, 0.3)) for _ in range(n)]
+    elif kind == "blobs":
+        centers = [(lat0 + rng.uniform(-0.3, 0.3), lon0 + rng.uniform(-0.3, 0.3)) for _ in range(rng.randint(1, 6))]
+        for _ in range(n):
+            c = rng.choice(centers)
+            points.append((c[0] + rng.gauss(0, 0.01), c[1] + rng.gauss(0, 0.01)))
+    elif kind == "duplicates":
+        base = [(lat0 + rng.uniform(-0.1, 0.1), lon0 + rng.uniform(-0.1, 0.1)) for _ in range(max(1, n // 5))]
+        points = [rng.choice(base) for _ in range(n)]
+    else:
+        # Шаг почти ровно радиус кластера — пары у самого порога
+        step = radius / routing.EARTH_RADIUS_KM * 180 / math.pi * rng.choice([0.999999, 1.0, 1.000001])
+        heading = rng.uniform(0, math.pi)
+        points = [(lat0 + k * step * math.sin(heading), lon0 + k * step * math.cos(heading)) for k in range(n)]
+    return [{'id': k + 1, 'lat': lat, 'lon': lon} for k, (lat, lon) in enumerate(points)], radius
+
+
+def check_properties(cases: int, rng: random.Random) -> int:
+    """Кластеры и отдельные точки по сетке == по полной матрице == прежний Union-Find."""
+    failures = 0
+    for case in range(cases):
+        orders, radius = random_layout(rng)
+        if not orders:
+            failures += routing.build_clusters(orders, radius) != []
+            continue
+        coords = routing._coords(orders)
+        dist = routing.distance_matrix(coords)
+        grid_labels = routing._grid_components(coords, radius)
+        matrix_labels = routing._components(dist <= radius)
+        grid = [ids(c) for c in routing._group(orders, grid_labels)]
+        matrix = [ids(c) for c in routing._group(orders, matrix_labels)]
+        legacy = [ids(c) for c in legacy_clusters(orders, radius)]
+        # Прежний Union-Find на скалярной math может разойтись с NumPy только
+        # для пар ровно на пороге (последний бит) — сверяем с ним вне цепочек
+        on_threshold = bool(np.any(np.isclose(dist, radius, rtol=0, atol=1e-9)))
+
+        threshold = radius * 2
+        rows = dist.copy()
+        np.fill_diagonal(rows, np.inf)
+        sizes = np.bincount(matrix_labels, minlength=len(orders))
+        expected_distant = (sizes[matrix_labels] == 1) & (rows.min(axis=1) >= threshold)
+        distant = routing._distant_singletons(coords, grid_labels, threshold)
+
+        if grid != matrix or (not on_threshold and grid != legacy) or not np.array_equal(distant, expected_distant):
+            failures += 1
+            print(f"❌ случай {case}: {len(orders)} точек, радиус {radius} км — расхождение")
+    print(f"{'✅' if not failures else '❌'} Свойства кластеризации по сетке: {cases - failures}/{cases} случаев")
+    return failures
+
+
+def with_urgency(orders: List[Dict], rng: random.Random) -> List[Dict]:
+    """Копия заказов: URGENT_SHARE срочных, часть из них уже ждёт."""
+    result = []
+    for o in orders:
+        o = {k: v for k, v in o.items() if k not in ('priority', 'due_min')}
+        if rng.random() < URGENT_SHARE:
+            o.update(priority=1.0, due_min=URGENT_DUE_MIN - rng.uniform(0, 60))
+        result.append(o)
+    return result
+
+
+def load_recorded(path: str) -> List[Tuple[Tuple[float, float], List[Dict]]]:
+    """Записанные наборы: (точка курьера, заказы с priority / due_min)."""
+    with open(path, encoding="utf-8") as f:
+        sets = json.load(f)
+    result = []
+    for item in sets:
+        orders = []
+        for o in item["orders"]:
+            order = {'id': o['id'], 'lat': o['lat'], 'lon': o['lon']}
+            if o.get('is_urgent'):
+                order.update(priority=1.0, due_min=URGENT_DUE_MIN - o.get('waited_min', 0.0))
+            orders.append(order)
+        result.append((tuple(item["start"]), orders))
+    return result
+
+
+def priority_rows(start: Tuple[float, float], orders: List[Dict], loop) -> List[Tuple[str, float, float, float, int, int]]:
+    """
+    Маршрут только по км против взвешенной цели (срочные раньше, окна доставки):
+    (вариант, мс, км, сумма прибытий к срочным, опоздания, срочных).
+    """
+    plain = [{k: v for k, v in o.items() if k not in ('priority', 'due_min')} for o in orders]
+    urgent = {o['id']: o for o in orders if o.get('priority')}
+    rows = []
+    for label, data in (("только км", plain), ("взвешенная", orders)):
+        t0 = time.perf_counter()
+        route = loop.run_until_complete(routing.optimize_route_with_clusters(start, data))
+        elapsed = (time.perf_counter() - t0) * 1000
+        etas = [(o['id'], eta) for o, eta in zip(route.grouped, route.eta_min) if o['id'] in urgent]
+        late = sum(eta > urgent[i]['due_min'] for i, eta in etas)
+        rows.append((label, elapsed, route.total_km, sum(eta for _, eta in etas), late, len(etas)))
+    return rows
+
+
+def priority_report(name: str, sets: List[Tuple[Tuple[float, float], List[Dict]]], loop) -> None:
+    """Сводка priority_rows по наборам заказов."""
+    totals: Dict[str, List[float]] = {}
+    for start, orders in sets:
+        for label, elapsed, km, eta_sum, late, count in priority_rows(start, orders, loop):
+            acc = totals.setdefault(label, [0.0, 0.0, 0.0, 0, 0])
+            for k, value in enumerate((elapsed, km, eta_sum, late, count)):
+                acc[k] += value
+    for label, (elapsed, km, eta_sum, late, count) in totals.items():
+        print(
+            f"{name:>6} {'срочные: ' + label:<22} {elapsed / len(sets):>10.2f} мс  {km / len(sets):>7.1f} км, "
+            f"срочных {count}, прибытие в среднем ~{eta_sum / count if count else 0.0:.0f} мин, опаздывают {late}"
+        )
+
+
+def courier_sets(count: int, rng: random.Random) -> List[Tuple[Tuple[float, float], List[Dict]]]:
+    """Наборы размера одного курьера: 5–25 заказов в радиусе ~8 км от точки курьера."""
+    sets = []
+    for _ in range(count):
+        start = (CENTER[0] + rng.uniform(-0.1, 0.1), CENTER[1] + rng.uniform(-0.1, 0.1))
+        orders = [
+            {'id': i + 1, 'lat': start[0] + rng.uniform(-0.07, 0.07), 'lon': start[1] + rng.uniform(-0.1, 0.1)}
+            for i in range(rng.randint(5, 25))
+        ]
+        sets.append((start, with_urgency(orders, rng)))
+    return sets
+
+
+# --- Набор сценариев с эталоном (регрессии скорости и качества) ---
+
+def scenario_orders(kind: str, n: int, rng: random.Random) -> List[Dict]:
+    """
+    Синтетические клиники по Ташкенту: uniform — равномерно по городу,
+    clustered — сгустки вокруг районных центров, ring — вдоль кольцевой
+    (~RING_RADIUS_KM от центра) и немного в центре.
+    """
+    km_lat = 180 / math.pi / routing.EARTH_RADIUS_KM
+    km_lon = km_lat / math.cos(math.radians(CENTER[0]))
+    if kind == "uniform":
+        return make_orders(n, rng)
+    points = []
+    if kind == "clustered":
+        centers = [
+            (CENTER[0] + rng.uniform(-0.7, 0.7) * SPREAD_DEG[0], CENTER[1] + rng.uniform(-0.7, 0.7) * SPREAD_DEG[1])
+            for _ in range(CLUSTERED_CENTERS)
+        ]
+        for _ in range(n):
+            c = rng.choice(centers)
+            points.append((c[0] + rng.gauss(0, CLUSTER_SIGMA_KM) * km_lat, c[1] + rng.gauss(0, CLUSTER_SIGMA_KM) * km_lon))
+    else:
+        for _ in range(n):
+            if rng.random() < RING_CENTER_SHARE:
+                r = rng.uniform(0, RING_RADIUS_KM / 3)
+            else:
+                r = RING_RADIUS_KM + rng.gauss(0, RING_WIDTH_KM)
+            a = rng.uniform(0, 2 * math.pi)
+            points.append((CENTER[0] + r * math.sin(a) * km_lat, CENTER[1] + r * math.cos(a) * km_lon))
+    return [{'id': i + 1, 'lat': lat, 'lon': lon} for i, (lat, lon) in enumerate(points)]
+
+
+def urgent_first_half(route: List[Dict]) -> Tuple[int, int]:
+    """(срочных в первой половине группового маршрута, всего срочных)."""
+    half = len(route) / 2
+    urgent = [k for k, o in enumerate(route) if o.get('priority')]
+    return sum(k < half for k in urgent), len(urgent)
+
+
+def median_ms(fn: Callable[[], object], repeat: int) -> Tuple[float, object]:
+    times, result = [], None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        times.append((time.perf_counter() - t0) * 1000)
+    return float(np.median(times)), result
+
+
+def measure(sets: List[Tuple[Tuple[float, float], List[Dict]]], repeat: int, loop) -> Dict[str, float]:
+    """Метрики сценария (суммарно по наборам): время трёх этапов, км, доля срочных в первой половине."""
+    totals = {"clusters_ms": 0.0, "nn_ms": 0.0, "route_ms": 0.0, "km": 0.0}
+    first, urgent = 0, 0
+    for start, orders in sets:
+        ms, _ = median_ms(lambda: routing.build_clusters(orders, routing.CLUSTER_RADIUS_KM), repeat)
+        totals["clusters_ms"] += ms
+        ms, _ = median_ms(lambda: routing._optimize_route_sync(start, orders), repeat)
+        totals["nn_ms"] += ms
+        ms, _ = median_ms(
+            lambda: loop.run_until_complete(routing.optimize_route_with_clusters(start, orders)), repeat
+        )
+        totals["route_ms"] += ms
+        # Качество — до сходимости улучшений: с рабочими бюджетами результат
+        # зависит от скорости машины, а эталон должен сверяться и в CI
+        route = loop.run_until_complete(routing.optimize_route_with_clusters(
+            start, orders, budget_s=QUALITY_BUDGET_S, priority_budget_s=QUALITY_BUDGET_S,
+        ))
+        totals["km"] += route.total_km
+        f, u = urgent_first_half(route.grouped)
+        first, urgent = first + f, urgent + u
+    totals["urgent_first_half"] = first / urgent if urgent else 1.0
+    return {k: round(v, 3) for k, v in totals.items()}
+
+
+def run_suite(sizes: List[int], seed: int, repeat: int, recorded: Optional[str], loop) -> Dict[str, Dict[str, float]]:
+    """Сценарий "вид/размер" -> метрики; наборы детерминированы по seed."""
+    results = {}
+    for kind in SCENARIOS:
+        for n in sizes:
+            rng = random.Random(f"{seed}:{kind}:{n}")
+            orders = with_urgency(scenario_orders(kind, n, rng), rng)
+            start = (CENTER[0] + rng.uniform(-0.1, 0.1), CENTER[1] + rng.uniform(-0.1, 0.1))
+            results[f"{kind}/{n}"] = measure([(start, orders)], repeat, loop)
+    if recorded:
+        results["recorded"] = measure(load_recorded(recorded), repeat, loop)
+    return results
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]]) -> int:
+    """Печать метрик против эталона; возвращает число регрессий."""
+    regressions = 0
+    print(f"{'сценарий':<16} {'метрика':<18} {'эталон':>10} {'сейчас':>10}  итог")
+    for name, metrics in results.items():
+        base = baseline.get(name)
+        for metric, value in metrics.items():
+            if base is None or metric not in base:
+                print(f"{name:<16} {metric:<18} {'—':>10} {value:>10.3f}  нет эталона")
+                continue
+            ref = base[metric]
+            if metric.endswith("_ms"):
+                bad = value > ref * (1 + TIME_TOLERANCE) + TIME_SLACK_MS
+            elif metric == "km":
+                bad = value > ref * (1 + KM_TOLERANCE) + 1e-6
+            else:
+                bad = value < ref - URGENT_TOLERANCE
+            regressions += bad
+            print(f"{name:<16} {metric:<18} {ref:>10.3f} {value:>10.3f}  {'РЕГРЕССИЯ' if bad else 'ok'}")
+    return regressions
+
+
+def export_day(day: str, path: str) -> int:
+    """
+    Выгрузить обезличенный день из orders / clinics: один набор на курьера —
+    его заказы с курьерской доставкой, собранные в этот день. Id заказов
+    перенумерованы, координаты клиник округлены (~100 м), имён нет; старт —
+    склад (WAREHOUSE_LAT / WAREHOUSE_LON) или центр набора.
+    """
+    from datetime import datetime, timedelta, timezone
+
+    from sqlalchemy import select
+
+    from config import config
+    from database.core import session_maker
+    from database.models import Clinic, DeliveryType, Order
+
+    begin = datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+
+    async def _rows():
+        async with session_maker() as session:
+            return (await session.execute(
+                select(Order.courier_id, Order.is_urgent, Order.created_at, Order.assembled_at, Clinic.geo_lat, Clinic.geo_lon)
+                .join(Clinic, Clinic.id == Order.clinic_id)
+                .where(
+                    Order.delivery_type == DeliveryType.COURIER,
+                    Order.courier_id.is_not(None),
+                    Order.assembled_at >= begin,
+                    Order.assembled_at < begin + timedelta(days=1),
+                )
+                .order_by(Order.courier_id, Order.assembled_at)
+            )).all()
+
+    rows = asyncio.run(_rows())
+    by_courier: Dict[int, List] = {}
+    for row in rows:
+        by_courier.setdefault(row.courier_id, []).append(row)
+    sets = []
+    for group in by_courier.values():
+        orders = []
+        for k, row in enumerate(group, 1):
+            created, ready = row.created_at, row.assembled_at
+            if created.tzinfo is None:
+                created = created.replace(tzinfo=timezone.utc)
+            if ready.tzinfo is None:
+                ready = ready.replace(tzinfo=timezone.utc)
+            orders.append({
+                "id": k,
+                "lat": round(row.geo_lat, EXPORT_DIGITS),
+                "lon": round(row.geo_lon, EXPORT_DIGITS),
+                "is_urgent": bool(row.is_urgent),
+                "waited_min": round((ready - created).total_seconds() / 60, 1),
+            })
+        if config.WAREHOUSE_LAT is not None and config.WAREHOUSE_LON is not None:
+            start = [config.WAREHOUSE_LAT, config.WAREHOUSE_LON]
+        else:
+            start = [round(float(np.mean([o["lat"] for o in orders])), EXPORT_DIGITS),
+                     round(float(np.mean([o["lon"] for o in orders])), EXPORT_DIGITS)]
+        sets.append({"start": start, "orders": orders})
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(sets, f, ensure_ascii=False, indent=1)
+    print(f"✅ {path}: {len(sets)} наборов, {len(rows)} заказов за {day}")
+    return 0
+
+
+def suite_main(args, loop) -> int:
+    sizes = [int(x) for x in (args.n or SUITE_SIZES).split(",")]
+    results = run_suite(sizes, args.seed, args.repeat, args.orders, loop)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=1, sort_keys=True)
+        print(f"✅ Эталон сохранён: {args.baseline} ({len(results)} сценариев)")
+        return 0
+    try:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        baseline = {}
+        print(f"⚠️ Эталона {args.baseline} нет — только текущие метрики (--save-baseline)")
+    regressions = compare(results, baseline)
+    if regressions and args.check:
+        print(f"❌ Регрессии маршрутизации: {regressions}")
+        return 1
+    print("✅ Регрессий нет" if not regressions else f"⚠️ Отклонения от эталона: {regressions}")
+    return 0
+
+
+def best_time(fn: Callable[[], object], repeat: int) -> Tuple[float, object]:
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        legacy_haversine.cache_clear()
+        t0 = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+def ids(orders) -> List[int]:
+    return [o['id'] for o in orders]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-n", help="Размеры сценариев через запятую (по умолчанию 10,100,1000; для --suite — 10,25,100)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--property", type=int, default=0, help="Случайных раскладок для проверки кластеризации")
+    parser.add_argument("--urgent-sets", type=int, default=100, help="Случайных наборов размера одного курьера со срочными")
+    parser.add_argument("--orders", help="JSON с записанными наборами заказов для сравнения порядка со срочными")
+    parser.add_argument("--suite", action="store_true", help="Сценарии uniform / clustered / ring (+ --orders) против эталона")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Файл эталона для --suite")
+    parser.add_argument("--save-baseline", action="store_true", help="Записать текущие метрики как эталон")
+    parser.add_argument("--check", action="store_true", help="Код 1 при регрессии относительно эталона (CI)")
+    parser.add_argument("--export-day", metavar="YYYY-MM-DD", help="Выгрузить обезличенный день из БД в --out")
+    parser.add_argument("--out", default="recorded_day.json", help="Файл для --export-day")
+    args = parser.parse_args()
+
+    if args.export_day:
+        return export_day(args.export_day, args.out)
+    if args.suite:
+        loop = asyncio.new_event_loop()
+        try:
+            return suite_main(args, loop)
+        finally:
+            loop.close()
+
+    rng = random.Random(args.seed)
+    loop = asyncio.new_event_loop()
+    mismatches = 0
+    print(f"{'точек':>6} {'этап':<22} {'было, мс':>10} {'стало, мс':>10} {'ускорение':>10}  результат")
+    for n in [int(x) for x in (args.n or "10,100,1000").split(",")]:
+        orders = make_orders(n, rng)
+        start = (CENTER[0] + rng.uniform(-0.1, 0.1), CENTER[1] + rng.uniform(-0.1, 0.1))
+        stages = [
+            (
+                "кластеры",
+                lambda: legacy_clusters(orders, routing.CLUSTER_RADIUS_KM),
+                lambda: routing.build_clusters(orders, routing.CLUSTER_RADIUS_KM),
+                lambda r: [ids(c) for c in r],
+            ),
+            (
+                "nearest neighbour",
+                lambda: legacy_nn(start, orders),
+                lambda: routing._optimize_route_sync(start, orders),
+                lambda r: (ids(r[0]), round(r[1], 6)),
+            ),
+            (
+                "маршрут с кластерами",
+                lambda: legacy_route_with_clusters(start, orders),
+                lambda: loop.run_until_complete(routing.optimize_route_with_clusters(start, orders)),
+                # Порядок обхода улучшен — сверяем состав маршрута и отдельные заказы
+                lambda r: (sorted(ids(r[0])), ids(r[1])),
+            ),
+            (
+                # Матрица между клиниками готова заранее (services.clinic_matrix)
+                "с матрицей клиник",
+                lambda: loop.run_until_complete(routing.optimize_route_with_clusters(start, orders)),
+                lambda: loop.run_until_complete(routing.optimize_route_with_clusters(start, orders, stop_dist=stop_dist)),
+                # Улучшение ограничено по времени — порядок может отличаться
+                lambda r: (sorted(ids(r.grouped)), ids(r.distant)),
+            ),
+        ]
+        stop_dist = routing.distance_matrix(routing._coords(orders))
+        for name, old_fn, new_fn, key in stages:
+            old_t, old_r = best_time(old_fn, args.repeat)
+            new_t, new_r = best_time(new_fn, args.repeat)
+            same = key(old_r) == key(new_r)
+            mismatches += not same
+            print(
+                f"{n:>6} {name:<22} {old_t * 1000:>10.2f} {new_t * 1000:>10.2f} "
+                f"{old_t / new_t if new_t else float('inf'):>9.1f}x  {'совпадает' if same else 'РАСХОЖДЕНИЕ'}"
+            )
+            if name == "маршрут с кластерами":
+                legacy_km, route = old_r[2], new_r
+        print(
+            f"{'':>6} длина маршрута: было {legacy_km:.1f} км, стало {route.total_km:.1f} км "
+            f"({(route.total_km - legacy_km) / legacy_km * 100 if legacy_km else 0.0:+.1f}%), "
+            f"2-opt / Or-opt сэкономили {route.saved_km:.1f} км"
+        )
+        priority_report(str(n), [(start, with_urgency(orders, rng))], loop)
+    if args.urgent_sets:
+        priority_report("5–25", courier_sets(args.urgent_sets, rng), loop)
+    if args.orders:
+        priority_report("запись", load_recorded(args.orders), loop)
+    loop.close()
+    if args.property:
+        mismatches += check_properties(args.property, rng)
+    if mismatches:
+        print(f"❌ Результаты расходятся в {mismatches} этапах")
+        return 1
+    print("✅ Результаты совпадают с прежней реализацией")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+"""
+Подготовка офлайн-графа дорог (services.road_graph) из выгрузки OpenStreetMap.
+
+Читает .osm (XML; .osm.pbf предварительно: osmium cat city.osm.pbf -o city.osm),
+берёт проезжие дороги (highway), учитывает односторонние улицы (oneway,
+круговые развязки, магистрали) и скорость (maxspeed или по типу дороги),
+оставляет крупнейшую связную компоненту и сохраняет граф в CSR-формате .npz.
+
+Без сети: выгрузку города можно скачать заранее (Geofabrik, BBBike, Overpass).
+
+Использование: python build_road_graph.py tashkent.osm road_graph.npz
+Затем в .env: ROAD_GRAPH_PATH=road_graph.npz
+"""
+import argparse
+import sys
+import time
+import xml.etree.ElementTree as ET
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from services.road_graph import ROAD_GRAPH_VERSION
+from services.routing import _union_find, haversine_pairs
+
+# Скорость по умолчанию (км/ч) по типу дороги — если нет maxspeed;
+# в городе ниже разрешённой из-за светофоров и пробок
+DEFAULT_SPEED_KMH = {
+    "motorway": 70, "motorway_link": 40,
+    "trunk": 55, "trunk_link": 35,
+    "primary": 40, "primary_link": 30,
+    "secondary": 35, "secondary_link": 25,
+    "tertiary": 30, "tertiary_link": 25,
+    "unclassified": 25, "residential": 20, "living_street": 10,
+    "service": 15, "road": 20,
+}
+# Доля от maxspeed, с которой реально едут по городу
+MAXSPEED_FACTOR = 0.7
+# Односторонние по умолчанию
+IMPLIED_ONEWAY = {"motorway", "motorway_link"}
+
+
+def parse_speed(value: Optional[str], highway: str) -> float:
+    default = DEFAULT_SPEED_KMH[highway]
+    if not value:
+        return default
+    head = value.split(";")[0].strip().lower()
+    try:
+        if head.endswith("mph"):
+            return float(head[:-3]) * 1.609 * MAXSPEED_FACTOR
+        return float(head.split()[0]) * MAXSPEED_FACTOR
+    except ValueError:
+        return default
+
+
+def read_ways(path: str) -> Tuple[List[Tuple[List[int], int, float]], set]:
+    """Проезжие дороги: (узлы OSM, направление 1 / -1 / 0 — обе стороны, скорость) и нужные узлы."""
+    ways = []
+    needed = set()
+    for _, elem in ET.iterparse(path, events=("end",)):
+        if elem.tag == "way":
+            tags = {t.get("k"): t.get("v") for t in elem.iter("tag")}
+            highway = tags.get("highway")
+            access = tags.get("access") or tags.get("motor_vehicle")
+            if highway in DEFAULT_SPEED_KMH and access not in ("no", "private"):
+                refs = [int(nd.get("ref")) for nd in elem.iter("nd")]
+                oneway = tags.get("oneway", "")
+                if oneway in ("yes", "1", "true") or (
+                    not oneway and (highway in IMPLIED_ONEWAY or tags.get("junction") == "roundabout")
+                ):
+                    direction = 1
+                elif oneway == "-1":
+                    direction = -1
+                else:
+                    direction = 0
+                if len(refs) > 1:
+                    ways.append((refs, direction, parse_speed(tags.get("maxspeed"), highway)))
+                    needed.update(refs)
+            elem.clear()
+        elif elem.tag == "relation":
+            elem.clear()
+    return ways, needed
+
+
+def read_nodes(path: str, needed: set) -> Dict[int, Tuple[float, float]]:
+    coords = {}
+    for _, elem in ET.iterparse(path, events=("end",)):
+        if elem.tag == "node":
+            node_id = int(elem.get("id"))
+            if node_id in needed:
+                coords[node_id] = (float(elem.get("lat")), float(elem.get("lon")))
+            elem.clear()
+        elif elem.tag in ("way", "relation"):
+            elem.clear()
+    return coords
+
+
+def build(ways, coords) -> Dict[str, np.ndarray]:
+    index: Dict[int, int] = {}
+    points: List[Tuple[float, float]] = []
+    src: List[int] = []
+    dst: List[int] = []
+    speed: List[float] = []
+    for refs, direction, kmh in ways:
+        refs = [r for r in refs if r in coords]
+        ids = []
+        for r in refs:
+            if r not in index:
+                index[r] = len(points)
+                points.append(coords[r])
+            ids.append(index[r])
+        for a, b in zip(ids, ids[1:]):
+            if a == b:
+                continue
+            if direction >= 0:
+                src.append(a), dst.append(b), speed.append(kmh)
+            if direction <= 0:
+                src.append(b), dst.append(a), speed.append(kmh)
+
+    pts = np.array(points, dtype=np.float64)
+    src_a, dst_a = np.array(src, dtype=np.int64), np.array(dst, dtype=np.int64)
+    length_m = haversine_pairs(pts, src_a, dst_a) * 1000
+    time_s = length_m / (np.array(speed) / 3.6)
+
+    # Крупнейшая связная компонента (без учёта направления): отбрасываем
+    # островки (дворы, парковки), с которых никуда не доехать
+    labels = _union_find(len(pts), src_a, dst_a)
+    main = np.bincount(labels).argmax()
+    keep_node = labels == main
+    new_id = np.cumsum(keep_node) - 1
+    keep_edge = keep_node[src_a]
+    src_a, dst_a = new_id[src_a[keep_edge]], new_id[dst_a[keep_edge]]
+    length_m, time_s = length_m[keep_edge], time_s[keep_edge]
+    pts = pts[keep_node]
+
+    order = np.lexsort((dst_a, src_a))
+    indptr = np.zeros(len(pts) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src_a, minlength=len(pts)), out=indptr[1:])
+    return {
+        "version": np.array(ROAD_GRAPH_VERSION),
+        "lat": pts[:, 0].astype(np.float32),
+        "lon": pts[:, 1].astype(np.float32),
+        "indptr": indptr,
+        "indices": dst_a[order].astype(np.int32),
+        "length_m": length_m[order].astype(np.float32),
+        "time_s": time_s[order].astype(np.float32),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("osm", help="Выгрузка OSM (.osm XML)")
+    parser.add_argument("output", help="Файл графа (.npz)")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    ways, needed = read_ways(args.osm)
+    coords = read_nodes(args.osm, needed)
+    if not ways:
+        print("❌ В выгрузке нет проезжих дорог")
+        return 1
+    graph = build(ways, coords)
+    np.savez_compressed(args.output, **graph)
+    print(
+        f"✅ {args.output}: {len(graph['lat'])} узлов, {len(graph['indices'])} рёбер "
+        f"из {len(ways)} дорог за {time.perf_counter() - t0:.1f} с"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
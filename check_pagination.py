@@ -0,0 +1,107 @@
+"""
+Проверка keyset-пагинации списка заказов менеджера (services.pagination).
+
+Во временной SQLite-базе создаются заказы, большая часть которых получает
+created_at из server_default в одну и ту же секунду (как при пачке заказов
+подряд), часть — с микросекундами. Список пролистывается вперёд до конца
+и обратно; при повторах или пропусках строк скрипт завершается с кодом 1.
+
+Использование: python check_pagination.py [-v]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from database.core import Base
+from database.models import Clinic, DeliveryType, Order, OrderStatus, User, UserRole
+from services.pagination import keyset_page
+
+PER_PAGE = 7
+SAME_SECOND = 40
+WITH_MICROSECONDS = 9
+
+
+def _order(manager_id: int, clinic_id: int, **extra) -> dict:
+    return dict(
+        manager_id=manager_id, clinic_id=clinic_id, status=OrderStatus.NEW,
+        delivery_type=DeliveryType.COURIER, is_urgent=False, **extra,
+    )
+
+
+async def _fill(session) -> list[int]:
+    manager = User(telegram_id=1, full_name="manager", role=UserRole.MANAGER, is_active=True)
+    clinic = Clinic(name="c", doctor_name="d", address="a", geo_lat=41.3, geo_lon=69.28, navigator_link="n")
+    session.add_all([manager, clinic])
+    await session.flush()
+    # Одна секунда, created_at из server_default ("YYYY-MM-DD HH:MM:SS")
+    await session.execute(insert(Order), [_order(manager.id, clinic.id) for _ in range(SAME_SECOND)])
+    # Раньше и с микросекундами (в том числе в одну секунду)
+    base = datetime(2025, 1, 1, 12, 0, 0)
+    await session.execute(insert(Order), [
+        _order(manager.id, clinic.id, created_at=base + timedelta(microseconds=k * 150_000))
+        for k in range(WITH_MICROSECONDS)
+    ])
+    await session.commit()
+    rows = await session.execute(
+        select(Order.id).where(Order.manager_id == manager.id).order_by(Order.created_at.desc(), Order.id.desc())
+    )
+    return [r.id for r in rows], manager.id
+
+
+async def main() -> int:
+    verbose = "-v" in sys.argv[1:]
+    path = os.path.join(tempfile.mkdtemp(), "pagination.sqlite3")
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    sessions = async_sessionmaker(engine, expire_on_commit=False)
+
+    failed = []
+    async with sessions() as session:
+        expected, manager_id = await _fill(session)
+        stmt = select(Order.id, Order.created_at).where(Order.manager_id == manager_id)
+        key_cols = (Order.created_at, Order.id)
+
+        # Вперёд до конца
+        pages, cursor = [], None
+        while True:
+            page = await keyset_page(session, stmt, key_cols, per_page=PER_PAGE, cursor=cursor)
+            pages.append(page)
+            if verbose:
+                print(f"  page {page.page}: {[r.id for r in page.rows]}")
+            if page.next_cursor is None or len(pages) > len(expected):
+                break
+            cursor = page.next_cursor
+        forward = [r.id for page in pages for r in page.rows]
+        if forward != expected:
+            failed.append(
+                f"вперёд: {len(forward)} строк, уникальных {len(set(forward))}, ожидалось {len(expected)}"
+            )
+
+        # Обратно с последней страницы
+        backward_ids, page = [], pages[-1]
+        while page.prev_cursor is not None and len(backward_ids) <= len(expected):
+            page = await keyset_page(
+                session, stmt, key_cols, per_page=PER_PAGE, cursor=page.prev_cursor, backward=True,
+            )
+            backward_ids = [r.id for r in page.rows] + backward_ids
+        backward_ids += [r.id for r in pages[-1].rows]
+        if backward_ids != expected:
+            failed.append(
+                f"назад: {len(backward_ids)} строк, уникальных {len(set(backward_ids))}, ожидалось {len(expected)}"
+            )
+    await engine.dispose()
+
+    print(f"{'❌' if failed else '✅'} keyset-пагинация: {len(expected)} заказов, по {PER_PAGE} на странице")
+    for line in failed:
+        print(f"   {line}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,167 @@
+"""
+Аудит планов горячих запросов по заказам.
+
+Для каждого запроса выполняется EXPLAIN (PostgreSQL) или EXPLAIN QUERY PLAN
+(SQLite); если хоть один из них читает таблицу полным сканированием
+(или не использует индекс, указанный в REQUIRED_INDEXES) —
+скрипт завершается с кодом 1 (удобно для CI после миграций).
+
+На PostgreSQL на время проверки выключается enable_seqscan: на маленькой
+тестовой базе планировщик честно выбирает Seq Scan, а так Seq Scan
+в плане остаётся только если подходящего индекса нет вовсе.
+
+Поддержка:
+- PostgreSQL (postgresql+asyncpg)
+- SQLite (sqlite+aiosqlite)
+
+Использование: python check_query_plans.py [-v]
+"""
+import asyncio
+import re
+import sys
+from datetime import datetime, timezone
+
+from sqlalchemy import select, text, and_
+from sqlalchemy.orm import selectinload
+
+from config import config
+from database.core import engine, Base
+from database.models import Order, OrderItem, OrderEvent, OrderSla, OrderStatus, DeliveryType, Clinic
+from services.pagination import keyset_condition
+
+IS_SQLITE = getattr(config, "DB_DIALECT", "postgres") in ("sqlite", "sqlite3")
+
+_NOW = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def hot_queries() -> dict:
+    """Горячие запросы — в том же виде, что строят хендлеры и сервисы."""
+    pending_replacement = select(OrderItem.order_id).where(
+        and_(
+            OrderItem.need_replacement == True,  # noqa: E712
+            OrderItem.replacement_sku.is_(None),
+        )
+    )
+    return {
+        # selectinload(Order.items) -> WHERE order_items.order_id IN (...)
+        "order items (selectinload)": select(OrderItem).where(OrderItem.order_id.in_([1, 2, 3])),
+        # manager.manager_replacements_list
+        "manager replacements": (
+            select(Order.id)
+            .where(Order.manager_id == 1, Order.id.in_(pending_replacement))
+            .order_by(Order.created_at.desc())
+        ),
+        # courier.process_location_search
+        "courier ready orders": select(Order.id, Order.clinic_id).where(
+            Order.status == OrderStatus.READY_FOR_PICKUP,
+            Order.delivery_type == DeliveryType.COURIER,
+        ),
+        # courier.process_location_search (заказы в квадрате вокруг курьера)
+        "courier orders in radius": (
+            select(Order.id)
+            .join(Clinic, Clinic.id == Order.clinic_id)
+            .where(
+                Order.clinic_id.in_(
+                    select(Clinic.id).where(
+                        Clinic.geo_lat.between(41.0, 41.6),
+                        Clinic.geo_lon.between(69.0, 69.6),
+                    )
+                ),
+                Order.status == OrderStatus.READY_FOR_PICKUP,
+                Order.delivery_type == DeliveryType.COURIER,
+            )
+        ),
+        # manager._load_manager_orders_page (keyset, страница после курсора)
+        "manager history page": (
+            select(Order.id, Order.status, Order.created_at, Clinic.doctor_name)
+            .outerjoin(Clinic, Clinic.id == Order.clinic_id)
+            .where(Order.manager_id == 1)
+            .where(keyset_condition((Order.created_at, Order.id), (_NOW, 100), sqlite=IS_SQLITE))
+            .order_by(Order.created_at.desc(), Order.id.desc())
+            .limit(16)
+        ),
+        # warehouse._get_active_orders / warehouse_queue.reconcile
+        "warehouse active orders": (
+            select(Order.id, Order.is_urgent, Order.status)
+            .where(Order.status.in_([OrderStatus.NEW, OrderStatus.ASSEMBLY]))
+            .order_by(Order.is_urgent.desc(), Order.created_at.asc(), Order.id.asc())
+        ),
+        # order_view.load_order_view
+        "order card": select(Order).where(Order.id == 1),
+        "order events": select(OrderEvent).where(OrderEvent.order_id == 1).order_by(OrderEvent.created_at),
+        # dashboard.get_sla_summary
+        "sla summary": select(OrderSla.order_id).where(OrderSla.created_ts >= _NOW.timestamp()),
+    }
+
+
+# Запросы, для которых мало отсутствия полного скана: план обязан
+# использовать конкретный индекс (иначе он есть, но не работает)
+REQUIRED_INDEXES = {
+    "courier orders in radius": "ix_clinics_geo_lat_geo_lon",
+}
+
+
+def find_seq_scans(plan_lines: list[str]) -> list[str]:
+    """Строки плана с полным сканированием таблицы."""
+    bad = []
+    for line in plan_lines:
+        if IS_SQLITE:
+            # "SCAN orders" — полный проход; "SCAN orders USING (COVERING) INDEX" — по индексу
+            if re.search(r"\bSCAN\b", line) and "USING" not in line and "CONSTANT ROW" not in line:
+                bad.append(line)
+        elif "Seq Scan" in line:
+            bad.append(line)
+    return bad
+
+
+async def explain(conn, stmt) -> list[str]:
+    compiled = stmt.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True})
+    if IS_SQLITE:
+        rows = await conn.execute(text(f"EXPLAIN QUERY PLAN {compiled}"))
+        return [str(r[-1]) for r in rows]
+    rows = await conn.execute(text(f"EXPLAIN {compiled}"))
+    return [str(r[0]) for r in rows]
+
+
+async def main() -> int:
+    verbose = "-v" in sys.argv[1:]
+    print("=" * 60)
+    print(f"Аудит планов запросов ({'SQLite' if IS_SQLITE else 'PostgreSQL'})")
+    print("=" * 60)
+
+    failed = []
+    async with engine.connect() as conn:
+        if IS_SQLITE:
+            # В режиме SQLite таблицы создаются автоматически (как в main.py)
+            await conn.run_sync(Base.metadata.create_all)
+        else:
+            await conn.execute(text("SET enable_seqscan = off"))
+        for name, stmt in hot_queries().items():
+            plan = await explain(conn, stmt)
+            bad = find_seq_scans(plan)
+            required = REQUIRED_INDEXES.get(name)
+            if required and not any(required in line for line in plan):
+                bad.append(f"не используется индекс {required}")
+            print(f"{'❌' if bad else '✅'} {name}")
+            if verbose or bad:
+                for line in plan:
+                    print(f"     {line}")
+            if bad:
+                failed.append(name)
+        await conn.rollback()
+
+    print("-" * 60)
+    if failed:
+        print(f"❌ Полное сканирование или нет нужного индекса в {len(failed)} запросах: {', '.join(failed)}")
+        print("   Решение: alembic upgrade head (индексы горячих запросов)")
+        return 1
+    print("✅ Все горячие запросы используют индексы")
+    return 0
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(asyncio.run(main()))
+    except KeyboardInterrupt:
+        print("\n\nПрервано пользователем")
+        sys.exit(1)
@@ -0,0 +1,108 @@
+"""
+Проверка закрытия заказа ссылкой такси (handlers.warehouse.process_taxi_link).
+
+Во временной SQLite-базе отменённый и уже доставленный заказы получают
+ссылку такси: оба должны быть отклонены («уже закрыт или отменён») без
+изменения статуса, delivered_at, order_sla и журнала order_events.
+При нарушении скрипт завершается с кодом 1.
+
+Использование: python check_taxi_link.py
+"""
+import asyncio
+import os
+import sys
+import tempfile
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from database.core import Base
+from database.models import Clinic, DeliveryType, Order, OrderEvent, OrderSla, OrderStatus, User, UserRole
+from handlers.warehouse import process_taxi_link
+
+WAREHOUSE_TG = 2
+DELIVERED_AT = datetime(2025, 1, 1, 12, 0, tzinfo=timezone.utc)
+
+
+class _Message(SimpleNamespace):
+    """Сообщение склада: текст — ссылка, ответы бота копятся в answers."""
+
+    async def answer(self, text, **kwargs):
+        self.answers.append(text)
+
+
+async def _state_for(order_id: int) -> FSMContext:
+    state = FSMContext(MemoryStorage(), StorageKey(bot_id=1, chat_id=WAREHOUSE_TG, user_id=WAREHOUSE_TG))
+    await state.update_data(current_order_id=order_id)
+    return state
+
+
+async def _snapshot(session, order_id: int):
+    order = (await session.execute(
+        select(Order.status, Order.delivered_at, Order.taxi_link).where(Order.id == order_id)
+    )).one()
+    sla = (await session.execute(
+        select(OrderSla.delivered_ts, OrderSla.delivery_s).where(OrderSla.order_id == order_id)
+    )).one()
+    events = await session.scalar(select(func.count()).select_from(OrderEvent).where(OrderEvent.order_id == order_id))
+    return tuple(order), tuple(sla), events
+
+
+async def main() -> int:
+    path = os.path.join(tempfile.mkdtemp(), "taxi.sqlite3")
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    sessions = async_sessionmaker(engine, expire_on_commit=False)
+
+    failed = []
+    async with sessions() as session:
+        manager = User(telegram_id=1, full_name="manager", role=UserRole.MANAGER, is_active=True)
+        clinic = Clinic(name="c", doctor_name="d", address="a", geo_lat=41.3, geo_lon=69.28,
+                        navigator_link="n", telegram_chat_id=3)
+        session.add_all([manager, clinic])
+        await session.flush()
+        orders = {
+            OrderStatus.CANCELED: Order(manager_id=manager.id, clinic_id=clinic.id, status=OrderStatus.CANCELED,
+                                        delivery_type=DeliveryType.TAXI, is_urgent=False),
+            OrderStatus.DELIVERED: Order(manager_id=manager.id, clinic_id=clinic.id, status=OrderStatus.DELIVERED,
+                                         delivery_type=DeliveryType.TAXI, is_urgent=False,
+                                         delivered_at=DELIVERED_AT, taxi_link="https://taxi/old"),
+        }
+        session.add_all(orders.values())
+        await session.flush()
+        for order in orders.values():
+            session.add(OrderSla(order_id=order.id, is_urgent=False, delivery_type=DeliveryType.TAXI,
+                                 created_ts=0.0, delivered_ts=DELIVERED_AT.timestamp() if order.delivered_at else None))
+        await session.commit()
+        order_ids = {status: order.id for status, order in orders.items()}
+
+        for status, order_id in order_ids.items():
+            before = await _snapshot(session, order_id)
+            message = _Message(text="https://taxi/new", from_user=SimpleNamespace(id=WAREHOUSE_TG), bot=None, answers=[])
+            state = await _state_for(order_id)
+            await process_taxi_link(message, state, session)
+            session.expire_all()
+            after = await _snapshot(session, order_id)
+
+            if not any("уже закрыт или отменён" in a for a in message.answers):
+                failed.append(f"{status.value}: ссылка такси не отклонена, ответы: {message.answers}")
+            if after != before:
+                failed.append(f"{status.value}: заказ изменён: {before} -> {after}")
+            if await state.get_state() is not None or await state.get_data():
+                failed.append(f"{status.value}: состояние FSM не очищено")
+    await engine.dispose()
+
+    print(f"{'❌' if failed else '✅'} ссылка такси для отменённого и доставленного заказа")
+    for line in failed:
+        print(f"   {line}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
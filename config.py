@@ -2,7 +2,7 @@
 Конфигурация приложения с валидацией через Pydantic.
 """
 import os
-from typing import List, Optional
+from typing import Dict, List, Optional
 from pathlib import Path
 from pydantic import Field, field_validator, computed_field
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -92,8 +92,13 @@ class Config(BaseSettings):
     REDIS_DB: int = Field(default=0, description="Номер БД Redis")
     REDIS_PASSWORD: Optional[str] = Field(default=None, description="Пароль Redis")
     REDIS_CACHE_TTL: int = Field(default=300, description="TTL кеша в секундах")
+    USER_CACHE_LOCAL_TTL: int = Field(default=30, description="TTL кеша пользователей в памяти процесса (перед Redis), секунд")
+    USER_CACHE_LOCAL_SIZE: int = Field(default=5000, description="Сколько пользователей держать в кеше в памяти процесса")
     REDIS_RATE_LIMIT_TTL: int = Field(default=60, description="TTL rate limit в секундах")
     
+    # Очередь склада в памяти
+    WAREHOUSE_QUEUE_RECONCILE_INTERVAL: int = Field(default=60, description="Интервал сверки очереди склада с БД в секундах")
+    
     # 1C Integration
     ONE_C_MODE: str = Field(default="test", description="Режим работы 1С: test или real")
     ONE_C_API_URL: str = Field(default="", description="URL API 1С")
@@ -202,6 +207,46 @@ class Config(BaseSettings):
     RATE_LIMIT_MESSAGE_MAX: int = Field(default=60, description="Максимум сообщений за период (на пользователя)")
     RATE_LIMIT_CALLBACK_MAX: int = Field(default=200, description="Максимум callback за период (на пользователя)")
     RATE_LIMIT_PERIOD: float = Field(default=60.0, description="Период rate limit в секундах")
+    RATE_LIMIT_ROLE_FACTORS: str = Field(
+        default="warehouse:2,courier:2,admin:3",
+        description="Множители лимитов по ролям (роль:множитель через запятую); остальные — 1",
+    )
+
+    @property
+    def RATE_LIMIT_ROLE_FACTORS_MAP(self) -> Dict[str, float]:
+        """{роль: множитель лимита}."""
+        factors = {}
+        for part in self.RATE_LIMIT_ROLE_FACTORS.split(","):
+            role, _, factor = part.partition(":")
+            if role.strip() and factor.strip():
+                factors[role.strip()] = float(factor)
+        return factors
+    
+    # Очередь исходящих уведомлений (лимиты Telegram: ~30 сообщений/с на бота, ~1/с в чат)
+    NOTIFY_WORKERS: int = Field(default=4, description="Количество воркеров, берущих уведомления из очереди")
+    NOTIFY_MAX_INFLIGHT: int = Field(default=1000, description="Сколько взятых из очереди, но не отправленных уведомлений держать в очередях чатов; сверх — берутся только срочные")
+    NOTIFY_GLOBAL_RATE: float = Field(default=25.0, description="Максимум сообщений в секунду на бота")
+    NOTIFY_CHAT_RATE: float = Field(default=1.0, description="Максимум сообщений в секунду в один чат")
+    NOTIFY_CHAT_BURST: int = Field(default=3, description="Допустимая пачка сообщений в один чат")
+    NOTIFY_MAX_ATTEMPTS: int = Field(default=5, description="Попыток отправки при сетевых ошибках")
+    NOTIFY_VISIBILITY_TIMEOUT: float = Field(default=120.0, description="Через сколько секунд взятое из Redis и не отправленное сообщение возвращается в очередь (упавший инстанс)")
+    NOTIFY_DIGEST_WINDOW: float = Field(default=3.0, description="Окно склейки несрочных уведомлений в дайджест, секунды")
+    NOTIFY_DIGEST_EDIT_WINDOW: float = Field(default=600.0, description="Сколько секунд дополнять (редактировать) последний дайджест вместо нового сообщения")
+    NOTIFY_DIGEST_MAX_LINES: int = Field(default=30, description="Максимум строк в одном дайджесте")
+
+    # Адресная рассылка курьерам (ближайшие первыми)
+    COURIER_NOTIFY_NEAREST_K: int = Field(default=3, description="Скольким ближайшим курьерам предлагать готовый заказ первыми (0 — всем сразу)")
+    COURIER_NOTIFY_WIDEN_AFTER: float = Field(default=180.0, description="Через сколько секунд предложить невзятый заказ остальным курьерам")
+    COURIER_NOTIFY_RADIUS_KM: float = Field(default=50.0, description="Радиус поиска ближайших курьеров от клиники, км")
+    COURIER_LOCATION_TTL: int = Field(default=3600, description="Сколько секунд считать последнюю геолокацию курьера актуальной")
+    COURIER_ROUTE_CAPACITY: int = Field(default=8, description="Максимум заказов в доставке у одного курьера при распределении маршрутов")
+    COURIER_INSERT_MAX_DETOUR_KM: float = Field(default=3.0, description="Предлагать готовый заказ курьеру в пути, если крюк ради него не больше, км")
+    WAREHOUSE_LAT: Optional[float] = Field(default=None, description="Широта склада (узел матрицы расстояний между клиниками)")
+    WAREHOUSE_LON: Optional[float] = Field(default=None, description="Долгота склада")
+    ROAD_GRAPH_PATH: Optional[str] = Field(default=None, description="Файл офлайн-графа дорог .npz (build_road_graph.py); пусто — расстояния по прямой")
+    ROAD_SNAP_MAX_KM: float = Field(default=0.5, description="Максимальное расстояние от точки до дороги графа, км (дальше — по прямой)")
+    ROAD_PAIR_CACHE_SIZE: int = Field(default=200000, description="Сколько пар узлов графа держать в кеше расстояний")
+    COURIER_URGENT_DELIVERY_MIN: int = Field(default=90, description="За сколько минут от создания нужно доставить срочный заказ (окно для порядка маршрута)")
     
     # Printer (Xprinter)
     PRINTER_ENABLED: bool = Field(default=False, description="Включить автоматическую печать этикеток")
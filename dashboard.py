@@ -6,14 +6,14 @@ from fastapi import FastAPI, Request
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
+from sqlalchemy import case, select, func
 from datetime import datetime, timedelta
 import json
 from pathlib import Path
 
 from config import config
 from database.core import session_maker
-from database.models import User, Order, OrderItem, Clinic, OrderStatus, UserRole, DeliveryType
+from database.models import User, Order, OrderItem, Clinic, OrderStatus, UserRole, DeliveryType, OrderSla
 
 # Создаем FastAPI приложение
 app = FastAPI(title="Megagen Bot Dashboard")
@@ -30,6 +30,52 @@ async def get_db():
         yield session
 
 
+async def get_sla_summary(session: AsyncSession, days: int = 7) -> dict:
+    """
+    Средние SLA-тайминги (в минутах) из материализованной таблицы order_sla.
+    Один агрегирующий запрос по индексу created_ts, без сканирования orders.
+    Доставка курьером и такси — раздельно: у такси нет этапов «готов к выдаче»
+    и «в доставке», его delivery_s — от начала сборки до отправки такси.
+    """
+    since_ts = (datetime.now() - timedelta(days=days)).timestamp()
+    is_taxi = OrderSla.delivery_type == DeliveryType.TAXI
+    row = (await session.execute(
+        select(
+            func.count(OrderSla.order_id),
+            func.count(OrderSla.delivered_ts),
+            func.avg(OrderSla.queue_wait_s),
+            func.avg(OrderSla.assembly_s),
+            func.avg(OrderSla.pickup_wait_s),
+            func.avg(case((~is_taxi, OrderSla.delivery_s))),
+            func.avg(OrderSla.total_s),
+            func.count(case((is_taxi, OrderSla.order_id))),
+            func.count(case((is_taxi, OrderSla.delivered_ts))),
+            func.avg(case((is_taxi, OrderSla.delivery_s))),
+            func.avg(case((is_taxi, OrderSla.total_s))),
+        ).where(OrderSla.created_ts >= since_ts)
+    )).one()
+
+    def _minutes(seconds):
+        return round(seconds / 60, 1) if seconds is not None else None
+
+    return {
+        "days": days,
+        "orders": row[0] or 0,
+        "delivered": row[1] or 0,
+        "queue_wait_min": _minutes(row[2]),
+        "assembly_min": _minutes(row[3]),
+        "pickup_wait_min": _minutes(row[4]),
+        "delivery_min": _minutes(row[5]),
+        "total_min": _minutes(row[6]),
+        "taxi": {
+            "orders": row[7] or 0,
+            "delivered": row[8] or 0,
+            "delivery_min": _minutes(row[9]),
+            "total_min": _minutes(row[10]),
+        },
+    }
+
+
 @app.get("/", response_class=HTMLResponse)
 async def dashboard(request: Request):
     """Главная страница дашборда"""
@@ -103,6 +149,9 @@ async def dashboard(request: Request):
         for date, count in orders_by_day_result:
             daily_stats[str(date)] = count
         
+        # SLA за 7 дней (предрассчитано в order_sla)
+        sla = await get_sla_summary(session, days=7)
+        
         return templates.TemplateResponse("dashboard.html", {
             "request": request,
             "total_orders": total_orders or 0,
@@ -116,6 +165,7 @@ async def dashboard(request: Request):
             "recent_orders": recent_orders_list,
             "status_stats": json.dumps(status_data),
             "daily_stats": json.dumps(daily_stats),
+            "sla": sla,
         })
 
 
@@ -152,6 +202,51 @@ async def get_stats():
         return stats
 
 
+@app.get("/api/sla")
+async def get_sla(days: int = 7):
+    """API endpoint для SLA-таймингов заказов (средние значения, минуты)"""
+    async with session_maker() as session:
+        return await get_sla_summary(session, days=days)
+
+
+_metrics_redis = None
+
+
+async def _get_metrics_redis():
+    """Клиент Redis для счётчиков бота (None — Redis недоступен)."""
+    global _metrics_redis
+    if _metrics_redis is None:
+        try:
+            import redis.asyncio as redis
+            client = redis.Redis(
+                host=config.REDIS_HOST,
+                port=config.REDIS_PORT,
+                db=config.REDIS_DB,
+                password=config.REDIS_PASSWORD,
+            )
+            await client.ping()
+            _metrics_redis = client
+        except Exception:
+            return None
+    return _metrics_redis
+
+
+@app.get("/api/metrics")
+async def get_metrics():
+    """API endpoint для счётчиков бота (services.metrics, сумма по инстансам)"""
+    from services import metrics
+    client = await _get_metrics_redis()
+    if client is None:
+        return {"available": False, "counters": {}}
+    counters = await metrics.read(client)
+    total = counters.get("updates_total", 0)
+    return {
+        "available": True,
+        "counters": counters,
+        "db_share": round(counters.get("updates_db", 0) / total, 3) if total else None,
+    }
+
+
 @app.get("/api/orders")
 async def get_orders(limit: int = 50, status: str = None):
     """API endpoint для получения списка заказов"""
@@ -2,7 +2,7 @@ import enum
 from datetime import datetime
 from typing import Optional, List
 
-from sqlalchemy import BigInteger, Integer, String, Boolean, ForeignKey, DateTime, Float, Enum as PgEnum, Index, func
+from sqlalchemy import BigInteger, Integer, String, Boolean, ForeignKey, DateTime, Float, Enum as PgEnum, Index, func, text
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from database.core import Base
@@ -66,10 +66,34 @@ class Clinic(Base):
     navigator_link: Mapped[str] = mapped_column(String, nullable=False)
     
     __table_args__ = (
+        # Поиск курьера в радиусе: geo_lat BETWEEN ... AND geo_lon BETWEEN ...
+        Index("ix_clinics_geo_lat_geo_lon", "geo_lat", "geo_lon"),
         {"comment": "Клиники"},
     )
 
 
+class ClinicDistance(Base):
+    """
+    Матрица расстояний между клиниками и складом (services.clinic_matrix).
+
+    Одна строка на неупорядоченную пару: from_id < to_id. Склад — узел 0
+    (id клиник начинаются с 1), поэтому без внешних ключей. Пересчитывается
+    по строке клиники при её создании или смене координат.
+    """
+    __tablename__ = "clinic_distances"
+
+    from_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    to_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    km: Mapped[float] = mapped_column(Float, nullable=False)
+    minutes: Mapped[float] = mapped_column(Float, nullable=False)
+
+    __table_args__ = (
+        # Удаление строк клиники: WHERE from_id = :id OR to_id = :id
+        Index("ix_clinic_distances_to_id", "to_id"),
+        {"comment": "Расстояния между клиниками и складом"},
+    )
+
+
 class Order(Base):
     __tablename__ = "orders"
 
@@ -87,14 +111,25 @@ class Order(Base):
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False, index=True)
     assembled_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
     delivered_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+    # Версия строки: +1 при каждой смене статуса/позиций (ключ кеша карточек заказа)
+    version: Mapped[int] = mapped_column(Integer, default=1, server_default="1", nullable=False)
 
     # Relationships
     manager: Mapped["User"] = relationship("User", foreign_keys=[manager_id])
     courier: Mapped[Optional["User"]] = relationship("User", foreign_keys=[courier_id])
     clinic: Mapped["Clinic"] = relationship("Clinic")
     items: Mapped[List["OrderItem"]] = relationship("OrderItem", back_populates="order", cascade="all, delete-orphan")
+    sla: Mapped[Optional["OrderSla"]] = relationship("OrderSla", uselist=False, viewonly=True)
     
     __table_args__ = (
+        # Поиск курьера: status = READY_FOR_PICKUP AND delivery_type = COURIER
+        Index("ix_orders_status_delivery_type", "status", "delivery_type"),
+        # Поиск курьера в радиусе: клиники из квадрата -> их готовые заказы
+        Index("ix_orders_clinic_id_status_delivery_type", "clinic_id", "status", "delivery_type"),
+        # История менеджера: keyset по (created_at, id) внутри manager_id
+        Index("ix_orders_manager_id_created_at", "manager_id", "created_at", "id"),
+        # Очередь склада: status IN (NEW, ASSEMBLY) ORDER BY is_urgent DESC, created_at
+        Index("ix_orders_status_is_urgent_created_at", "status", "is_urgent", "created_at"),
         {"comment": "Заказы"},
     )
 
@@ -103,7 +138,7 @@ class OrderItem(Base):
     __tablename__ = "order_items"
 
     id: Mapped[int] = mapped_column(PK_INT, primary_key=True, autoincrement=True)
-    order_id: Mapped[int] = mapped_column(ForeignKey("orders.id"), nullable=False)
+    order_id: Mapped[int] = mapped_column(ForeignKey("orders.id"), nullable=False, index=True)
     # Note: Requirements specify 'sku', but using 'item_sku' to avoid conflicts with Python's built-in
     # The field is correctly mapped in handlers (item['sku'] -> item_sku)
     item_sku: Mapped[str] = mapped_column(String, nullable=False)
@@ -116,6 +151,66 @@ class OrderItem(Base):
 
     order: Mapped["Order"] = relationship("Order", back_populates="items")
 
+    __table_args__ = (
+        # Частичный индекс: позиции, ждущие замену (раздел «Замены» менеджера)
+        Index(
+            "ix_order_items_pending_replacement",
+            "order_id",
+            postgresql_where=text("need_replacement AND replacement_sku IS NULL"),
+            sqlite_where=text("need_replacement = 1 AND replacement_sku IS NULL"),
+        ),
+    )
+
+
+class OrderEvent(Base):
+    """Журнал переходов статусов заказа (только добавление, без UPDATE/DELETE)."""
+    __tablename__ = "order_events"
+
+    id: Mapped[int] = mapped_column(PK_INT, primary_key=True, autoincrement=True)
+    order_id: Mapped[int] = mapped_column(ForeignKey("orders.id"), nullable=False)
+    # NULL — создание заказа или переход из нескольких допустимых статусов
+    from_status: Mapped[Optional[OrderStatus]] = mapped_column(PgEnum(OrderStatus, name="order_status_enum"), nullable=True)
+    to_status: Mapped[OrderStatus] = mapped_column(PgEnum(OrderStatus, name="order_status_enum"), nullable=False)
+    # Кто выполнил переход (telegram_id — известен в хендлере без запроса к users)
+    actor_telegram_id: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    __table_args__ = (
+        Index("ix_order_events_order_id_created_at", "order_id", "created_at"),
+        {"comment": "Журнал событий заказов"},
+    )
+
+
+class OrderSla(Base):
+    """
+    Материализованные SLA-тайминги заказа (одна строка на заказ).
+
+    Метки времени хранятся в секундах Unix (Float), чтобы длительности
+    считались одинаково в PostgreSQL и SQLite: SET assembly_s = :ts - assembly_started_ts.
+    """
+    __tablename__ = "order_sla"
+
+    order_id: Mapped[int] = mapped_column(ForeignKey("orders.id"), primary_key=True)
+    is_urgent: Mapped[bool] = mapped_column(Boolean, default=False, nullable=False)
+    delivery_type: Mapped[DeliveryType] = mapped_column(PgEnum(DeliveryType, name="delivery_type_enum"), nullable=False)
+
+    created_ts: Mapped[float] = mapped_column(Float, nullable=False, index=True)
+    assembly_started_ts: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    ready_ts: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    pickup_ts: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    delivered_ts: Mapped[Optional[float]] = mapped_column(Float, nullable=True, index=True)
+
+    # Длительности этапов, секунды
+    queue_wait_s: Mapped[Optional[float]] = mapped_column(Float, nullable=True)   # NEW -> ASSEMBLY
+    assembly_s: Mapped[Optional[float]] = mapped_column(Float, nullable=True)     # ASSEMBLY -> READY_FOR_PICKUP
+    pickup_wait_s: Mapped[Optional[float]] = mapped_column(Float, nullable=True)  # READY_FOR_PICKUP -> DELIVERING
+    delivery_s: Mapped[Optional[float]] = mapped_column(Float, nullable=True)     # DELIVERING -> DELIVERED
+    total_s: Mapped[Optional[float]] = mapped_column(Float, nullable=True)        # создание -> DELIVERED
+
+    __table_args__ = (
+        {"comment": "SLA-тайминги заказов (rollup)"},
+    )
+
 
 class CatalogItem(Base):
     """Плоская таблица каталога — единый источник товаров, остатков, навигации."""
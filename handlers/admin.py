@@ -16,6 +16,7 @@ from keyboards.admin_kbs import (
     get_admin_menu_kb,
     get_user_manage_kb,
     get_user_delete_confirm_kb,
+    get_users_next_page_kb,
 )
 from keyboards.manager_kbs import get_manager_menu_kb
 from keyboards.warehouse_kbs import get_warehouse_menu_kb
@@ -28,6 +29,7 @@ from database.models import Order
 from database.models import User
 from keyboards.admin_kbs import get_role_assignment_kb
 from services.cache import user_cache
+from services.pagination import invalidate_count
 
 logger = logging.getLogger(__name__)
 router = Router()
@@ -343,30 +345,26 @@ async def process_edit_chat_id(message: types.Message, state: FSMContext, sessio
 
 # --- Main Menu Handlers ---
 @router.callback_query(F.data == "admin:users")
+@router.callback_query(F.data.startswith("admin:users:n:"))
 async def admin_menu_users(callback: types.CallbackQuery, session: AsyncSession):
-    """Показать список пользователей с пагинацией."""
+    """Показать список пользователей с пагинацией (keyset по id, новые сверху)."""
     if not is_admin(callback.from_user.id):
         await callback.answer("Вы не администратор.", show_alert=True)
         return
 
-    # Защита: нельзя менять/удалять пользователей, которые используются как Chat ID врача клиники
-    protected_result = await session.execute(
-        select(Clinic.telegram_chat_id, Clinic.name).where(Clinic.telegram_chat_id.is_not(None))
+    from services.pagination import keyset_page, cached_count
+    cursor = None
+    if callback.data.startswith("admin:users:n:"):
+        cursor = callback.data.split(":", 3)[3]
+
+    page = await keyset_page(
+        session,
+        select(User.id, User.telegram_id, User.full_name, User.role, User.is_active),
+        (User.id,),
+        per_page=config.USERS_PER_PAGE,
+        cursor=cursor,
     )
-    protected_map = {int(chat_id): clinic_name for chat_id, clinic_name in protected_result.all() if chat_id is not None}
-
-    # Пагинация
-    from config import config
-    from sqlalchemy import func
-    page_size = config.USERS_PER_PAGE
-    
-    # Подсчет общего количества
-    total_count = await session.scalar(select(func.count(User.id)))
-    
-    # Загружаем только первую страницу
-    stmt = select(User).order_by(User.id.desc()).limit(page_size)
-    result = await session.execute(stmt)
-    users = list(result.scalars().all())
+    users = page.rows
 
     if not users:
         try:
@@ -380,22 +378,32 @@ async def admin_menu_users(callback: types.CallbackQuery, session: AsyncSession)
         await callback.answer()
         return
 
-    pending_count = sum(1 for u in users if not u.is_active)
-    protected_count = sum(1 for u in users if u.telegram_id in protected_map)
-
-    header = (
-        "👥 Управление пользователями\n\n"
-        f"Всего: {total_count}\n"
-        f"Показано: {len(users)}\n"
-        f"Ожидают активации: {pending_count}\n"
-        f"Защищены (врач клиники): {protected_count}\n\n"
-        "Карточки ниже: данные, роль. Можно менять роль, исключать или удалять."
+    # Защита: нельзя менять/удалять пользователей, которые используются как Chat ID врача клиники
+    protected_result = await session.execute(
+        select(Clinic.telegram_chat_id, Clinic.name).where(
+            Clinic.telegram_chat_id.in_([u.telegram_id for u in users])
+        )
     )
-    try:
-        await callback.message.edit_text(header, reply_markup=get_admin_menu_kb())
-    except TelegramBadRequest as e:
-        if "message is not modified" not in str(e):
-            raise
+    protected_map = {int(chat_id): clinic_name for chat_id, clinic_name in protected_result.all() if chat_id is not None}
+
+    if cursor is None:
+        total_count = await cached_count(session, "admin_users", select(User.id))
+        pending_count = sum(1 for u in users if not u.is_active)
+        protected_count = sum(1 for u in users if u.telegram_id in protected_map)
+
+        header = (
+            "👥 Управление пользователями\n\n"
+            f"Всего: {total_count}\n"
+            f"Показано: {len(users)}\n"
+            f"Ожидают активации: {pending_count}\n"
+            f"Защищены (врач клиники): {protected_count}\n\n"
+            "Карточки ниже: данные, роль. Можно менять роль, исключать или удалять."
+        )
+        try:
+            await callback.message.edit_text(header, reply_markup=get_admin_menu_kb())
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                raise
 
     for u in users:
         is_protected = u.telegram_id in protected_map
@@ -403,6 +411,11 @@ async def admin_menu_users(callback: types.CallbackQuery, session: AsyncSession)
         text = _format_user_card(u, clinic_name=clinic_name)
         kb = get_user_manage_kb(u.telegram_id, is_protected=is_protected, is_active=u.is_active)
         await callback.message.answer(text, reply_markup=kb)
+    if page.next_cursor:
+        await callback.message.answer(
+            f"Страница {page.page + 1}. Показать следующих пользователей?",
+            reply_markup=get_users_next_page_kb(page.next_cursor),
+        )
     await callback.answer()
 
 
@@ -446,11 +459,7 @@ async def manage_user_callback(callback: types.CallbackQuery, callback_data: Use
         user.is_active = True  # при смене роли автоматически активируем
         await session.commit()
         await session.refresh(user)
-        if user_cache is not None:
-            try:
-                await user_cache.invalidate(user_telegram_id)
-            except Exception:
-                pass
+        await user_cache.invalidate(user_telegram_id)
         try:
             await callback.message.edit_text(
                 _format_user_card(user),
@@ -466,11 +475,7 @@ async def manage_user_callback(callback: types.CallbackQuery, callback_data: Use
         user.is_active = not bool(user.is_active)
         await session.commit()
         await session.refresh(user)
-        if user_cache is not None:
-            try:
-                await user_cache.invalidate(user_telegram_id)
-            except Exception:
-                pass
+        await user_cache.invalidate(user_telegram_id)
         try:
             await callback.message.edit_text(
                 _format_user_card(user),
@@ -514,11 +519,7 @@ async def manage_user_callback(callback: types.CallbackQuery, callback_data: Use
             user.is_active = False
             await session.commit()
             await session.refresh(user)
-            if user_cache is not None:
-                try:
-                    await user_cache.invalidate(user_telegram_id)
-                except Exception:
-                    pass
+            await user_cache.invalidate(user_telegram_id)
             try:
                 await callback.message.edit_text(
                     _format_user_card(user),
@@ -532,11 +533,8 @@ async def manage_user_callback(callback: types.CallbackQuery, callback_data: Use
 
         await session.delete(user)
         await session.commit()
-        if user_cache is not None:
-            try:
-                await user_cache.invalidate(user_telegram_id)
-            except Exception:
-                pass
+        invalidate_count("admin_users")
+        await user_cache.invalidate(user_telegram_id)
         await callback.answer("Пользователь удалён", show_alert=True)
         try:
             await callback.message.edit_text("🗑 Пользователь удалён.")
@@ -626,7 +624,8 @@ async def admin_menu_reports(callback: types.CallbackQuery, session: AsyncSessio
         .options(
             selectinload(Order.clinic),
             selectinload(Order.manager),
-            selectinload(Order.items)
+            selectinload(Order.items),
+            selectinload(Order.sla)
         )
         .order_by(Order.created_at.desc())
     )
@@ -774,7 +773,8 @@ async def cmd_report(message: types.Message, session: AsyncSession):
         .options(
             selectinload(Order.clinic),
             selectinload(Order.manager),
-            selectinload(Order.items)
+            selectinload(Order.items),
+            selectinload(Order.sla)
         )
         .order_by(Order.created_at.desc())
     )
@@ -1,22 +1,32 @@
 from datetime import datetime, timezone
+from typing import Optional
 from aiogram import Router, types, F
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
-from sqlalchemy import select
-from sqlalchemy.orm import selectinload
+from sqlalchemy import select, func
+from sqlalchemy.orm import contains_eager, selectinload
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from database.models import User, UserRole, Order, OrderStatus, DeliveryType, Clinic
+from database.models import UserRole, Order, OrderStatus, DeliveryType, Clinic
 from config import config
-from services.db_ops import get_user_by_telegram_id, check_role
+from services.db_ops import check_role
+from services.cache import CachedUser
+from services.order_service import OrderService
+from services.courier_locations import courier_locations
+from services.clinic_matrix import clinic_matrix
+from services.active_routes import RouteStop, active_routes
+from services.route_store import StoredRoute, StoredStop, route_store
 from services.routing import (
+    bounding_box,
+    haversine_matrix,
     optimize_route_with_clusters,
     generate_yandex_maps_url,
     haversine_distance,
+    travel_minutes,
 )
 from keyboards.courier_kbs import (
     get_courier_reply_kb, get_route_action_kb, get_delivery_kb,
-    get_single_orders_kb, get_combined_delivery_kb, get_courier_select_orders_kb,
+    get_single_orders_kb, get_combined_delivery_kb, get_courier_select_orders_kb, get_route_url_kb,
 )
 from states.courier_states import CourierState
 
@@ -25,6 +35,16 @@ MAX_RADIUS_KM = 50
 
 router = Router()
 
+def _urgency(order: Order, now: datetime) -> dict:
+    """Приоритет и окно доставки заказа для маршрута (только срочные)."""
+    if not order.is_urgent:
+        return {}
+    created = order.created_at
+    if created.tzinfo is None:
+        created = created.replace(tzinfo=timezone.utc)
+    waited_min = (now - created).total_seconds() / 60
+    return {'priority': 1.0, 'due_min': config.COURIER_URGENT_DELIVERY_MIN - waited_min}
+
 async def is_courier(user_id: int, session: AsyncSession) -> bool:
     """Проверка прав курьера (делегирует в единую check_role)."""
     return await check_role(session, user_id, UserRole.COURIER)
@@ -155,6 +175,8 @@ async def process_location_search(message: types.Message, state: FSMContext, ses
 
     lat = message.location.latitude
     lon = message.location.longitude
+    # Последняя точка курьера — для адресной рассылки готовых заказов
+    courier_locations.update(message.from_user.id, lat, lon)
     data = await state.get_data()
     selected_ids = data.get("selected_order_ids") or []
 
@@ -173,27 +195,41 @@ async def process_location_search(message: types.Message, state: FSMContext, ses
         orders = result.scalars().all()
         await state.update_data(selected_order_ids=[])
     else:
-        # Старое поведение: все заказы в радиусе
+        # Все заказы в радиусе: из БД — только попавшие в описанный квадрат,
+        # точный радиус — ниже, векторно. Клиники квадрата выбираются
+        # подзапросом по индексу координат, заказы к ним — по индексу
+        # (clinic_id, status, delivery_type); при обычном JOIN планировщик
+        # начинает с заказов по статусу и индекс координат не использует.
+        lat_min, lat_max, lon_min, lon_max = bounding_box(lat, lon, MAX_RADIUS_KM)
+        clinics_in_box = select(Clinic.id).where(
+            Clinic.geo_lat.between(lat_min, lat_max),
+            Clinic.geo_lon.between(lon_min, lon_max),
+        )
         stmt = (
             select(Order)
-            .options(selectinload(Order.clinic))
+            .join(Clinic, Clinic.id == Order.clinic_id)
+            .options(contains_eager(Order.clinic))
             .where(
+                Order.clinic_id.in_(clinics_in_box),
                 Order.status == OrderStatus.READY_FOR_PICKUP,
                 Order.delivery_type == DeliveryType.COURIER
             )
         )
         result = await session.execute(stmt)
         orders = result.scalars().all()
-
-    if not orders:
-        await message.answer("Нет заказов, готовых к выдаче (курьерская доставка).")
-        return
+        # Всего готовых курьерских заказов — для пометки о не вошедших в радиус
+        ready_total = await session.scalar(
+            select(func.count()).select_from(Order).where(
+                Order.status == OrderStatus.READY_FOR_PICKUP,
+                Order.delivery_type == DeliveryType.COURIER
+            )
+        )
 
     # Prepare data for routing; for pre-selected orders skip radius filter
     orders_map = []
-    filtered_count = 0
-    for o in orders:
-        distance = haversine_distance(lat, lon, o.clinic.geo_lat, o.clinic.geo_lon)
+    now = datetime.now(timezone.utc)
+    distances = haversine_matrix((lat, lon), [(o.clinic.geo_lat, o.clinic.geo_lon) for o in orders])[0]
+    for o, distance in zip(orders, distances.tolist()):
         if selected_ids or distance <= MAX_RADIUS_KM:
             orders_map.append({
                 'id': o.id,
@@ -201,10 +237,12 @@ async def process_location_search(message: types.Message, state: FSMContext, ses
                 'lon': o.clinic.geo_lon,
                 'clinic_name': o.clinic.name,
                 'distance': distance,
-                'obj': o
+                'obj': o,
+                **_urgency(o, now),
             })
-        else:
-            filtered_count += 1
+
+    # Заказы вне радиуса из БД не читались — их число выводим из общего
+    filtered_count = 0 if selected_ids else ready_total - len(orders_map)
 
     if not orders_map:
         if filtered_count > 0:
@@ -217,13 +255,14 @@ async def process_location_search(message: types.Message, state: FSMContext, ses
         return
     
     # Кластеризация: групповой маршрут (близкие точки) + отдельные (вдали 8+ км)
-    grouped_route, distant_orders, total_grouped_dist = await optimize_route_with_clusters(
-        (lat, lon), orders_map
+    route = await optimize_route_with_clusters(
+        (lat, lon), orders_map,
+        stop_dist=clinic_matrix.submatrix([item['obj'].clinic_id for item in orders_map]),
     )
+    grouped_route, distant_orders, total_grouped_dist = route.grouped, route.distant, route.total_km
 
     grouped_ids = [item['id'] for item in grouped_route]
     distant_ids = [item['id'] for item in distant_orders]
-    all_ids = grouped_ids + distant_ids
 
     map_url = generate_yandex_maps_url(grouped_route) if grouped_route else None
 
@@ -233,119 +272,131 @@ async def process_location_search(message: types.Message, state: FSMContext, ses
         text_parts.append(
             f"📍 *Маршрут по близким точкам* ({len(grouped_route)} заказов, ~{dist_str} км)\n"
         )
-        for idx, item in enumerate(grouped_route, 1):
+        if route.saved_km >= 0.1:
+            text_parts.append(f"_Оптимизация сократила путь на {route.saved_km:.1f} км_\n")
+        if route.late:
+            text_parts.append(f"⏰ Не успеваем к сроку срочных: {route.late}\n")
+        for idx, (item, eta) in enumerate(zip(grouped_route, route.eta_min), 1):
             icon = "🔥" if item.get('obj') and item['obj'].is_urgent else "🟢"
-            text_parts.append(f"{idx}. {icon} {item['clinic_name']} (#{item['id']})\n")
+            text_parts.append(f"{idx}. {icon} {item['clinic_name']} (#{item['id']}) — ~{eta:.0f} мин\n")
 
     if distant_orders:
         text_parts.append(f"\n📦 *Отдельные заказы (вдали 8+ км)*\n")
         for item in distant_orders:
             icon = "🔥" if item.get('obj') and item['obj'].is_urgent else "🟢"
             dist_to = haversine_distance(lat, lon, item['lat'], item['lon'])
-            text_parts.append(f"• {icon} {item['clinic_name']} (#{item['id']}) — {dist_to:.1f} км\n")
+            text_parts.append(
+                f"• {icon} {item['clinic_name']} (#{item['id']}) — {dist_to:.1f} км, ~{travel_minutes(dist_to):.0f} мин\n"
+            )
 
     if filtered_count > 0:
         text_parts.append(f"\n⚠️ {filtered_count} заказов вне радиуса не включены.")
 
     text = "".join(text_parts)
 
-    route_data = grouped_route + distant_orders
-    await state.update_data(
-        sorted_order_ids=all_ids,
-        grouped_order_ids=grouped_ids,
-        distant_order_ids=distant_ids,
-        route_data=route_data,
-    )
+    # В FSM — только id маршрута, остановки — в services.route_store
+    route_id = await route_store.save(message.from_user.id, StoredRoute(
+        [StoredStop.from_item(item) for item in grouped_route],
+        [StoredStop.from_item(item) for item in distant_orders],
+    ))
+    await state.update_data(route_id=route_id)
 
     await message.answer(text, reply_markup=get_route_action_kb(
         route_url=map_url,
         grouped_ids=grouped_ids,
         distant_ids=distant_ids,
+        route_id=route_id,
     ), parse_mode="Markdown")
     await state.set_state(CourierState.viewing_route)
 
+@router.edited_message(F.location)
+async def track_live_location(message: types.Message, session: AsyncSession):
+    """Обновления трансляции геолокации (live location) — только запоминаем точку."""
+    if not await is_courier(message.from_user.id, session):
+        return
+    courier_locations.update(message.from_user.id, message.location.latitude, message.location.longitude)
+
 @router.callback_query(F.data == "take_route", CourierState.viewing_route)
-async def take_route(callback: types.CallbackQuery, state: FSMContext, session: AsyncSession):
+async def take_route(callback: types.CallbackQuery, state: FSMContext, session: AsyncSession, identity: Optional[CachedUser] = None):
     data = await state.get_data()
-    ids = data.get('grouped_order_ids') or data.get('sorted_order_ids', [])
+    route = await route_store.get(callback.from_user.id, data.get('route_id'))
+    ids = ([s.order_id for s in route.grouped] or route.order_ids()) if route else []
     
     if not ids:
         await callback.answer("Маршрут устарел.", show_alert=True)
         return
         
-    # Update statuses to DELIVERING
-    # Also assign courier_id? The model has courier_id.
-    user_result = await session.execute(select(User).where(User.telegram_id == callback.from_user.id))
-    courier_user = user_result.scalar_one()
-    
-    # Батчинг: обновляем все заказы, затем один commit
-    for order_id in ids:
-        stmt = select(Order).where(Order.id == order_id)
-        res = await session.execute(stmt)
-        order = res.scalar_one()
-        
-        # Ensure status is still correct
-        if order.status == OrderStatus.READY_FOR_PICKUP:
-            old_status = order.status
-            order.status = OrderStatus.DELIVERING
-            order.courier_id = courier_user.id
+    if identity is None:
+        await callback.answer("Ошибка: курьер не найден", show_alert=True)
+        return
     
+    # Один UPDATE ... RETURNING на весь маршрут (SKIP LOCKED на Postgres)
+    claimed_ids = set(await OrderService.claim_for_courier(
+        session, ids, identity.id, actor_telegram_id=callback.from_user.id
+    ))
     await session.commit()
+
+    if not claimed_ids:
+        await callback.answer("Заказы маршрута уже взяты другим курьером.", show_alert=True)
+        return
+
+    # Один SELECT для уведомлений и карточек (clinic и manager — без lazy load)
+    orders = await OrderService.load_orders(session, [oid for oid in ids if oid in claimed_ids])
+    active_routes.add(callback.from_user.id, [RouteStop.from_order(o) for o in orders])
     
-    # Уведомляем менеджеров о всех заказах (clinic и manager нужны для notify — без lazy load)
     from services.notifications import notify_manager_about_order_status
-    for order_id in ids:
-        stmt = select(Order).options(
-            selectinload(Order.clinic), selectinload(Order.manager)
-        ).where(Order.id == order_id)
-        res = await session.execute(stmt)
-        order = res.scalar_one_or_none()
-        if order and order.status == OrderStatus.DELIVERING:
-            await notify_manager_about_order_status(
-                callback.bot, order, OrderStatus.READY_FOR_PICKUP, OrderStatus.DELIVERING, session
-            )
+    for order in orders:
+        await notify_manager_about_order_status(
+            callback.bot, order, OrderStatus.READY_FOR_PICKUP, OrderStatus.DELIVERING, session
+        )
     
-    await callback.message.edit_text("✅ Вы взяли маршрут! Удачной дороги.")
+    text = "✅ Вы взяли маршрут! Удачной дороги."
+    if len(claimed_ids) < len(ids):
+        text += f"\n\n⚠️ {len(ids) - len(claimed_ids)} зак. уже взяты другим курьером и исключены."
+    await callback.message.edit_text(text)
     
-    # Show list of active deliveries with "Delivered" buttons
-    # We could send separate messages or a list. 
-    # Let's send a message for each order to allow individual closing.
-    await send_delivery_cards(callback.message, ids, session)
+    # Отдельная карточка на каждый заказ, чтобы закрывать их по одному
+    await send_delivery_cards(callback.message, orders)
     await state.set_state(CourierState.delivering)
 
-async def send_delivery_cards(message: types.Message, order_ids: list, session: AsyncSession):
+def _delivery_card_text(order: Order, route_number: int | None = None, header: str | None = None) -> str:
+    """Текст карточки заказа в доставке."""
+    if header is None:
+        header = f"📦 *Заказ #{order.id}*"
+        if route_number:
+            header += f" (№{route_number} в маршруте)"
+    info = (
+        f"{header}\n\n"
+        f"🏥 *Клиника:* {order.clinic.name}\n"
+        f"📍 *Адрес:* {order.clinic.address}"
+    )
+    if order.is_urgent:
+        info += "\n\n🔥 *СРОЧНЫЙ ЗАКАЗ*"
+    return info
+
+
+def _navigator_url(order: Order) -> str:
+    """Ссылка на навигатор до клиники заказа."""
+    return order.clinic.navigator_link if order.clinic.navigator_link else (
+        f"https://yandex.ru/maps/?pt={order.clinic.geo_lon},{order.clinic.geo_lat}&z=16"
+    )
+
+
+async def send_delivery_cards(message: types.Message, orders: list[Order]):
     """Отправка карточек заказов с номерами в маршруте, навигатором и кнопкой завершения"""
-    for idx, order_id in enumerate(order_ids, 1):
-        stmt = select(Order).options(selectinload(Order.clinic)).where(Order.id == order_id)
-        res = await session.execute(stmt)
-        order = res.scalar_one_or_none()
-        if order:
-            # Генерируем ссылку на навигатор для этого заказа
-            nav_url = order.clinic.navigator_link if order.clinic.navigator_link else (
-                f"https://yandex.ru/maps/?pt={order.clinic.geo_lon},{order.clinic.geo_lat}&z=16"
-            )
-            
-            info = (
-                f"📦 *Заказ #{order.id}* (№{idx} в маршруте)\n\n"
-                f"🏥 *Клиника:* {order.clinic.name}\n"
-                f"📍 *Адрес:* {order.clinic.address}"
-            )
-            if order.is_urgent:
-                info += "\n\n🔥 *СРОЧНЫЙ ЗАКАЗ*"
-            
-            await message.answer(
-                info, 
-                reply_markup=get_delivery_kb(order.id, nav_url, idx, len(order_ids)), 
-                parse_mode="Markdown"
-            )
+    for idx, order in enumerate(orders, 1):
+        await message.answer(
+            _delivery_card_text(order, idx),
+            reply_markup=get_delivery_kb(order.id, _navigator_url(order), idx, len(orders)),
+            parse_mode="Markdown"
+        )
 
 @router.callback_query(F.data == "show_distant_orders")
 async def show_distant_orders(callback: types.CallbackQuery, state: FSMContext):
     """Показать список отдельно доставляемых заказов (вдали 8+ км)"""
     data = await state.get_data()
-    order_ids = data.get('distant_order_ids', [])
-    route_data = data.get('route_data', [])
-    order_id_to_urgent = {item['id']: getattr(item.get('obj'), 'is_urgent', False) for item in route_data if 'obj' in item}
+    route = await route_store.get(callback.from_user.id, data.get('route_id'))
+    order_ids = [s.order_id for s in route.distant] if route else []
 
     if not order_ids:
         await callback.answer("Нет отдельных заказов", show_alert=True)
@@ -354,7 +405,7 @@ async def show_distant_orders(callback: types.CallbackQuery, state: FSMContext):
     await callback.message.edit_text(
         "📦 *Отдельные заказы (вдали 8+ км)*\n\nВыберите заказ для принятия:",
         parse_mode="Markdown",
-        reply_markup=get_single_orders_kb(order_ids, order_id_to_urgent)
+        reply_markup=get_single_orders_kb(order_ids, route.urgency())
     )
     await callback.answer()
 
@@ -363,9 +414,8 @@ async def show_distant_orders(callback: types.CallbackQuery, state: FSMContext):
 async def show_single_orders(callback: types.CallbackQuery, state: FSMContext):
     """Показать список всех заказов по отдельности"""
     data = await state.get_data()
-    order_ids = data.get('sorted_order_ids', [])
-    route_data = data.get('route_data', [])
-    order_id_to_urgent = {item['id']: getattr(item.get('obj'), 'is_urgent', False) for item in route_data if 'obj' in item}
+    route = await route_store.get(callback.from_user.id, data.get('route_id'))
+    order_ids = route.order_ids() if route else []
     
     if not order_ids:
         await callback.answer("Заказы не найдены", show_alert=True)
@@ -374,59 +424,46 @@ async def show_single_orders(callback: types.CallbackQuery, state: FSMContext):
     await callback.message.edit_text(
         "📦 *Отдельные заказы*\n\nВыберите заказ для принятия:",
         parse_mode="Markdown",
-        reply_markup=get_single_orders_kb(order_ids, order_id_to_urgent)
+        reply_markup=get_single_orders_kb(order_ids, route.urgency())
     )
     await callback.answer()
 
 @router.callback_query(F.data.startswith("take_single_order:"))
-async def take_single_order(callback: types.CallbackQuery, session: AsyncSession, state: FSMContext):
+async def take_single_order(callback: types.CallbackQuery, session: AsyncSession, state: FSMContext, identity: Optional[CachedUser] = None):
     """Принять отдельный заказ"""
     order_id = int(callback.data.split(":")[1])
     
-    user_result = await session.execute(select(User).where(User.telegram_id == callback.from_user.id))
-    courier_user = user_result.scalar_one_or_none()
-    
-    if not courier_user:
+    if identity is None:
         await callback.answer("Ошибка: курьер не найден", show_alert=True)
         return
     
-    stmt = select(Order).options(
-        selectinload(Order.clinic), selectinload(Order.manager)
-    ).where(Order.id == order_id)
-    res = await session.execute(stmt)
-    order = res.scalar_one_or_none()
-    
-    if not order:
-        await callback.answer("Заказ не найден", show_alert=True)
-        return
+    claimed = await OrderService.claim_for_courier(
+        session, [order_id], identity.id, actor_telegram_id=callback.from_user.id
+    )
+    await session.commit()
     
-    if order.status != OrderStatus.READY_FOR_PICKUP:
+    if not claimed:
         await callback.answer("Заказ уже взят или не готов к выдаче", show_alert=True)
         return
     
-    old_status = order.status
-    order.status = OrderStatus.DELIVERING
-    order.courier_id = courier_user.id
-    await session.commit()
+    orders = await OrderService.load_orders(session, claimed)
+    if not orders:
+        await callback.answer("Заказ не найден", show_alert=True)
+        return
+    order = orders[0]
+    active_routes.add(callback.from_user.id, [RouteStop.from_order(order)])
+    # Взятый заказ больше не предлагается в списках маршрута
+    data = await state.get_data()
+    route = await route_store.get(callback.from_user.id, data.get('route_id'))
+    if route is not None:
+        await route_store.save(callback.from_user.id, route.without([order.id]), data['route_id'])
     
     # Сначала показываем карточку доставки — чтобы курьер мог завершить заказ
     # Уведомление менеджера — после, чтобы ошибка notify не мешала
-    nav_url = order.clinic.navigator_link if order.clinic.navigator_link else (
-        f"https://yandex.ru/maps/?pt={order.clinic.geo_lon},{order.clinic.geo_lat}&z=16"
-    )
-    
-    info = (
-        f"✅ *Заказ #{order.id} взят в доставку*\n\n"
-        f"🏥 *Клиника:* {order.clinic.name}\n"
-        f"📍 *Адрес:* {order.clinic.address}"
-    )
-    if order.is_urgent:
-        info += "\n\n🔥 *СРОЧНЫЙ ЗАКАЗ*"
-    
     await callback.message.edit_text(
-        info, 
+        _delivery_card_text(order, header=f"✅ *Заказ #{order.id} взят в доставку*"),
         parse_mode="Markdown", 
-        reply_markup=get_delivery_kb(order.id, nav_url)
+        reply_markup=get_delivery_kb(order.id, _navigator_url(order))
     )
     await state.set_state(CourierState.delivering)
     await callback.answer()
@@ -435,98 +472,216 @@ async def take_single_order(callback: types.CallbackQuery, session: AsyncSession
     from services.notifications import notify_manager_about_order_status
     try:
         await notify_manager_about_order_status(
-            callback.bot, order, old_status, OrderStatus.DELIVERING, session
+            callback.bot, order, OrderStatus.READY_FOR_PICKUP, OrderStatus.DELIVERING, session
         )
     except Exception:
         pass  # Не блокируем курьера при ошибке уведомления
 
 @router.callback_query(F.data.startswith("take_combined_route:"))
-async def take_combined_route(callback: types.CallbackQuery, session: AsyncSession, state: FSMContext):
+async def take_combined_route(callback: types.CallbackQuery, session: AsyncSession, state: FSMContext, identity: Optional[CachedUser] = None):
     """Принять объединенный маршрут"""
-    order_ids_str = callback.data.split(":")[1]
-    order_ids = [int(id_str) for id_str in order_ids_str.split(",")]
-    
-    user_result = await session.execute(select(User).where(User.telegram_id == callback.from_user.id))
-    courier_user = user_result.scalar_one_or_none()
-    
-    if not courier_user:
+    route = await route_store.get(callback.from_user.id, callback.data.split(":", 1)[1])
+    if route is None or not route.grouped:
+        await callback.answer("Маршрут устарел. Отправьте геолокацию ещё раз.", show_alert=True)
+        return
+    await _take_combined(callback, session, state, [s.order_id for s in route.grouped], identity)
+
+
+@router.callback_query(F.data.startswith("courier:plan:"))
+async def take_planned_route(callback: types.CallbackQuery, session: AsyncSession, state: FSMContext, identity: Optional[CachedUser] = None):
+    """Принять маршрут, построенный складом (services.route_planner)."""
+    route = await route_store.pop(callback.from_user.id, callback.data.split(":", 2)[2])
+    order_ids = route.order_ids() if route else []
+    if not order_ids:
+        await callback.answer("Маршрут устарел или уже взят.", show_alert=True)
+        return
+    await _take_combined(callback, session, state, order_ids, identity)
+
+
+@router.callback_query(F.data.startswith("courier:insert:"))
+async def take_insertion(callback: types.CallbackQuery, session: AsyncSession, state: FSMContext, identity: Optional[CachedUser] = None):
+    """Добавить готовый заказ по пути в текущий маршрут (services.active_routes)."""
+    order_id = int(callback.data.split(":")[2])
+
+    if identity is None:
+        await callback.answer("Ошибка: курьер не найден", show_alert=True)
+        return
+
+    claimed = await OrderService.claim_for_courier(
+        session, [order_id], identity.id, actor_telegram_id=callback.from_user.id
+    )
+    await session.commit()
+    if not claimed:
+        await callback.answer("Заказ уже взят или не готов к выдаче", show_alert=True)
+        return
+    orders = await OrderService.load_orders(session, claimed)
+    if not orders:
+        await callback.answer("Заказ не найден", show_alert=True)
+        return
+    order = orders[0]
+
+    # Место считается заново: маршрут мог сократиться с момента предложения
+    insertion = active_routes.insert(callback.from_user.id, RouteStop.from_order(order))
+    data = await state.get_data()
+    if data.get('is_combined_route'):
+        await state.update_data(combined_route_ids=list(data.get('combined_route_ids', [])) + [order.id])
+
+    await callback.message.edit_text(
+        _delivery_card_text(order, header=f"✅ *Заказ #{order.id} добавлен в маршрут* (№{insertion.position + 1})"),
+        parse_mode="Markdown",
+        reply_markup=get_delivery_kb(order.id, _navigator_url(order)),
+    )
+    url = generate_yandex_maps_url([{'lat': s.lat, 'lon': s.lon} for s in insertion.stops])
+    await callback.message.answer(
+        f"🗺 Маршрут обновлён: {len(insertion.stops)} остановок.",
+        reply_markup=get_route_url_kb(url),
+    )
+    await callback.answer()
+
+    from services.notifications import notify_manager_about_order_status
+    try:
+        await notify_manager_about_order_status(
+            callback.bot, order, OrderStatus.READY_FOR_PICKUP, OrderStatus.DELIVERING, session
+        )
+    except Exception:
+        pass  # Не блокируем курьера при ошибке уведомления
+
+
+async def _take_combined(
+    callback: types.CallbackQuery,
+    session: AsyncSession,
+    state: FSMContext,
+    order_ids: list[int],
+    identity: Optional[CachedUser],
+):
+    """Взять заказы маршрута в доставку и показать карточки объединённого маршрута."""
+    if identity is None:
         await callback.answer("Ошибка: курьер не найден", show_alert=True)
         return
     
-    # Обновляем статусы всех заказов
-    orders_data = []
-    for order_id in order_ids:
-        stmt = select(Order).options(selectinload(Order.clinic)).where(Order.id == order_id)
-        res = await session.execute(stmt)
-        order = res.scalar_one_or_none()
-        
-        if order and order.status == OrderStatus.READY_FOR_PICKUP:
-            old_status = order.status
-            order.status = OrderStatus.DELIVERING
-            order.courier_id = courier_user.id
-            orders_data.append({
-                'order_id': order.id,
-                'name': order.clinic.name,
-                'address': order.clinic.address
-            })
-    
+    # Все заказы маршрута — одним UPDATE ... RETURNING
+    claimed_ids = set(await OrderService.claim_for_courier(
+        session, order_ids, identity.id, actor_telegram_id=callback.from_user.id
+    ))
     await session.commit()
     
+    if not claimed_ids:
+        await callback.answer("Заказы маршрута уже взяты другим курьером.", show_alert=True)
+        return
+    
+    route_ids = [oid for oid in order_ids if oid in claimed_ids]
+    orders = await OrderService.load_orders(session, route_ids)
+    active_routes.add(callback.from_user.id, [RouteStop.from_order(o) for o in orders])
+    
     # Уведомляем менеджеров о всех заказах (clinic и manager — без lazy load)
     from services.notifications import notify_manager_about_order_status
-    for order_id in order_ids:
-        stmt = select(Order).options(
-            selectinload(Order.clinic), selectinload(Order.manager)
-        ).where(Order.id == order_id)
-        res = await session.execute(stmt)
-        order = res.scalar_one_or_none()
-        if order and order.status == OrderStatus.DELIVERING:
-            await notify_manager_about_order_status(
-                callback.bot, order, OrderStatus.READY_FOR_PICKUP, OrderStatus.DELIVERING, session
-            )
+    for order in orders:
+        await notify_manager_about_order_status(
+            callback.bot, order, OrderStatus.READY_FOR_PICKUP, OrderStatus.DELIVERING, session
+        )
     
     # Сохраняем информацию о объединенном маршруте в state
     await state.update_data(
-        combined_route_ids=order_ids,
+        combined_route_ids=route_ids,
         delivered_order_ids=[],
         is_combined_route=True
     )
     
     # Отправляем карточки для каждого заказа с навигатором и номерами
-    for idx, order_id in enumerate(order_ids, 1):
-        stmt = select(Order).options(selectinload(Order.clinic)).where(Order.id == order_id)
-        res = await session.execute(stmt)
-        order = res.scalar_one_or_none()
-        if order:
-            # Генерируем ссылку на навигатор
-            nav_url = order.clinic.navigator_link if order.clinic.navigator_link else (
-                f"https://yandex.ru/maps/?pt={order.clinic.geo_lon},{order.clinic.geo_lat}&z=16"
-            )
-            
-            info = (
-                f"📦 *Заказ #{order.id}* (№{idx} в маршруте)\n\n"
-                f"🏥 *Клиника:* {order.clinic.name}\n"
-                f"📍 *Адрес:* {order.clinic.address}"
-            )
-            if order.is_urgent:
-                info += "\n\n🔥 *СРОЧНЫЙ ЗАКАЗ*"
-            
-            await callback.message.answer(
-                info,
-                reply_markup=get_delivery_kb(order.id, nav_url, idx, len(order_ids)),
-                parse_mode="Markdown"
-            )
+    await send_delivery_cards(callback.message, orders)
     
     text = (
         f"✅ *Объединенный маршрут взят в доставку*\n\n"
-        f"Заказов в маршруте: {len(orders_data)}\n\n"
+        f"Заказов в маршруте: {len(orders)}\n\n"
         f"Используйте кнопки навигатора и завершения для каждого заказа."
     )
+    if len(route_ids) < len(order_ids):
+        text += f"\n\n⚠️ {len(order_ids) - len(route_ids)} зак. уже взяты другим курьером и исключены."
     
-    await callback.message.edit_text(text, parse_mode="Markdown")
+    clinics = [{'order_id': o.id, 'name': o.clinic.name, 'is_urgent': o.is_urgent} for o in orders]
+    await callback.message.edit_text(
+        text,
+        parse_mode="Markdown",
+        reply_markup=get_combined_delivery_kb(route_ids, clinics)
+    )
     await state.set_state(CourierState.delivering_combined)
     await callback.answer()
 
+
+async def _finish_combined_delivery(
+    callback: types.CallbackQuery,
+    state: FSMContext,
+    session: AsyncSession,
+    combined_ids: list,
+    delivered_ids: list,
+    text_prefix: str,
+):
+    """Обновить сообщение объединённого маршрута после доставки одного или нескольких заказов."""
+    await state.update_data(delivered_order_ids=delivered_ids)
+    
+    if len(delivered_ids) >= len(combined_ids):
+        # Все заказы доставлены - закрываем маршрут
+        await callback.message.edit_text(
+            f"✅ *Все заказы из объединенного маршрута доставлены!*\n\n"
+            f"Доставлено заказов: {len(delivered_ids)}",
+            parse_mode="Markdown"
+        )
+        await state.clear()
+        return
+    
+    # Обновляем клавиатуру - убираем доставленные заказы (один SELECT на все оставшиеся)
+    remaining_orders = [oid for oid in combined_ids if oid not in delivered_ids]
+    orders = await OrderService.load_orders(session, remaining_orders)
+    clinics = [{'order_id': o.id, 'name': o.clinic.name, 'is_urgent': o.is_urgent} for o in orders]
+    
+    await callback.message.edit_text(
+        f"{text_prefix}\n\n"
+        f"Осталось доставить: {len(remaining_orders)} заказов",
+        parse_mode="Markdown",
+        reply_markup=get_combined_delivery_kb(remaining_orders, clinics)
+    )
+
+
+@router.callback_query(F.data == "combined_delivered_all")
+async def mark_combined_delivered_all(callback: types.CallbackQuery, session: AsyncSession, state: FSMContext, identity: Optional[CachedUser] = None):
+    """Отметить доставленными все оставшиеся заказы объединенного маршрута одним запросом"""
+    data = await state.get_data()
+    combined_ids = data.get('combined_route_ids', [])
+    delivered_ids = list(data.get('delivered_order_ids', []))
+    remaining = [oid for oid in combined_ids if oid not in delivered_ids]
+    
+    if not remaining:
+        await callback.answer("Нет заказов для отметки", show_alert=True)
+        return
+    
+    if identity is None:
+        await callback.answer("Ошибка: курьер не найден", show_alert=True)
+        return
+    
+    changed = await OrderService.mark_delivered_by_courier(
+        session, remaining, identity.id, actor_telegram_id=callback.from_user.id
+    )
+    await session.commit()
+    
+    if not changed:
+        await callback.answer("Заказы не в статусе доставки", show_alert=True)
+        return
+    
+    from services.notifications import notify_manager_about_order_status
+    for order in await OrderService.load_orders(session, changed):
+        await notify_manager_about_order_status(
+            callback.bot, order, OrderStatus.DELIVERING, OrderStatus.DELIVERED, session
+        )
+    
+    # Заказы, которые не удалось отметить (не в статусе доставки), тоже убираем из маршрута
+    delivered_ids.extend(remaining)
+    await _finish_combined_delivery(
+        callback, state, session, combined_ids, delivered_ids,
+        f"✅ *Доставлено заказов: {len(changed)}*"
+    )
+    await callback.answer()
+
+
 @router.callback_query(F.data.startswith("combined_delivered:"))
 async def mark_combined_delivered(callback: types.CallbackQuery, session: AsyncSession, state: FSMContext):
     """Отметить доставку заказа из объединенного маршрута"""
@@ -534,7 +689,7 @@ async def mark_combined_delivered(callback: types.CallbackQuery, session: AsyncS
     
     data = await state.get_data()
     combined_ids = data.get('combined_route_ids', [])
-    delivered_ids = data.get('delivered_order_ids', [])
+    delivered_ids = list(data.get('delivered_order_ids', []))
     
     if order_id not in combined_ids:
         await callback.answer("Этот заказ не в текущем маршруте", show_alert=True)
@@ -544,107 +699,62 @@ async def mark_combined_delivered(callback: types.CallbackQuery, session: AsyncS
         await callback.answer("Этот заказ уже отмечен как доставленный", show_alert=True)
         return
     
-    # Отмечаем заказ как доставленный
-    stmt = select(Order).options(
-        selectinload(Order.clinic),
-        selectinload(Order.manager),
-    ).where(Order.id == order_id)
-    res = await session.execute(stmt)
-    order = res.scalar_one_or_none()
-    
-    if not order:
-        await callback.answer("Заказ не найден", show_alert=True)
-        return
+    changed = await OrderService.transition_many(
+        session, [order_id], OrderStatus.DELIVERING, OrderStatus.DELIVERED,
+        actor_telegram_id=callback.from_user.id,
+    )
+    await session.commit()
     
-    if order.status != OrderStatus.DELIVERING:
+    if not changed:
         await callback.answer("Заказ не в статусе доставки", show_alert=True)
         return
     
-    old_status = order.status
-    order.status = OrderStatus.DELIVERED
-    order.delivered_at = datetime.now(timezone.utc)
-    await session.commit()
-    from services.notifications import notify_manager_about_order_status
-    await notify_manager_about_order_status(
-        callback.bot, order, old_status, OrderStatus.DELIVERED, session
-    )
+    orders = await OrderService.load_orders(session, changed)
+    order = orders[0] if orders else None
+    if order:
+        from services.notifications import notify_manager_about_order_status
+        await notify_manager_about_order_status(
+            callback.bot, order, OrderStatus.DELIVERING, OrderStatus.DELIVERED, session
+        )
     
     # Добавляем в список доставленных
     delivered_ids.append(order_id)
-    await state.update_data(delivered_order_ids=delivered_ids)
-    
-    # Проверяем, все ли заказы доставлены
-    if len(delivered_ids) == len(combined_ids):
-        # Все заказы доставлены - закрываем маршрут
-        await callback.message.edit_text(
-            f"✅ *Все заказы из объединенного маршрута доставлены!*\n\n"
-            f"Доставлено заказов: {len(delivered_ids)}",
-            parse_mode="Markdown"
-        )
-        await state.clear()
-    else:
-        # Обновляем клавиатуру - убираем доставленный заказ
-        remaining_orders = [oid for oid in combined_ids if oid not in delivered_ids]
-        
-        clinics = []
-        for oid in remaining_orders:
-            stmt = select(Order).options(selectinload(Order.clinic)).where(Order.id == oid)
-            res = await session.execute(stmt)
-            order = res.scalar_one_or_none()
-            if order:
-                clinics.append({'order_id': order.id, 'name': order.clinic.name, 'is_urgent': order.is_urgent})
-        
-        kb = get_combined_delivery_kb(remaining_orders, clinics)
-        
-        await callback.message.edit_text(
-            f"✅ *Заказ #{order_id} доставлен в {order.clinic.name}*\n\n"
-            f"Осталось доставить: {len(remaining_orders)} заказов",
-            parse_mode="Markdown",
-            reply_markup=kb
-        )
-    
+    clinic_name = order.clinic.name if order and order.clinic else "—"
+    await _finish_combined_delivery(
+        callback, state, session, combined_ids, delivered_ids,
+        f"✅ *Заказ #{order_id} доставлен в {clinic_name}*"
+    )
     await callback.answer()
 
 @router.callback_query(F.data.startswith("courier_delivered:"))
-async def mark_delivered(callback: types.CallbackQuery, session: AsyncSession):
+async def mark_delivered(callback: types.CallbackQuery, session: AsyncSession, identity: Optional[CachedUser] = None):
     order_id = int(callback.data.split(":")[1])
     
-    stmt = select(Order).options(
-        selectinload(Order.manager),
-        selectinload(Order.clinic),
-    ).where(Order.id == order_id)
-    res = await session.execute(stmt)
-    order = res.scalar_one_or_none()
+    if identity is None:
+        await callback.answer("Ошибка: курьер не найден", show_alert=True)
+        return
     
-    if order:
-        # Check if order is assigned to this courier or is free
-        user_result = await session.execute(select(User).where(User.telegram_id == callback.from_user.id))
-        courier_user = user_result.scalar_one_or_none()
-        
-        if not courier_user:
-            await callback.answer("Ошибка: курьер не найден", show_alert=True)
-            return
-        
-        # Check if order is assigned to this courier or is free (no courier assigned)
-        if order.courier_id is not None and order.courier_id != courier_user.id:
+    # Проверка статуса и назначения курьеру — в WHERE того же UPDATE
+    changed = await OrderService.mark_delivered_by_courier(
+        session, [order_id], identity.id, actor_telegram_id=callback.from_user.id
+    )
+    await session.commit()
+    
+    if not changed:
+        stmt = select(Order.status, Order.courier_id).where(Order.id == order_id)
+        row = (await session.execute(stmt)).one_or_none()
+        if row is None:
+            await callback.answer("Ошибка обновления.", show_alert=True)
+        elif row.courier_id is not None and row.courier_id != identity.id:
             await callback.answer("❌ Этот заказ назначен другому курьеру", show_alert=True)
-            return
-        
-        if order.status != OrderStatus.DELIVERING:
+        else:
             await callback.answer("❌ Заказ не в статусе 'В доставке'", show_alert=True)
-            return
-        
-        old_status = order.status
-        order.status = OrderStatus.DELIVERED
-        order.delivered_at = datetime.now(timezone.utc)
-        # Ensure courier_id is set
-        if order.courier_id is None:
-            order.courier_id = courier_user.id
-        await session.commit()
+        return
+    
+    orders = await OrderService.load_orders(session, changed)
+    if orders:
         from services.notifications import notify_manager_about_order_status
         await notify_manager_about_order_status(
-            callback.bot, order, old_status, OrderStatus.DELIVERED, session
+            callback.bot, orders[0], OrderStatus.DELIVERING, OrderStatus.DELIVERED, session
         )
-        await callback.message.edit_text(f"✅ Заказ #{order_id} доставлен.")
-    else:
-        await callback.answer("Ошибка обновления.", show_alert=True)
+    await callback.message.edit_text(f"✅ Заказ #{order_id} доставлен.")
@@ -1,17 +1,20 @@
 import logging
+from typing import Optional
 from aiogram import Router, types, F
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.exceptions import TelegramBadRequest
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from database.models import User, UserRole, Order, OrderItem, OrderStatus, DeliveryType, Clinic
+from database.models import UserRole, Order, OrderItem, OrderStatus, DeliveryType, Clinic
 
 logger = logging.getLogger("manager_catalog")
 from config import config
 from services.one_c import get_stock, get_sku
-from services.db_ops import get_user_by_telegram_id, check_role
+from services.db_ops import check_role
+from services.cache import CachedUser
 from services.search_service import search_clinics
+from services.order_view import OrderView, get_order_card
 from catalog_config import get_catalog
 from services.telegram_utils import safe_edit_text
 from keyboards.manager_kbs import (
@@ -1565,7 +1568,7 @@ async def select_clinic(callback: types.CallbackQuery, state: FSMContext, sessio
     await finalize_order(callback, state, session)
 
 
-async def finalize_order(callback: types.CallbackQuery, state: FSMContext, session: AsyncSession):
+async def finalize_order(callback: types.CallbackQuery, state: FSMContext, session: AsyncSession, identity: Optional[CachedUser] = None):
     """Создание заказа через OrderService с транзакцией и проверкой остатков."""
     from services.order_service import OrderService
     from services.catalog_db import get_qty as db_get_qty
@@ -1583,8 +1586,7 @@ async def finalize_order(callback: types.CallbackQuery, state: FSMContext, sessi
         callback.from_user.id, clinic_id, len(cart), items_summary, is_urgent, delivery_type_str
     )
 
-    manager_user = await get_user_by_telegram_id(session, callback.from_user.id, use_cache=True)
-    if not manager_user:
+    if identity is None:
         logger.warning("catalog user=%s finalize_order manager_not_found", callback.from_user.id)
         await callback.answer("❌ Ошибка: пользователь не найден", show_alert=True)
         return
@@ -1660,7 +1662,7 @@ async def finalize_order(callback: types.CallbackQuery, state: FSMContext, sessi
     delivery_type = DeliveryType(delivery_type_str)
     order, error = await OrderService.create_order(
         session=session,
-        manager_id=manager_user.id,
+        manager_id=identity.id,
         clinic_id=clinic_id,
         cart=cart,
         is_urgent=is_urgent,
@@ -1696,55 +1698,58 @@ async def confirm_adjusted_order(callback: types.CallbackQuery, callback_data: M
 ORDERS_PER_PAGE = 15
 
 
-async def _load_manager_orders_page(session: AsyncSession, manager_user_id: int, page: int):
-    """Загружает страницу заказов менеджера с пагинацией."""
-    from sqlalchemy.orm import selectinload
-    from sqlalchemy import func
-    # Общее количество
-    count_stmt = (
-        select(func.count(Order.id))
+async def _load_manager_orders_page(
+    session: AsyncSession,
+    manager_user_id: int,
+    cursor: str | None = None,
+    backward: bool = False,
+):
+    """
+    Загружает страницу заказов менеджера: keyset по (created_at, id), только
+    нужные для кнопок колонки (без позиций заказа). Итог — кешированный COUNT.
+    """
+    from services.pagination import keyset_page, cached_count
+    from services.order_service import manager_orders_count_key
+    base = (
+        select(Order.id, Order.status, Order.created_at, Clinic.doctor_name)
+        .outerjoin(Clinic, Clinic.id == Order.clinic_id)
         .where(Order.manager_id == manager_user_id)
     )
-    total_result = await session.execute(count_stmt)
-    total_count = total_result.scalar() or 0
-    # Страница заказов
-    offset = page * ORDERS_PER_PAGE
-    stmt = (
-        select(Order)
-        .options(selectinload(Order.clinic), selectinload(Order.items))
-        .where(Order.manager_id == manager_user_id)
-        .order_by(Order.created_at.desc())
-        .limit(ORDERS_PER_PAGE)
-        .offset(offset)
+    page = await keyset_page(
+        session, base, (Order.created_at, Order.id),
+        per_page=ORDERS_PER_PAGE, cursor=cursor, backward=backward,
     )
-    result = await session.execute(stmt)
-    orders = result.scalars().all()
-    return orders, total_count
+    total_count = await cached_count(
+        session,
+        manager_orders_count_key(manager_user_id),
+        select(Order.id).where(Order.manager_id == manager_user_id),
+    )
+    return page, total_count
 
 
 @router.callback_query(F.data == "manager:orders")
-@router.callback_query(F.data.startswith("manager:orders:page:"))
-async def manager_menu_orders(callback: types.CallbackQuery, session: AsyncSession):
+@router.callback_query(F.data.startswith("manager:orders:"))
+async def manager_menu_orders(callback: types.CallbackQuery, session: AsyncSession, identity: Optional[CachedUser] = None):
     """Показать заказы менеджера в виде кнопок с пагинацией."""
     if not await is_manager(callback.from_user.id, session):
         await callback.answer("Доступ запрещен", show_alert=True)
         return
     
-    manager_user = await get_user_by_telegram_id(session, callback.from_user.id, use_cache=True)
-    if not manager_user:
+    if identity is None:
         await callback.answer("Ошибка: пользователь не найден", show_alert=True)
         return
     
-    page = 0
-    if callback.data and callback.data.startswith("manager:orders:page:"):
-        try:
-            page = int(callback.data.split(":")[-1])
-        except (ValueError, IndexError):
-            page = 0
+    # manager:orders:n:<курсор> — следующая страница, manager:orders:p:<курсор> — предыдущая
+    cursor = None
+    backward = False
+    parts = (callback.data or "").split(":", 3)
+    if len(parts) == 4 and parts[2] in ("n", "p"):
+        cursor = parts[3]
+        backward = parts[2] == "p"
     
-    orders, total_count = await _load_manager_orders_page(session, manager_user.id, page)
+    page, total_count = await _load_manager_orders_page(session, identity.id, cursor, backward)
     
-    if not orders:
+    if not page.rows:
         await callback.message.edit_text(
             "📋 *Мои заказы*\n\nУ вас пока нет заказов.\n\n"
             "🟡 собирается на складе | 🔵 доставляется | 🟢 доставлен | 🔴 отменён",
@@ -1754,13 +1759,13 @@ async def manager_menu_orders(callback: types.CallbackQuery, session: AsyncSessi
         await callback.answer()
         return
     
-    total_pages = max(1, (total_count + ORDERS_PER_PAGE - 1) // ORDERS_PER_PAGE)
+    total_pages = max(page.page + 1, (total_count + ORDERS_PER_PAGE - 1) // ORDERS_PER_PAGE)
     text = (
-        f"📋 *Мои заказы* (страница {page + 1}/{total_pages})\n\n"
+        f"📋 *Мои заказы* (страница {page.page + 1}/{total_pages})\n\n"
         f"Всего заказов: {total_count}\n\n"
         "🟡 собирается | 🔵 доставка | 🟢 доставлен | 🔴 отменён"
     )
-    kb = make_manager_orders_list_kb(orders, page=page, per_page=ORDERS_PER_PAGE, total_count=total_count)
+    kb = make_manager_orders_list_kb(page.rows, prev_cursor=page.prev_cursor, next_cursor=page.next_cursor)
     try:
         await callback.message.edit_text(text, parse_mode="Markdown", reply_markup=kb)
     except TelegramBadRequest as e:
@@ -1769,37 +1774,8 @@ async def manager_menu_orders(callback: types.CallbackQuery, session: AsyncSessi
     await callback.answer()
 
 
-@router.callback_query(F.data.startswith("manager:order:"))
-async def manager_order_detail(callback: types.CallbackQuery, session: AsyncSession):
-    """Показать полные данные заказа при нажатии на кнопку."""
-    if not await is_manager(callback.from_user.id, session):
-        await callback.answer("Доступ запрещен", show_alert=True)
-        return
-    
-    try:
-        order_id = int(callback.data.split(":")[-1])
-    except (ValueError, IndexError):
-        await callback.answer("Ошибка", show_alert=True)
-        return
-    
-    from sqlalchemy.orm import selectinload
-    stmt = (
-        select(Order)
-        .options(selectinload(Order.clinic), selectinload(Order.items))
-        .where(Order.id == order_id)
-    )
-    result = await session.execute(stmt)
-    order = result.scalar_one_or_none()
-    
-    if not order:
-        await callback.answer("Заказ не найден", show_alert=True)
-        return
-    
-    manager_user = await get_user_by_telegram_id(session, callback.from_user.id, use_cache=True)
-    if not manager_user or order.manager_id != manager_user.id:
-        await callback.answer("Доступ запрещен", show_alert=True)
-        return
-    
+def _render_manager_card(view: OrderView):
+    """Текст и клавиатура карточки заказа для менеджера."""
     status_names = {
         OrderStatus.NEW: "🆕 Новый",
         OrderStatus.ASSEMBLY: "🔧 В сборке",
@@ -1808,47 +1784,71 @@ async def manager_order_detail(callback: types.CallbackQuery, session: AsyncSess
         OrderStatus.DELIVERED: "✅ Доставлен",
         OrderStatus.CANCELED: "❌ Отменён",
     }
-    status_name = status_names.get(order.status, order.status.value)
-    created_date = order.created_at.strftime("%d.%m.%Y %H:%M") if order.created_at else "—"
-    assembled_date = order.assembled_at.strftime("%d.%m.%Y %H:%M") if order.assembled_at else "—"
-    delivered_date = order.delivered_at.strftime("%d.%m.%Y %H:%M") if order.delivered_at else "—"
+    status_name = status_names.get(view.status, view.status.value)
+    created_date = view.created_at.strftime("%d.%m.%Y %H:%M") if view.created_at else "—"
+    assembled_date = view.assembled_at.strftime("%d.%m.%Y %H:%M") if view.assembled_at else "—"
+    delivered_date = view.delivered_at.strftime("%d.%m.%Y %H:%M") if view.delivered_at else "—"
     
     text = (
-        f"📦 *Заказ #{order.id}*\n\n"
-        f"*Клиника:* {order.clinic.name if order.clinic else '—'}\n"
-        f"*Врач:* {order.clinic.doctor_name if order.clinic else '—'}\n"
+        f"📦 *Заказ #{view.id}*\n\n"
+        f"*Клиника:* {view.clinic_name or '—'}\n"
+        f"*Врач:* {view.doctor_name or '—'}\n"
         f"*Статус:* {status_name}\n"
         f"*Создан:* {created_date}\n"
         f"*Собран:* {assembled_date}\n"
         f"*Доставлен:* {delivered_date}\n"
-        f"*Срочный:* {'Да' if order.is_urgent else 'Нет'}\n"
-        f"*Доставка:* {order.delivery_type.value if order.delivery_type else '—'}\n"
+        f"*Срочный:* {'Да' if view.is_urgent else 'Нет'}\n"
+        f"*Доставка:* {view.delivery_type.value if view.delivery_type else '—'}\n"
     )
-    if order.taxi_link:
-        text += f"*Ссылка такси:* {order.taxi_link}\n"
+    if view.taxi_link:
+        text += f"*Ссылка такси:* {view.taxi_link}\n"
     
     text += "\n*Товары:*\n"
-    for item in order.items or []:
-        name = (item.replacement_name or item.item_name) if getattr(item, "replacement_name", None) else item.item_name
-        text += f"• {name} — {item.quantity} шт\n"
+    for item in view.items:
+        text += f"• {item.display_name} — {item.quantity} шт\n"
     
     kb = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="⬅ К списку заказов", callback_data="manager:orders")]
     ])
-    await callback.message.edit_text(text, parse_mode="Markdown", reply_markup=kb)
+    return text, kb
+
+
+@router.callback_query(F.data.startswith("manager:order:"))
+async def manager_order_detail(callback: types.CallbackQuery, session: AsyncSession, identity: Optional[CachedUser] = None):
+    """Показать полные данные заказа при нажатии на кнопку."""
+    if not await is_manager(callback.from_user.id, session):
+        await callback.answer("Доступ запрещен", show_alert=True)
+        return
+    
+    try:
+        order_id = int(callback.data.split(":")[-1])
+    except (ValueError, IndexError):
+        await callback.answer("Ошибка", show_alert=True)
+        return
+    
+    card = await get_order_card(session, order_id, "manager", _render_manager_card)
+    
+    if not card:
+        await callback.answer("Заказ не найден", show_alert=True)
+        return
+    
+    if identity is None or card.view.manager_id != identity.id:
+        await callback.answer("Доступ запрещен", show_alert=True)
+        return
+    
+    await callback.message.edit_text(card.text, parse_mode="Markdown", reply_markup=card.reply_markup)
     await callback.answer()
 
 
 # --- Замены товаров (склад указал «нет в наличии», менеджер подбирает замену) ---
 
 @router.callback_query(F.data == "manager:replacements")
-async def manager_replacements_list(callback: types.CallbackQuery, session: AsyncSession):
+async def manager_replacements_list(callback: types.CallbackQuery, session: AsyncSession, identity: Optional[CachedUser] = None):
     """Список заказов, в которых есть товары без замены (need_replacement=True, replacement_sku пусто)."""
     if not await is_manager(callback.from_user.id, session):
         await callback.answer("Доступ запрещен", show_alert=True)
         return
-    manager_user = await get_user_by_telegram_id(session, callback.from_user.id, use_cache=True)
-    if not manager_user:
+    if identity is None:
         await callback.answer("Ошибка: пользователь не найден", show_alert=True)
         return
     from sqlalchemy.orm import selectinload
@@ -1863,7 +1863,7 @@ async def manager_replacements_list(callback: types.CallbackQuery, session: Asyn
     stmt = (
         select(Order)
         .options(selectinload(Order.clinic), selectinload(Order.items))
-        .where(Order.manager_id == manager_user.id, Order.id.in_(subq))
+        .where(Order.manager_id == identity.id, Order.id.in_(subq))
         .order_by(Order.created_at.desc())
     )
     result = await session.execute(stmt)
@@ -1894,7 +1894,7 @@ async def manager_replacements_list(callback: types.CallbackQuery, session: Asyn
 
 
 @router.callback_query(F.data.startswith("manager:replace_order:"))
-async def manager_replace_order_detail(callback: types.CallbackQuery, session: AsyncSession):
+async def manager_replace_order_detail(callback: types.CallbackQuery, session: AsyncSession, identity: Optional[CachedUser] = None):
     """Детали заказа для подбора замен: список товаров с need_replacement без replacement_sku."""
     if not await is_manager(callback.from_user.id, session):
         await callback.answer("Доступ запрещен", show_alert=True)
@@ -1915,8 +1915,7 @@ async def manager_replace_order_detail(callback: types.CallbackQuery, session: A
     if not order:
         await callback.answer("Заказ не найден", show_alert=True)
         return
-    manager_user = await get_user_by_telegram_id(session, callback.from_user.id, use_cache=True)
-    if not manager_user or order.manager_id != manager_user.id:
+    if identity is None or order.manager_id != identity.id:
         await callback.answer("Доступ запрещен", show_alert=True)
         return
     need_replace = [i for i in (order.items or []) if getattr(i, "need_replacement", False) and not getattr(i, "replacement_sku", None)]
@@ -1991,6 +1990,8 @@ async def manager_confirm_replacement(callback: types.CallbackQuery, state: FSMC
         return
     item.replacement_sku = sku
     item.replacement_name = name
+    from services.order_service import OrderService
+    await OrderService.bump_version(session, item.order_id)
     await session.commit()
     await state.clear()
     from services.telegram_utils import escape_markdown
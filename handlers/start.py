@@ -27,11 +27,7 @@ async def cmd_start(message: types.Message, session: AsyncSession):
         from services.cache import user_cache
         if not user:
             user = await create_user(session, telegram_id, full_name, role=UserRole.ADMIN, is_active=True)
-            if user_cache is not None:
-                try:
-                    await user_cache.invalidate(telegram_id)
-                except Exception:
-                    pass
+            await user_cache.invalidate(telegram_id)
         else:
             changed = False
             if not user.is_active:
@@ -43,11 +39,7 @@ async def cmd_start(message: types.Message, session: AsyncSession):
             if changed:
                 await session.commit()
                 await session.refresh(user)
-                if user_cache is not None:
-                    try:
-                        await user_cache.invalidate(telegram_id)
-                    except Exception:
-                        pass
+                await user_cache.invalidate(telegram_id)
 
         welcome_text = f"Добро пожаловать, {user.full_name}!\n\nВыберите действие:"
         await message.answer(welcome_text, reply_markup=get_admin_menu_kb())
@@ -58,11 +50,7 @@ async def cmd_start(message: types.Message, session: AsyncSession):
         user = await create_user(session, telegram_id, full_name)
         # Инвалидируем кеш для нового пользователя
         from services.cache import user_cache
-        if user_cache is not None:
-            try:
-                await user_cache.invalidate(telegram_id)
-            except Exception:
-                pass
+        await user_cache.invalidate(telegram_id)
         await message.answer("Ваша заявка на регистрацию принята. Ожидайте подтверждения администратора.")
         
         # Notify Admins
@@ -3,16 +3,29 @@ from datetime import datetime, timezone
 from aiogram import Router, types, F
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
-from sqlalchemy import select
+from sqlalchemy import select, func
 from sqlalchemy.orm import selectinload
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from database.models import User, UserRole, Order, OrderStatus, DeliveryType, Clinic, OrderItem
 from config import config
 from services.db_ops import get_user_by_telegram_id, check_role
+from services.order_service import OrderService
+from services.warehouse_queue import warehouse_queue
+from services.order_view import OrderView, get_order_card
+from services.notify_dispatcher import enqueue_message
+from services.notify_digest import notify_digest
+from services.courier_offers import offer_order
+from services.active_routes import RouteStop, active_routes
+from services.courier_locations import courier_locations
+from services.clinic_matrix import clinic_matrix
+from services.route_planner import PlanCourier, PlanStop, plan_dispatch
+from services.route_store import StoredRoute, StoredStop, route_store
+from services.routing import generate_yandex_maps_url
 from services.telegram_utils import escape_markdown, safe_edit_text
 from services.printer import generate_label, generate_collected_label, send_to_printer
 from keyboards.warehouse_kbs import get_warehouse_order_kb, get_warehouse_orders_list_kb, get_warehouse_order_detail_kb
+from keyboards.courier_kbs import get_planned_route_kb, get_route_insert_kb
 from states.warehouse_states import WarehouseState
 
 logger = logging.getLogger(__name__)
@@ -25,34 +38,20 @@ async def is_warehouse(user_id: int, session: AsyncSession) -> bool:
 
 
 async def _get_active_orders(session: AsyncSession):
-    """Получить активные заказы (NEW/ASSEMBLY) со всеми связями."""
+    """
+    Активные заказы (NEW/ASSEMBLY) для списка кнопок: срочные первыми, затем FIFO.
+    Берутся из очереди в памяти (services.warehouse_queue); пока она не
+    сверена с БД — лёгкая выборка (id, is_urgent, status) без связей.
+    """
+    if warehouse_queue.ready:
+        return warehouse_queue.snapshot()
     stmt = (
-        select(Order)
-        .options(
-            selectinload(Order.clinic),
-            selectinload(Order.manager),
-            selectinload(Order.items)
-        )
+        select(Order.id, Order.is_urgent, Order.status)
         .where(Order.status.in_([OrderStatus.NEW, OrderStatus.ASSEMBLY]))
-        .order_by(Order.is_urgent.desc(), Order.created_at.asc())
-    )
-    result = await session.execute(stmt)
-    return result.scalars().all()
-
-
-async def _get_order_detail(session: AsyncSession, order_id: int) -> Order | None:
-    """Получить заказ по ID со всеми связями."""
-    stmt = (
-        select(Order)
-        .options(
-            selectinload(Order.clinic),
-            selectinload(Order.manager),
-            selectinload(Order.items)
-        )
-        .where(Order.id == order_id)
+        .order_by(Order.is_urgent.desc(), Order.created_at.asc(), Order.id.asc())
     )
     result = await session.execute(stmt)
-    return result.scalar_one_or_none()
+    return result.all()
 
 
 @router.callback_query(F.data == "warehouse:orders")
@@ -74,52 +73,51 @@ async def warehouse_menu_orders(callback: types.CallbackQuery, session: AsyncSes
     )
     await callback.answer()
 
-@router.callback_query(F.data.startswith("warehouse:order:"))
-async def warehouse_order_detail(callback: types.CallbackQuery, session: AsyncSession):
-    """Показать детали заказа по нажатию на кнопку"""
-    if not await is_warehouse(callback.from_user.id, session):
-        await callback.answer("Доступ запрещен", show_alert=True)
-        return
-
-    order_id = int(callback.data.split(":")[-1])
-    order = await _get_order_detail(session, order_id)
-    
-    if not order or order.status not in [OrderStatus.NEW, OrderStatus.ASSEMBLY]:
-        await callback.answer("Заказ не найден или уже обработан", show_alert=True)
-        return
-
-    icon = "🔥" if order.is_urgent else "🟢"
+def _render_warehouse_card(view: OrderView):
+    """Текст и клавиатура карточки заказа для склада."""
+    icon = "🔥" if view.is_urgent else "🟢"
     status_map = {OrderStatus.NEW: "Новый", OrderStatus.ASSEMBLY: "В сборке"}
-    manager_name = escape_markdown(order.manager.full_name if order.manager else "Неизвестен")
-    doctor_name = escape_markdown(order.clinic.doctor_name if order.clinic else "—")
-    clinic_name = escape_markdown(order.clinic.name if order.clinic else "—")
-    created_date = order.created_at.strftime("%d.%m.%Y %H:%M") if order.created_at else "—"
+    manager_name = escape_markdown(view.manager_name or "Неизвестен")
+    doctor_name = escape_markdown(view.doctor_name or "—")
+    clinic_name = escape_markdown(view.clinic_name or "—")
+    created_date = view.created_at.strftime("%d.%m.%Y %H:%M") if view.created_at else "—"
     
     text = (
-        f"{icon} *Заказ #{order.id}*\n\n"
+        f"{icon} *Заказ #{view.id}*\n\n"
         f"👤 *Врач:* {doctor_name}\n"
         f"👤 *Менеджер:* {manager_name}\n"
         f"🏥 *Клиника:* {clinic_name}\n"
         f"📅 *Создан:* {created_date}\n"
-        f"📊 *Статус:* {status_map.get(order.status, order.status.value)}\n"
-        f"🚚 *Доставка:* {order.delivery_type.value}\n\n"
+        f"📊 *Статус:* {status_map.get(view.status, view.status.value)}\n"
+        f"🚚 *Доставка:* {view.delivery_type.value}\n\n"
         f"📦 *Товары:*\n"
     )
-    if order.items:
-        for idx, item in enumerate(order.items, 1):
-            name = (item.replacement_name or item.item_name) if getattr(item, "replacement_name", None) else item.item_name
-            if getattr(item, "need_replacement", False) and not getattr(item, "replacement_sku", None):
-                text += f"{idx}. {escape_markdown(name)} — {item.quantity} шт. _⏳ ждёт замену_\n"
+    if view.items:
+        for idx, item in enumerate(view.items, 1):
+            if item.waiting_replacement:
+                text += f"{idx}. {escape_markdown(item.display_name)} — {item.quantity} шт. _⏳ ждёт замену_\n"
             else:
-                text += f"{idx}. {escape_markdown(name)} — {item.quantity} шт.\n"
+                text += f"{idx}. {escape_markdown(item.display_name)} — {item.quantity} шт.\n"
     else:
         text += "⚠️ Товары не найдены\n"
+    return text, get_warehouse_order_detail_kb(view.id, view.status.value, view.items)
 
-    await safe_edit_text(
-        callback.message,
-        text,
-        reply_markup=get_warehouse_order_detail_kb(order.id, order.status.value, order.items),
-    )
+
+@router.callback_query(F.data.startswith("warehouse:order:"))
+async def warehouse_order_detail(callback: types.CallbackQuery, session: AsyncSession):
+    """Показать детали заказа по нажатию на кнопку"""
+    if not await is_warehouse(callback.from_user.id, session):
+        await callback.answer("Доступ запрещен", show_alert=True)
+        return
+
+    order_id = int(callback.data.split(":")[-1])
+    card = await get_order_card(session, order_id, "warehouse", _render_warehouse_card)
+    
+    if not card or card.view.status not in [OrderStatus.NEW, OrderStatus.ASSEMBLY]:
+        await callback.answer("Заказ не найден или уже обработан", show_alert=True)
+        return
+
+    await safe_edit_text(callback.message, card.text, reply_markup=card.reply_markup)
     await callback.answer()
 
 @router.message(Command("warehouse"))
@@ -165,47 +163,25 @@ async def mark_item_out_of_stock(callback: types.CallbackQuery, session: AsyncSe
         await callback.answer("Уже отмечено как нет в наличии", show_alert=True)
         return
     item.need_replacement = True
+    await OrderService.bump_version(session, order_id)
     await session.commit()
-    # Уведомить менеджера и обновить экран (один запрос вместо двух)
-    order = await _get_order_detail(session, order_id)
-    if order and order.manager and order.manager.telegram_id:
-        try:
-            await callback.bot.send_message(
-                order.manager.telegram_id,
-                f"📦 *Заказ #{order.id}*\n\n"
-                f"Склад указал: *нет в наличии* — {escape_markdown(item.item_name)} ({item.quantity} шт.).\n\n"
-                "Подберите замену в разделе *🔄 Замены* в меню менеджера.",
-                parse_mode="Markdown"
-            )
-        except Exception as e:
-            logger.error("Notify manager about out-of-stock: %s", e)
-    await callback.answer("Отмечено. Менеджер получит уведомление о замене.")
-    if order and order.status in [OrderStatus.NEW, OrderStatus.ASSEMBLY]:
-        icon = "🔥" if order.is_urgent else "🟢"
-        status_map = {OrderStatus.NEW: "Новый", OrderStatus.ASSEMBLY: "В сборке"}
-        manager_name = escape_markdown(order.manager.full_name if order.manager else "Неизвестен")
-        doctor_name = escape_markdown(order.clinic.doctor_name if order.clinic else "—")
-        clinic_name = escape_markdown(order.clinic.name if order.clinic else "—")
-        created_date = order.created_at.strftime("%d.%m.%Y %H:%M") if order.created_at else "—"
-        text = (
-            f"{icon} *Заказ #{order.id}*\n\n"
-            f"👤 *Врач:* {doctor_name}\n"
-            f"👤 *Менеджер:* {manager_name}\n"
-            f"🏥 *Клиника:* {clinic_name}\n"
-            f"📅 *Создан:* {created_date}\n"
-            f"📊 *Статус:* {status_map.get(order.status, order.status.value)}\n"
-            f"🚚 *Доставка:* {order.delivery_type.value}\n\n"
-            f"📦 *Товары:*\n"
+    # Уведомить менеджера и обновить экран (карточка перестраивается по новой версии)
+    card = await get_order_card(session, order_id, "warehouse", _render_warehouse_card)
+    if card and card.view.manager_telegram_id:
+        await enqueue_message(
+            callback.bot,
+            card.view.manager_telegram_id,
+            f"📦 *Заказ #{order_id}*\n\n"
+            f"Склад указал: *нет в наличии* — {escape_markdown(item.item_name)} ({item.quantity} шт.).\n\n"
+            "Подберите замену в разделе *🔄 Замены* в меню менеджера.",
+            parse_mode="Markdown",
+            urgent=card.view.is_urgent,
         )
-        for idx, it in enumerate(order.items, 1):
-            name = (it.replacement_name or it.item_name) if getattr(it, "replacement_name", None) else it.item_name
-            if getattr(it, "need_replacement", False) and not getattr(it, "replacement_sku", None):
-                text += f"{idx}. {escape_markdown(name)} — {it.quantity} шт. _⏳ ждёт замену_\n"
-            else:
-                text += f"{idx}. {escape_markdown(name)} — {it.quantity} шт.\n"
+    await callback.answer("Отмечено. Менеджер получит уведомление о замене.")
+    if card and card.view.status in [OrderStatus.NEW, OrderStatus.ASSEMBLY]:
         await callback.message.edit_text(
-            text,
-            reply_markup=get_warehouse_order_detail_kb(order.id, order.status.value, order.items),
+            card.text,
+            reply_markup=card.reply_markup,
             parse_mode="Markdown"
         )
 
@@ -213,29 +189,62 @@ async def mark_item_out_of_stock(callback: types.CallbackQuery, session: AsyncSe
 async def take_order(callback: types.CallbackQuery, session: AsyncSession):
     order_id = int(callback.data.split(":")[1])
     
-    stmt = select(Order).options(
-        selectinload(Order.manager),
-        selectinload(Order.clinic),
-        selectinload(Order.items),
-    ).where(Order.id == order_id)
-    result = await session.execute(stmt)
-    order = result.scalar_one_or_none()
+    # Условный UPDATE: два сотрудника склада не возьмут один заказ
+    changed = await OrderService.transition_many(
+        session, [order_id], OrderStatus.NEW, OrderStatus.ASSEMBLY,
+        actor_telegram_id=callback.from_user.id,
+    )
+    await session.commit()
     
-    if order and order.status == OrderStatus.NEW:
-        old_status = order.status
-        order.status = OrderStatus.ASSEMBLY
-        # Сохраняем items до commit — после commit ленивый доступ к order.items вызовет MissingGreenlet в async
-        items_snapshot = list(order.items)
-        await session.commit()
-        from services.notifications import notify_manager_about_order_status
+    if not changed:
+        await callback.answer("Заказ не найден или статус изменен", show_alert=True)
+        return
+    
+    orders = await OrderService.load_orders(session, changed, with_items=True)
+    if not orders:
+        await callback.answer("Заказ не найден или статус изменен", show_alert=True)
+        return
+    order = orders[0]
+    from services.notifications import notify_manager_about_order_status
+    await notify_manager_about_order_status(
+        callback.bot, order, OrderStatus.NEW, OrderStatus.ASSEMBLY, session
+    )
+    
+    await callback.message.edit_reply_markup(reply_markup=get_warehouse_order_detail_kb(order.id, "assembly", order.items))
+    await callback.answer("Взято в работу")
+
+
+@router.callback_query(F.data == "wh_take_all")
+async def take_all_orders(callback: types.CallbackQuery, session: AsyncSession):
+    """Взять в работу все новые заказы одним запросом."""
+    if not await is_warehouse(callback.from_user.id, session):
+        await callback.answer("Доступ запрещен", show_alert=True)
+        return
+    
+    changed = await OrderService.transition_many(
+        session, None, OrderStatus.NEW, OrderStatus.ASSEMBLY,
+        actor_telegram_id=callback.from_user.id,
+    )
+    await session.commit()
+    
+    if not changed:
+        await callback.answer("Нет новых заказов", show_alert=True)
+        return
+    
+    from services.notifications import notify_manager_about_order_status
+    for order in await OrderService.load_orders(session, changed):
         await notify_manager_about_order_status(
-            callback.bot, order, old_status, OrderStatus.ASSEMBLY, session
+            callback.bot, order, OrderStatus.NEW, OrderStatus.ASSEMBLY, session
         )
-        
-        await callback.message.edit_reply_markup(reply_markup=get_warehouse_order_detail_kb(order.id, "assembly", items_snapshot))
-        await callback.answer("Взято в работу")
-    else:
-        await callback.answer("Заказ не найден или статус изменен", show_alert=True)
+    
+    orders = await _get_active_orders(session)
+    await safe_edit_text(
+        callback.message,
+        f"📦 Активные заказы: {len(orders)}\n\nВыберите заказ:",
+        reply_markup=get_warehouse_orders_list_kb(orders),
+        parse_mode=None,
+    )
+    await callback.answer(f"Взято в работу: {len(changed)}")
 
 @router.callback_query(F.data.startswith("wh_ready:"))
 async def ready_order(callback: types.CallbackQuery, state: FSMContext, session: AsyncSession):
@@ -312,13 +321,18 @@ async def ready_order(callback: types.CallbackQuery, state: FSMContext, session:
         # Показываем ошибку только если это не просто отключенный принтер
         await callback.message.answer(f"⚠️ Не удалось отправить на принтер: {print_message}")
     
-    # 2. Update assembled_at timestamp to NOW (use datetime, not func.now())
-    order.assembled_at = datetime.now(timezone.utc)
-    
     if order.delivery_type == DeliveryType.COURIER:
         old_status = order.status
-        order.status = OrderStatus.READY_FOR_PICKUP
+        # assembled_at выставляется в том же UPDATE
+        changed = await OrderService.transition_many(
+            session, [order.id], OrderStatus.ASSEMBLY, OrderStatus.READY_FOR_PICKUP,
+            actor_telegram_id=callback.from_user.id,
+        )
         await session.commit()
+        if not changed:
+            await callback.message.answer("⚠️ Статус заказа изменился, повторите действие.")
+            await callback.answer()
+            return
         await callback.message.answer("Статус обновлен: Готов к выдаче (Курьер).")
         
         # Уведомляем менеджера
@@ -331,6 +345,8 @@ async def ready_order(callback: types.CallbackQuery, state: FSMContext, session:
         await notify_couriers_about_order(callback.bot, order, session)
         
     elif order.delivery_type == DeliveryType.TAXI:
+        # 2. Update assembled_at timestamp to NOW (use datetime, not func.now())
+        order.assembled_at = datetime.now(timezone.utc)
         # Ask for tracking link
         await state.update_data(current_order_id=order.id)
         await callback.message.answer(f"🚕 Доставка Такси. Пришлите ссылку на трекинг для заказа #{order_id}:")
@@ -350,10 +366,19 @@ async def process_taxi_link(message: types.Message, state: FSMContext, session:
     
     if order:
         old_status = order.status
-        order.status = OrderStatus.DELIVERED
-        order.delivered_at = datetime.now(timezone.utc)
-        order.taxi_link = link
+        changed = await OrderService.transition_many(
+            session,
+            [order.id],
+            (OrderStatus.NEW, OrderStatus.ASSEMBLY, OrderStatus.READY_FOR_PICKUP),
+            OrderStatus.DELIVERED,
+            actor_telegram_id=message.from_user.id,
+            values={"taxi_link": link},
+        )
         await session.commit()
+        if not changed:
+            await message.answer(f"⚠️ Заказ #{order_id} уже закрыт или отменён.")
+            await state.clear()
+            return
         
         from services.notifications import notify_manager_about_order_status
         await notify_manager_about_order_status(
@@ -363,36 +388,40 @@ async def process_taxi_link(message: types.Message, state: FSMContext, session:
         # Notify Logic
         chat_id = order.clinic.telegram_chat_id
         if chat_id:
-            try:
-                await message.bot.send_message(chat_id, f"🚕 Ваш заказ #{order.id} едет к вам!\nСсылка: {link}")
+            if await enqueue_message(
+                message.bot, chat_id, f"🚕 Ваш заказ #{order.id} едет к вам!\nСсылка: {link}", urgent=True
+            ):
                 await message.answer("Врач уведомлен.")
-            except Exception as e:
-                logger.error("Failed to notify doctor %s for order %s: %s", chat_id, order.id, e)
-                await message.answer(f"Не удалось уведомить врача ({e}).")
+            else:
+                await message.answer("Не удалось уведомить врача.")
         
         # Additional logic: if doctor notification fails or not exists?
         # Prompt: "If ID exists -> Send to Doctor. If ID null -> Send to Manager"
         if not chat_id:
             manager_id = order.manager.telegram_id
-            try:
-                await message.bot.send_message(manager_id, f"🚕 Заказ #{order.id} отправлен на такси.\nПерешлите ссылку врачу: {link}")
+            if await enqueue_message(
+                message.bot, manager_id,
+                f"🚕 Заказ #{order.id} отправлен на такси.\nПерешлите ссылку врачу: {link}",
+                urgent=True,
+            ):
                 await message.answer("Менеджер уведомлен (у врача нет ID).")
-            except Exception as e:
-                logger.error("Failed to notify manager %s for order %s: %s", manager_id, order.id, e)
     
     await message.answer(f"✅ Заказ #{order_id} закрыт (Delivered).")
     await state.clear()
 
 
 async def notify_couriers_about_order(bot, order: Order, session: AsyncSession):
-    """Notify all active couriers about a new order ready for pickup"""
-    stmt = select(User).where(
+    """
+    Уведомить курьеров о заказе, готовом к выдаче: сначала ближайших к клинике,
+    остальных — если заказ не возьмут (services.courier_offers).
+    """
+    stmt = select(User.telegram_id).where(
         User.role == UserRole.COURIER,
         User.is_active == True
     )
     result = await session.execute(stmt)
-    couriers = result.scalars().all()
-    
+    courier_ids = result.scalars().all()
+
     clinic_name = escape_markdown(order.clinic.name if order.clinic else "—")
     clinic_addr = escape_markdown(order.clinic.address if order.clinic else "—")
     notification_text = (
@@ -403,16 +432,154 @@ async def notify_couriers_about_order(bot, order: Order, session: AsyncSession):
         f"{'🔥 СРОЧНО' if order.is_urgent else ''}"
     )
     
-    notified_count = 0
-    for courier in couriers:
-        try:
-            await bot.send_message(
-                courier.telegram_id,
-                notification_text,
-                parse_mode="Markdown"
-            )
-            notified_count += 1
-        except Exception as e:
-            logger.error("Failed to notify courier %s: %s", courier.telegram_id, e)
-    
-    logger.info("Notified %s/%s couriers about order #%s", notified_count, len(couriers), order.id)
+    # В очередь отправки: несколько готовых подряд заказов склеиваются в один
+    # дайджест на курьера, срочные уходят сразу; склад не ждёт
+    async def _send(telegram_id: int) -> bool:
+        return await notify_digest(
+            bot,
+            telegram_id,
+            "ready_for_pickup",
+            "📦 *Заказы готовы к доставке*",
+            f"#{order.id} — {clinic_name}, {clinic_addr}",
+            notification_text,
+            parse_mode="Markdown",
+            urgent=order.is_urgent,
+        )
+
+    # Курьер в пути, которому заказ почти по дороге, получает его первым —
+    # с местом в маршруте и обновлённой ссылкой; общей рассылки ему не шлём
+    insertion = active_routes.best_insertion(RouteStop.from_order(order), among=courier_ids) if order.clinic else None
+    if insertion is not None and insertion.detour_km <= config.COURIER_INSERT_MAX_DETOUR_KM:
+        url = generate_yandex_maps_url([{"lat": s.lat, "lon": s.lon} for s in insertion.stops])
+        insert_text = (
+            f"📦 *Заказ #{order.id} почти по пути*\n\n"
+            f"Клиника: {clinic_name}\n"
+            f"Адрес: {clinic_addr}\n"
+            f"Крюк ~{insertion.detour_km:.1f} км, встанет №{insertion.position + 1} в маршруте\n"
+            f"{'🔥 СРОЧНО' if order.is_urgent else ''}"
+        )
+        await enqueue_message(
+            bot,
+            insertion.telegram_id,
+            insert_text,
+            parse_mode="Markdown",
+            reply_markup=get_route_insert_kb(order.id, url),
+            urgent=order.is_urgent,
+        )
+        courier_ids = [telegram_id for telegram_id in courier_ids if telegram_id != insertion.telegram_id]
+
+    notified_count = await offer_order(
+        order.id,
+        order.clinic.geo_lat if order.clinic else None,
+        order.clinic.geo_lon if order.clinic else None,
+        courier_ids,
+        _send,
+        urgent=order.is_urgent,
+    )
+
+    logger.info("Queued notifications for %s/%s couriers about order #%s", notified_count, len(courier_ids), order.id)
+
+
+@router.callback_query(F.data == "warehouse:dispatch")
+async def warehouse_dispatch_routes(callback: types.CallbackQuery, session: AsyncSession):
+    """
+    Распределить все готовые заказы (курьерская доставка) между курьерами
+    с актуальной геолокацией и предложить каждому построенный маршрут.
+    """
+    if not await is_warehouse(callback.from_user.id, session):
+        await callback.answer("Доступ запрещен", show_alert=True)
+        return
+
+    result = await session.execute(
+        select(Order.id, Order.is_urgent, Order.clinic_id, Clinic.name, Clinic.geo_lat, Clinic.geo_lon)
+        .join(Clinic, Clinic.id == Order.clinic_id)
+        .where(
+            Order.status == OrderStatus.READY_FOR_PICKUP,
+            Order.delivery_type == DeliveryType.COURIER,
+        )
+        .order_by(Order.is_urgent.desc(), Order.created_at.asc())
+    )
+    rows = result.all()
+    if not rows:
+        await callback.answer("Нет заказов, готовых к выдаче курьером", show_alert=True)
+        return
+
+    couriers = (await session.execute(
+        select(User.id, User.telegram_id).where(User.role == UserRole.COURIER, User.is_active == True)
+    )).all()
+    # Заказы уже в доставке занимают вместимость курьера
+    busy = dict((await session.execute(
+        select(Order.courier_id, func.count())
+        .where(Order.status == OrderStatus.DELIVERING, Order.courier_id.is_not(None))
+        .group_by(Order.courier_id)
+    )).all())
+    plan_couriers = []
+    from_courier = set()  # курьеры, чей маршрут начинается от их геолокации
+    depot = None
+    if config.WAREHOUSE_LAT is not None and config.WAREHOUSE_LON is not None:
+        depot = (config.WAREHOUSE_LAT, config.WAREHOUSE_LON)
+    for user_id, telegram_id in couriers:
+        # Без свежей геолокации курьер начинает маршрут со склада (если он задан)
+        location = courier_locations.get(telegram_id)
+        if location is not None:
+            from_courier.add(telegram_id)
+        location = location or depot
+        capacity = config.COURIER_ROUTE_CAPACITY - busy.get(user_id, 0)
+        if location is not None and capacity > 0:
+            plan_couriers.append(PlanCourier(telegram_id, location[0], location[1], capacity))
+    if not plan_couriers:
+        await callback.answer(
+            "Нет свободных курьеров с актуальной геолокацией. "
+            "Курьер передаёт её кнопкой «🚀 Найти маршрут» или трансляцией.",
+            show_alert=True,
+        )
+        return
+
+    stops = [PlanStop(r.id, r.geo_lat, r.geo_lon, bool(r.is_urgent)) for r in rows]
+    info = {r.id: r for r in rows}
+    plan = await plan_dispatch(
+        plan_couriers, stops, stop_dist=clinic_matrix.submatrix([r.clinic_id for r in rows])
+    )
+
+    # Прежние предложения склада устарели: новое распределение заменяет их все
+    for _, telegram_id in couriers:
+        await route_store.revoke_offer(telegram_id)
+
+    for route in plan.routes:
+        start = "от вашей геолокации" if route.telegram_id in from_courier else "от склада"
+        lines = [f"🗺 *Маршрут {start}* ({len(route.order_ids)} зак., ~{route.km:.1f} км)\n"]
+        for idx, order_id in enumerate(route.order_ids, 1):
+            row = info[order_id]
+            icon = "🔥" if row.is_urgent else "🟢"
+            lines.append(f"{idx}. {icon} {escape_markdown(row.name)} (#{order_id})")
+        url = generate_yandex_maps_url([{"lat": info[i].geo_lat, "lon": info[i].geo_lon} for i in route.order_ids])
+        offer = StoredRoute(
+            [
+                StoredStop(i, info[i].geo_lat, info[i].geo_lon, info[i].clinic_id, bool(info[i].is_urgent))
+                for i in route.order_ids
+            ],
+            [],
+        )
+        route_id = await route_store.save_offer(route.telegram_id, offer)
+        await enqueue_message(
+            callback.bot,
+            route.telegram_id,
+            "\n".join(lines),
+            parse_mode="Markdown",
+            reply_markup=get_planned_route_kb(route_id, url, len(route.order_ids)),
+        )
+
+    text = (
+        f"🗺 *Маршруты распределены*\n\n"
+        f"Курьеров: {len(plan.routes)} из {len(plan_couriers)}\n"
+        f"Заказов: {len(rows) - len(plan.unassigned)} из {len(rows)}\n"
+        f"Суммарно ~{plan.total_km:.1f} км, самый длинный ~{plan.longest_km:.1f} км"
+    )
+    if plan.unassigned:
+        text += f"\n\n⚠️ Не хватило вместимости курьеров: {len(plan.unassigned)} зак."
+    await callback.message.answer(text, parse_mode="Markdown")
+    await callback.answer()
+    logger.info(
+        "Dispatch plan: %s orders, %s couriers, %.1f km, unassigned %s, %.0f ms",
+        len(rows), len(plan_couriers), plan.total_km, len(plan.unassigned), plan.elapsed_ms,
+    )
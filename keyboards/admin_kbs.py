@@ -105,6 +105,14 @@ def get_user_delete_confirm_kb(user_id: int) -> InlineKeyboardMarkup:
         ]
     )
 
+def get_users_next_page_kb(cursor: str) -> InlineKeyboardMarkup:
+    """Кнопка следующей страницы списка пользователей (курсор из services.pagination)."""
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(text="Следующие ▶", callback_data=f"admin:users:n:{cursor}")]
+        ]
+    )
+
 def get_clinics_list_kb(clinics) -> InlineKeyboardMarkup:
     """Клавиатура: список клиник для редактирования + кнопка добавления новой"""
     rows = []
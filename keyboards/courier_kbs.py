@@ -20,11 +20,13 @@ def get_route_action_kb(
     route_url: str = None,
     grouped_ids: list = None,
     distant_ids: list = None,
+    route_id: str = None,
 ) -> InlineKeyboardMarkup:
     """
     Клавиатура для действий с маршрутом.
     grouped_ids — заказы в групповом маршруте (близкие точки).
     distant_ids — отдельные заказы вдали (8+ км).
+    route_id — маршрут в services.route_store (список id в callback_data не влезает в 64 байта).
     """
     rows = []
     grouped_ids = grouped_ids or []
@@ -37,11 +39,10 @@ def get_route_action_kb(
                 InlineKeyboardButton(text="🗺 Открыть групповой маршрут", url=route_url)
             ])
         if len(grouped_ids) >= 2:
-            order_ids_str = ",".join(map(str, grouped_ids))
             rows.append([
                 InlineKeyboardButton(
                     text=f"✅ Взять групповой маршрут ({len(grouped_ids)} заказов)",
-                    callback_data=f"take_combined_route:{order_ids_str}"
+                    callback_data=f"take_combined_route:{route_id}"
                 )
             ])
         else:
@@ -63,6 +64,33 @@ def get_route_action_kb(
 
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
+def get_planned_route_kb(offer_key: str, route_url: str = None, count: int = 0) -> InlineKeyboardMarkup:
+    """Маршрут, построенный диспетчером для курьера: открыть на карте и взять."""
+    rows = []
+    if route_url:
+        rows.append([InlineKeyboardButton(text="🗺 Открыть маршрут", url=route_url)])
+    rows.append([
+        InlineKeyboardButton(
+            text=f"✅ Взять маршрут ({count} зак.)" if count else "✅ Взять маршрут",
+            callback_data=f"courier:plan:{offer_key}",
+        )
+    ])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+def get_route_insert_kb(order_id: int, route_url: str = None) -> InlineKeyboardMarkup:
+    """Готовый заказ по пути: открыть обновлённый маршрут и добавить заказ в него."""
+    rows = []
+    if route_url:
+        rows.append([InlineKeyboardButton(text="🗺 Маршрут с этим заказом", url=route_url)])
+    rows.append([
+        InlineKeyboardButton(text=f"➕ Добавить #{order_id} в маршрут", callback_data=f"courier:insert:{order_id}")
+    ])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+def get_route_url_kb(route_url: str) -> InlineKeyboardMarkup:
+    """Одна кнопка — обновлённый маршрут на карте."""
+    return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="🗺 Открыть маршрут", url=route_url)]])
+
 def get_single_orders_kb(order_ids: list, order_id_to_urgent: dict = None) -> InlineKeyboardMarkup:
     """Клавиатура со списком отдельных заказов. order_id_to_urgent: {order_id: is_urgent} для иконок."""
     rows = []
@@ -107,7 +135,10 @@ def get_delivery_kb(order_id: int, nav_url: str = None, route_number: int = None
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
 def get_combined_delivery_kb(order_ids: list, clinics: list) -> InlineKeyboardMarkup:
-    """Клавиатура для выбора клиники при доставке объединенного заказа. clinics: [{'order_id', 'name', 'is_urgent'?}]"""
+    """
+    Клавиатура для выбора клиники при доставке объединенного заказа. clinics: [{'order_id', 'name', 'is_urgent'?}]
+    При нескольких заказах — кнопка «Доставлено все» (один запрос на все оставшиеся).
+    """
     rows = []
     for clinic in clinics:
         icon = "🔥" if clinic.get('is_urgent') else "🟢"
@@ -117,6 +148,13 @@ def get_combined_delivery_kb(order_ids: list, clinics: list) -> InlineKeyboardMa
                 callback_data=f"combined_delivered:{clinic['order_id']}"
             )
         ])
+    if len(clinics) > 1:
+        rows.append([
+            InlineKeyboardButton(
+                text=f"✅ Доставлено все ({len(clinics)})",
+                callback_data="combined_delivered_all"
+            )
+        ])
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
 def get_courier_menu_kb() -> InlineKeyboardMarkup:
@@ -1768,19 +1768,19 @@ def _order_status_icon(status) -> str:
 
 def make_manager_orders_list_kb(
     orders: list,
-    page: int = 0,
-    per_page: int = 15,
-    total_count: int = 0,
+    prev_cursor: Optional[str] = None,
+    next_cursor: Optional[str] = None,
 ) -> InlineKeyboardMarkup:
     """
     Клавиатура заказов менеджера в виде кнопок.
     Каждая кнопка: [кружок статуса] #номер ФИО врача.
-    С пагинацией.
+    orders — строки с полями id, status, doctor_name.
+    С пагинацией по курсору (см. services.pagination).
     """
     rows = []
     for order in orders:
         icon = _order_status_icon(order.status)
-        doctor_name = (order.clinic.doctor_name or "—") if order.clinic else "—"
+        doctor_name = order.doctor_name or "—"
         # Ограничение текста кнопки ~60 символов (лимит Telegram)
         btn_text = f"{icon} #{order.id} {doctor_name}"[:60]
         rows.append([
@@ -1790,12 +1790,11 @@ def make_manager_orders_list_kb(
             )
         ])
     # Пагинация
-    total_pages = max(1, (total_count + per_page - 1) // per_page) if total_count else 1
     nav_row = []
-    if page > 0:
-        nav_row.append(InlineKeyboardButton(text="◀ Назад", callback_data=f"manager:orders:page:{page - 1}"))
-    if page < total_pages - 1:
-        nav_row.append(InlineKeyboardButton(text="Вперёд ▶", callback_data=f"manager:orders:page:{page + 1}"))
+    if prev_cursor:
+        nav_row.append(InlineKeyboardButton(text="◀ Назад", callback_data=f"manager:orders:p:{prev_cursor}"))
+    if next_cursor:
+        nav_row.append(InlineKeyboardButton(text="Вперёд ▶", callback_data=f"manager:orders:n:{next_cursor}"))
     if nav_row:
         rows.append(nav_row)
     rows.append([InlineKeyboardButton(text="🏠 В главное меню", callback_data="manager:main")])
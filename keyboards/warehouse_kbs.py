@@ -2,7 +2,7 @@ from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from database.models import Order, OrderStatus, OrderItem
 
 def get_warehouse_orders_list_kb(orders: list) -> InlineKeyboardMarkup:
-    """Список активных заказов в виде кнопок. При нажатии — детали заказа."""
+    """Список активных заказов в виде кнопок. При нажатии — детали заказа. Внизу — «Взять все новые»."""
     rows = []
     # По 2 кнопки в строке
     for i in range(0, len(orders), 2):
@@ -16,6 +16,12 @@ def get_warehouse_orders_list_kb(orders: list) -> InlineKeyboardMarkup:
                     callback_data=f"warehouse:order:{o.id}"
                 ))
         rows.append(row)
+    new_count = sum(1 for o in orders if o.status == OrderStatus.NEW)
+    if new_count:
+        rows.append([InlineKeyboardButton(
+            text=f"🛠 Взять все новые в работу ({new_count})",
+            callback_data="wh_take_all"
+        )])
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
 def get_warehouse_order_detail_kb(order_id: int, status: str, items: list = None) -> InlineKeyboardMarkup:
@@ -50,5 +56,6 @@ def get_warehouse_menu_kb() -> InlineKeyboardMarkup:
     """Главное меню склада"""
     rows = [
         [InlineKeyboardButton(text="📦 Активные заказы", callback_data="warehouse:orders")],
+        [InlineKeyboardButton(text="🗺 Распределить по курьерам", callback_data="warehouse:dispatch")],
     ]
     return InlineKeyboardMarkup(inline_keyboard=rows)
\ No newline at end of file
@@ -276,8 +276,16 @@ async def main():
         redis_client = None
     
     # Инициализируем кеш пользователей
-    from services.cache import init_cache
+    from services.cache import init_cache, stop_cache
     await init_cache(redis_client)
+    # Маршруты, предложенные курьерам (в FSM — только route_id)
+    from services.route_store import init_route_store
+    init_route_store(redis_client)
+    
+    # Очередь исходящих уведомлений (лимиты Telegram, приоритет срочных)
+    from services.notify_dispatcher import init_dispatcher, stop_dispatcher
+    await init_dispatcher(bot, redis_client)
+    from services.courier_offers import cancel_pending_offers
     
     dp = Dispatcher(storage=storage)
     
@@ -313,30 +321,71 @@ async def main():
             # Ничего страшного — главное, что залогировали
             pass
     
-    # Добавляем middleware
-    dp.message.middleware(DatabaseMiddleware())
-    dp.callback_query.middleware(DatabaseMiddleware())
-    
-    # Rate limiting через Redis или Memory
+    # Rate limiting через Redis или Memory — первым (outer, до фильтров):
+    # отклонённые апдейты не доходят ни до кеша пользователей, ни до БД
     from middlewares.rate_limit import create_rate_limit_middleware
     message_rate_limit = await create_rate_limit_middleware(
         redis_client=redis_client,
         max_calls=config.RATE_LIMIT_MESSAGE_MAX,
-        period=config.RATE_LIMIT_PERIOD
+        period=config.RATE_LIMIT_PERIOD,
+        name="message",
     )
     callback_rate_limit = await create_rate_limit_middleware(
         redis_client=redis_client,
         max_calls=config.RATE_LIMIT_CALLBACK_MAX,
-        period=config.RATE_LIMIT_PERIOD
+        period=config.RATE_LIMIT_PERIOD,
+        name="callback",
     )
-    dp.message.middleware(message_rate_limit)
-    dp.callback_query.middleware(callback_rate_limit)
+    dp.message.outer_middleware(message_rate_limit)
+    dp.callback_query.outer_middleware(callback_rate_limit)
+
+    # Пользователь апдейта (CachedUser) — один раз и до фильтров: data['identity']
+    from middlewares.auth_middleware import IdentityMiddleware
+    identity_middleware = IdentityMiddleware()
+    dp.message.outer_middleware(identity_middleware)
+    dp.callback_query.outer_middleware(identity_middleware)
+    dp.edited_message.outer_middleware(identity_middleware)
+
+    # Сессия БД — лениво, при первом обращении хендлера (счётчики — services.metrics)
+    from services.metrics import start_metrics, stop_metrics
+    start_metrics(redis_client)
+    dp.message.middleware(DatabaseMiddleware())
+    dp.callback_query.middleware(DatabaseMiddleware())
+    # Обновления live location курьеров (handlers.courier.track_live_location)
+    dp.edited_message.middleware(DatabaseMiddleware())
     
     # Запуск фоновой синхронизации 1С (polling)
     from services.one_c_sync import start_polling as start_1c_polling, stop_polling as stop_1c_polling
     from database.core import session_maker as db_session_maker
     start_1c_polling(session_maker=db_session_maker, interval=config.ONE_C_SYNC_INTERVAL)
 
+    # Шина событий заказов (Redis pub/sub между инстансами) и очередь склада в памяти
+    from services.order_bus import init_order_bus, stop_order_bus
+    from services.warehouse_queue import start_reconcile as start_wh_queue, stop_reconcile as stop_wh_queue
+    await init_order_bus(redis_client)
+    start_wh_queue(session_maker=db_session_maker, interval=config.WAREHOUSE_QUEUE_RECONCILE_INTERVAL)
+
+    # Маршруты курьеров в памяти процесса — восстановить из заказов в доставке
+    from services.active_routes import restore_routes
+    await restore_routes(db_session_maker)
+
+    # Офлайн-граф дорог (если задан) — провайдер расстояний вместо прямой
+    if config.ROAD_GRAPH_PATH:
+        try:
+            from services.road_graph import load_provider
+            from services.routing import set_distance_provider
+            set_distance_provider(await asyncio.to_thread(
+                load_provider, config.ROAD_GRAPH_PATH, config.ROAD_SNAP_MAX_KM, config.ROAD_PAIR_CACHE_SIZE,
+            ))
+        except Exception:
+            logger.warning("Road graph %s is not available, using straight-line distances", config.ROAD_GRAPH_PATH, exc_info=True)
+
+    # Матрица расстояний между клиниками и складом (для маршрутов курьеров);
+    # первый расчёт по графу дорог может занять минуты — в фоне. Через Redis
+    # инстансы обмениваются пересчитанными строками клиник
+    from services.clinic_matrix import start_loading as start_clinic_matrix, stop_loading as stop_clinic_matrix
+    start_clinic_matrix(session_maker=db_session_maker, redis_client=redis_client)
+
     # Include routers (fallback — последним, ловит необработанные обновления)
     dp.include_router(start.router)
     dp.include_router(admin.router)
@@ -378,7 +427,7 @@ async def main():
             try:
                 await dp.start_polling(
                     bot,
-                    allowed_updates=["message", "callback_query"],
+                    allowed_updates=["message", "edited_message", "callback_query"],
                     drop_pending_updates=True
                 )
                 break  # нормальная остановка polling
@@ -397,6 +446,13 @@ async def main():
     finally:
         logger.info("Closing connections...")
         stop_1c_polling()
+        stop_wh_queue()
+        stop_clinic_matrix()
+        stop_order_bus()
+        stop_cache()
+        cancel_pending_offers()
+        await stop_dispatcher()
+        await stop_metrics()
         await bot.session.close()
         if redis_client is not None:
             try:
@@ -1,25 +1,96 @@
 """
 Authentication and authorization middleware for role-based access control.
+
+IdentityMiddleware находит пользователя апдейта (CachedUser: роль, активность,
+id в БД) один раз — в кеше, при промахе в БД — и кладёт его в data['identity']
+и services.cache.acting_user. Фильтры ролей, RoleRequiredMiddleware,
+check_role и хендлеры берут пользователя оттуда, без повторных запросов.
 """
 import logging
-from typing import Callable, Dict, Any, Awaitable
+from typing import Callable, Dict, Any, Awaitable, Optional
 from aiogram import BaseMiddleware
-from aiogram.types import TelegramObject, Message, CallbackQuery
-from sqlalchemy.ext.asyncio import AsyncSession
+from aiogram.filters import BaseFilter
+from aiogram.types import TelegramObject, Message, CallbackQuery, User as TelegramUser
+from sqlalchemy.exc import OperationalError
+from database.core import session_maker
 from services.db_ops import get_user_by_telegram_id
-from services.cache import user_cache
+from services.cache import CachedUser, acting_user, user_cache
 from database.models import UserRole
 from config import config
 
 logger = logging.getLogger(__name__)
 
 
+async def resolve_identity(telegram_id: int) -> Optional[CachedUser]:
+    """Пользователь из кеша; при промахе — из БД (короткая сессия), кеш заполняется."""
+    cached = await user_cache.get(telegram_id)
+    if cached is not None:
+        return cached
+    try:
+        async with session_maker() as session:
+            user = await get_user_by_telegram_id(session, telegram_id)
+    except (OperationalError, ConnectionRefusedError, OSError) as e:
+        # Ошибку БД покажет пользователю DatabaseMiddleware
+        logger.warning("Identity lookup failed for user %s: %s", telegram_id, e)
+        return None
+    return CachedUser.from_orm(user) if user is not None else None
+
+
+class IdentityMiddleware(BaseMiddleware):
+    """
+    Outer-middleware: пользователь апдейта до фильтров (RoleFilter читает
+    data['identity']). Регистрируется через dp.<event>.outer_middleware.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        from_user: Optional[TelegramUser] = data.get("event_from_user")
+        identity = await resolve_identity(from_user.id) if from_user is not None else None
+        data["identity"] = identity
+        token = acting_user.set(identity)
+        try:
+            return await handler(event, data)
+        finally:
+            acting_user.reset(token)
+
+
+class RoleFilter(BaseFilter):
+    """
+    Декларативная проверка роли по data['identity'] (без сессии и запросов):
+        router.callback_query.filter(RoleFilter(UserRole.COURIER))
+    Несколько ролей — любая из них; admin_allowed — пропускать ADMIN_IDS.
+    """
+
+    def __init__(self, *roles: UserRole, admin_allowed: bool = False):
+        self.roles = frozenset(roles)
+        self.admin_allowed = admin_allowed
+
+    async def __call__(
+        self,
+        obj: TelegramObject,
+        identity: Optional[CachedUser] = None,
+        event_from_user: Optional[TelegramUser] = None,
+    ) -> bool:
+        if event_from_user is None:
+            return False
+        if self.admin_allowed and event_from_user.id in config.ADMIN_IDS_LIST:
+            return True
+        if identity is None or not identity.is_active:
+            return False
+        return not self.roles or identity.role in self.roles
+
+
 class RoleRequiredMiddleware(BaseMiddleware):
     """
     Middleware that checks if user has required role and is active.
     Can be applied to specific routers or handlers.
+    Пользователь берётся из data['identity'] (IdentityMiddleware).
     """
-    
+
     def __init__(self, required_role: UserRole | None = None, admin_allowed: bool = False):
         """
         Args:
@@ -28,44 +99,35 @@ class RoleRequiredMiddleware(BaseMiddleware):
         """
         self.required_role = required_role
         self.admin_allowed = admin_allowed
-    
+
     async def __call__(
         self,
         handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
         event: TelegramObject,
         data: Dict[str, Any]
     ) -> Any:
-        # Extract user ID from event
-        user_id = None
-        if isinstance(event, Message):
-            user_id = event.from_user.id if event.from_user else None
-        elif isinstance(event, CallbackQuery):
-            user_id = event.from_user.id if event.from_user else None
-        
-        if not user_id:
+        from_user: Optional[TelegramUser] = data.get("event_from_user")
+        if from_user is None:
             logger.warning("No user ID found in event")
             return await handler(event, data)
-        
+        user_id = from_user.id
+
         # Check if user is admin (admins bypass role checks if admin_allowed=True)
-        is_admin = user_id in config.ADMIN_IDS
-        if self.admin_allowed and is_admin:
-            return await handler(event, data)
-        
-        # Получаем сессию из data (должна быть добавлена DatabaseMiddleware)
-        session: AsyncSession = data.get('session')
-        if not session:
-            logger.error("Session not found in data. DatabaseMiddleware must be registered.")
+        if self.admin_allowed and user_id in config.ADMIN_IDS_LIST:
             return await handler(event, data)
-        
-        # Check user role and active status (с использованием кеша)
-        user = await get_user_by_telegram_id(session, user_id, use_cache=True)
-        
+
+        if "identity" in data:
+            user = data["identity"]
+        else:
+            logger.error("Identity not found in data. IdentityMiddleware must be registered.")
+            user = await resolve_identity(user_id)
+
         if not user:
             logger.warning("User %s not found in database", user_id)
             if isinstance(event, CallbackQuery):
                 await event.answer("❌ Пользователь не найден в системе.", show_alert=True)
             return
-        
+
         if not user.is_active:
             logger.warning("User %s is not active", user_id)
             if isinstance(event, CallbackQuery):
@@ -73,7 +135,7 @@ class RoleRequiredMiddleware(BaseMiddleware):
             elif isinstance(event, Message):
                 await event.answer("❌ Ваш аккаунт не активирован. Ожидайте подтверждения администратора.")
             return
-        
+
         # Check role if required
         if self.required_role and user.role != self.required_role:
             logger.warning("User %s (role: %s) attempted to access %s resource", user_id, user.role, self.required_role)
@@ -82,46 +144,16 @@ class RoleRequiredMiddleware(BaseMiddleware):
             elif isinstance(event, Message):
                 await event.answer(f"❌ Доступ запрещен. Требуется роль: {self.required_role.value}")
             return
-        
-        # Store user in data for handler access
+
+        # Store user in data for handler access (CachedUser, не ORM)
         data['user'] = user
         return await handler(event, data)
 
 
-def create_role_filter(required_role: UserRole, admin_allowed: bool = False):
+def create_role_filter(required_role: UserRole, admin_allowed: bool = False) -> RoleFilter:
     """
     Factory function to create a filter for specific role.
     Usage in router:
-        router.message.register(handler, RoleFilter(UserRole.MANAGER))
+        router.message.register(handler, create_role_filter(UserRole.MANAGER))
     """
-    from aiogram.filters import BaseFilter
-    
-    class RoleFilter(BaseFilter):
-        async def __call__(self, obj: TelegramObject, *args) -> bool:
-            user_id = None
-            if isinstance(obj, Message):
-                user_id = obj.from_user.id if obj.from_user else None
-            elif isinstance(obj, CallbackQuery):
-                user_id = obj.from_user.id if obj.from_user else None
-            
-            if not user_id:
-                return False
-            
-            # Admins bypass if allowed
-            if admin_allowed and user_id in config.ADMIN_IDS_LIST:
-                return True
-            
-            # Note: This filter should be used with DatabaseMiddleware
-            # Session should be in data, but for filters we might need to get it differently
-            # For now, keeping the old approach but with cache
-            from database.core import session_maker
-            async with session_maker() as session:
-                user = await get_user_by_telegram_id(session, user_id, use_cache=True)
-                if not user or not user.is_active:
-                    return False
-                if user.role == required_role:
-                    return True
-                return False
-    
-    return RoleFilter()
-
+    return RoleFilter(required_role, admin_allowed=admin_allowed)
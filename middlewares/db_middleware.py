@@ -2,27 +2,64 @@
 Middleware для dependency injection сессий БД.
 """
 import logging
-from typing import Callable, Dict, Any, Awaitable
+from typing import Callable, Dict, Any, Awaitable, Optional
 from aiogram import BaseMiddleware
 from aiogram.types import TelegramObject, Message, CallbackQuery
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import OperationalError
 from database.core import session_maker
+from services import metrics
 
 logger = logging.getLogger(__name__)
 
 
+class LazySession:
+    """
+    Сессия БД, которая создаётся при первом обращении к ней (session.execute,
+    session.add, ...). Хендлеры, обслуживаемые из памяти (навигация, noop,
+    проверка роли по data['identity']), сессию не открывают совсем.
+    """
+
+    __slots__ = ("_session", "touched")
+
+    def __init__(self) -> None:
+        self._session: Optional[AsyncSession] = None
+        self.touched = False  # сессия создавалась (апдейт обращался к БД)
+
+    def __getattr__(self, name: str) -> Any:
+        if self._session is None:
+            self._session = session_maker()
+            self.touched = True
+        return getattr(self._session, name)
+
+    async def close(self) -> None:
+        if self._session is not None:
+            session, self._session = self._session, None
+            await session.close()
+
+    async def __aenter__(self) -> "LazySession":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+
 class DatabaseMiddleware(BaseMiddleware):
-    """Middleware для автоматического создания и закрытия сессий БД."""
-    
+    """
+    Middleware для ленивого создания и закрытия сессий БД: сессия (и соединение
+    из пула) появляется при первом использовании и закрывается сразу после
+    хендлера. Считает апдейты всего / с обращением к БД (services.metrics).
+    """
+
     async def __call__(
         self,
         handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
         event: TelegramObject,
         data: Dict[str, Any]
     ) -> Any:
+        session = LazySession()
         try:
-            async with session_maker() as session:
+            async with session:
                 data['session'] = session
                 return await handler(event, data)
         except (OperationalError, ConnectionRefusedError, OSError) as e:
@@ -40,4 +77,7 @@ class DatabaseMiddleware(BaseMiddleware):
                 except Exception:
                     pass
             return
-
+        finally:
+            metrics.incr("updates_total")
+            if session.touched:
+                metrics.incr("updates_db")
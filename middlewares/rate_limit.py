@@ -1,145 +1,224 @@
 """
 Rate limiting middleware с поддержкой Redis для multi-instance окружений.
+
+Лимит — max_calls за period на пользователя, умноженный на множитель его
+роли (config.RATE_LIMIT_ROLE_FACTORS). Роль берётся из памяти кеша
+пользователей (user_cache.peek, без I/O): middleware стоит раньше
+IdentityMiddleware, и отклонённый апдейт не должен доходить до кеша и БД.
+Неизвестный пользователь — базовый лимит.
+
+Счётчики пропущенных / отклонённых апдейтов по ролям — в self.counters
+и services.metrics (rate_limit_allowed:<роль>, rate_limit_rejected:<роль>).
 """
-from typing import Callable, Dict, Any, Awaitable, Optional
+from collections import Counter, deque
+from typing import Callable, Deque, Dict, Any, Awaitable, Optional
 from aiogram import BaseMiddleware
-from aiogram.types import TelegramObject, Message, CallbackQuery
+from aiogram.types import TelegramObject, Message, CallbackQuery, User as TelegramUser
 import time
 import logging
 
+from config import config
+from services import metrics
+from services.cache import user_cache
+
 logger = logging.getLogger(__name__)
 
+# Роль для пользователей, которых нет в памяти кеша
+UNKNOWN_ROLE = "unknown"
+
+# Token bucket за один вызов: KEYS[1] — хеш (t — токены, ts — время пополнения),
+# ARGV: ёмкость, токенов в секунду, TTL ключа. Время — TIME сервера Redis
+# (часы инстансов могут расходиться).
+_TOKEN_BUCKET_LUA = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 't', 'ts')
+local tokens = tonumber(state[1])
+local ts = tonumber(state[2])
+if tokens == nil or ts == nil then
+    tokens = capacity
+else
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+end
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 't', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return allowed
+"""
+
+
+class _RateLimitBase(BaseMiddleware):
+    """Общее: лимиты по ролям, счётчики и ответ при превышении."""
+
+    def __init__(self, max_calls: int, period: float, name: str):
+        self.max_calls = max_calls
+        self.period = period
+        self.name = name
+        self.role_factors = config.RATE_LIMIT_ROLE_FACTORS_MAP
+        # (роль, "allowed" | "rejected") -> количество
+        self.counters: Counter = Counter()
+
+    def role_of(self, user_id: int) -> str:
+        cached = user_cache.peek(user_id)
+        return cached.role.value if cached is not None else UNKNOWN_ROLE
+
+    def limit_for(self, role: str) -> int:
+        """Максимум апдейтов за period для роли."""
+        return max(1, int(self.max_calls * self.role_factors.get(role, 1.0)))
+
+    def _count(self, role: str, allowed: bool) -> None:
+        outcome = "allowed" if allowed else "rejected"
+        self.counters[(role, outcome)] += 1
+        metrics.incr(f"rate_limit_{outcome}:{role}")
+
+    @staticmethod
+    async def _reject(event: TelegramObject) -> None:
+        if isinstance(event, CallbackQuery):
+            await event.answer("⚠️ Слишком много запросов. Подождите немного.", show_alert=True)
+        elif isinstance(event, Message):
+            await event.answer("⚠️ Слишком много запросов. Подождите немного.")
+
+    async def _allow(self, user_id: int, role: str) -> bool:
+        raise NotImplementedError
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        from_user: Optional[TelegramUser] = data.get("event_from_user")
+        if from_user is None:
+            return await handler(event, data)
+
+        role = self.role_of(from_user.id)
+        allowed = await self._allow(from_user.id, role)
+        self._count(role, allowed)
+        if not allowed:
+            await self._reject(event)
+            return
+        return await handler(event, data)
+
+
+class RedisRateLimitMiddleware(_RateLimitBase):
+    """
+    Ограничение количества запросов через Redis: token bucket (ёмкость —
+    лимит роли, пополнение — лимит / period в секунду) одним Lua-скриптом,
+    за один round trip и атомарно (TTL ставится тем же скриптом).
+    """
 
-class RedisRateLimitMiddleware(BaseMiddleware):
-    """Ограничение количества запросов через Redis."""
-    
     def __init__(
         self,
         redis_client,
         max_calls: int = 10,
         period: float = 60.0,
-        key_prefix: str = "rate_limit:"
+        key_prefix: str = "rate_limit:",
+        name: str = "default",
     ):
         """
         Args:
             redis_client: Клиент Redis (async)
-            max_calls: Максимальное количество запросов за период
+            max_calls: Максимальное количество запросов за период (базовый лимит)
             period: Период в секундах
             key_prefix: Префикс для ключей Redis
+            name: Имя лимитера (message / callback) — часть ключа
         """
+        super().__init__(max_calls, period, name)
         self.redis = redis_client
-        self.max_calls = max_calls
-        self.period = int(period)
         self.key_prefix = key_prefix
-    
+        self._script = redis_client.register_script(_TOKEN_BUCKET_LUA)
+
     def _key(self, user_id: int) -> str:
         """Генерация ключа для Redis."""
-        return f"{self.key_prefix}{user_id}"
-    
-    async def __call__(
-        self,
-        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
-        event: TelegramObject,
-        data: Dict[str, Any]
-    ) -> Any:
-        user_id = None
-        if isinstance(event, Message):
-            user_id = event.from_user.id if event.from_user else None
-        elif isinstance(event, CallbackQuery):
-            user_id = event.from_user.id if event.from_user else None
-        
-        if not user_id:
-            return await handler(event, data)
-        
+        return f"{self.key_prefix}{self.name}:{user_id}"
+
+    async def _allow(self, user_id: int, role: str) -> bool:
+        limit = self.limit_for(role)
         try:
-            key = self._key(user_id)
-            # Используем INCR и EXPIRE для атомарной операции
-            current = await self.redis.incr(key)
-            if current == 1:
-                # Первый запрос - устанавливаем TTL
-                await self.redis.expire(key, self.period)
-            
-            if current > self.max_calls:
-                # Превышен лимит
-                if isinstance(event, CallbackQuery):
-                    await event.answer("⚠️ Слишком много запросов. Подождите немного.", show_alert=True)
-                elif isinstance(event, Message):
-                    await event.answer("⚠️ Слишком много запросов. Подождите немного.")
-                return
-        
-            return await handler(event, data)
+            allowed = await self._script(
+                keys=[self._key(user_id)],
+                args=[limit, limit / self.period, max(1, int(self.period))],
+            )
+            return bool(int(allowed))
         except Exception as e:
             logger.warning("Rate limit error for user %s: %s", user_id, e)
             # При ошибке Redis пропускаем запрос
-            return await handler(event, data)
+            return True
 
 
-class MemoryRateLimitMiddleware(BaseMiddleware):
-    """In-memory rate limiting (fallback)."""
-    
-    def __init__(self, max_calls: int = 10, period: float = 60.0):
+class MemoryRateLimitMiddleware(_RateLimitBase):
+    """
+    In-memory rate limiting (fallback): скользящее окно на deque фиксированной
+    длины (лимит роли) — проверка и запись за O(1). Пользователи, молчащие
+    дольше period, удаляются раз в period.
+    """
+
+    def __init__(self, max_calls: int = 10, period: float = 60.0, name: str = "default"):
         """
         Args:
-            max_calls: Максимальное количество запросов за период
+            max_calls: Максимальное количество запросов за период (базовый лимит)
             period: Период в секундах
+            name: Имя лимитера (message / callback)
         """
-        self.max_calls = max_calls
-        self.period = period
-        from collections import defaultdict
-        self.calls = defaultdict(list)
-    
-    async def __call__(
-        self,
-        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
-        event: TelegramObject,
-        data: Dict[str, Any]
-    ) -> Any:
-        user_id = None
-        if isinstance(event, Message):
-            user_id = event.from_user.id if event.from_user else None
-        elif isinstance(event, CallbackQuery):
-            user_id = event.from_user.id if event.from_user else None
-        
-        if not user_id:
-            return await handler(event, data)
-        
-        now = time.time()
-        user_calls = self.calls[user_id]
-        # Удаляем старые записи
-        user_calls[:] = [t for t in user_calls if now - t < self.period]
-        
-        if len(user_calls) >= self.max_calls:
-            if isinstance(event, CallbackQuery):
-                await event.answer("⚠️ Слишком много запросов. Подождите немного.", show_alert=True)
-            elif isinstance(event, Message):
-                await event.answer("⚠️ Слишком много запросов. Подождите немного.")
-            return
-        
-        user_calls.append(now)
-        return await handler(event, data)
+        super().__init__(max_calls, period, name)
+        self.calls: Dict[int, Deque[float]] = {}
+        self._next_sweep = time.monotonic() + period
+
+    def _sweep(self, now: float) -> None:
+        idle = [user_id for user_id, calls in self.calls.items() if now - calls[-1] >= self.period]
+        for user_id in idle:
+            del self.calls[user_id]
+        self._next_sweep = now + self.period
+
+    async def _allow(self, user_id: int, role: str) -> bool:
+        now = time.monotonic()
+        if now >= self._next_sweep:
+            self._sweep(now)
+
+        limit = self.limit_for(role)
+        calls = self.calls.get(user_id)
+        if calls is None:
+            calls = self.calls[user_id] = deque(maxlen=limit)
+        elif calls.maxlen != limit:
+            # Сменилась роль — окно другой длины (последние запросы сохраняются)
+            calls = self.calls[user_id] = deque(calls, maxlen=limit)
+
+        # Окно заполнено и самый старый запрос ещё в периоде — лимит исчерпан
+        if len(calls) == limit and now - calls[0] < self.period:
+            return False
+        calls.append(now)
+        return True
 
 
 async def create_rate_limit_middleware(
     redis_client=None,
     max_calls: int = 10,
-    period: float = 60.0
+    period: float = 60.0,
+    name: str = "default",
 ) -> RedisRateLimitMiddleware | MemoryRateLimitMiddleware:
     """
     Создать middleware для rate limiting.
-    
+
     Args:
         redis_client: Клиент Redis (опционально)
-        max_calls: Максимальное количество запросов
+        max_calls: Максимальное количество запросов (базовый лимит, см. RATE_LIMIT_ROLE_FACTORS)
         period: Период в секундах
-        
+        name: Имя лимитера — у сообщений и callback отдельные счётчики
+
     Returns:
         Экземпляр middleware (Redis или Memory)
     """
     if redis_client:
         try:
             await redis_client.ping()
-            return RedisRateLimitMiddleware(redis_client, max_calls, period)
+            return RedisRateLimitMiddleware(redis_client, max_calls, period, name=name)
         except Exception as e:
             logger.warning("Redis not available for rate limiting, using memory: %s", e)
-    
-    return MemoryRateLimitMiddleware(max_calls, period)
+
+    return MemoryRateLimitMiddleware(max_calls, period, name=name)
@@ -0,0 +1,248 @@
+"""
+Активные маршруты курьеров и дозаказ по пути (вставка в маршрут).
+
+Когда курьер берёт маршрут или заказ, его оставшиеся остановки запоминаются
+здесь по порядку. Доставленные, отменённые и возвращённые заказы убираются
+по событиям services.order_bus — маршрут всегда «остаток пути».
+
+Когда заказ становится готовым к выдаче, best_insertion за один проход
+оценивает самую дешёвую вставку его клиники в маршрут каждого курьера
+(крюк = d(prev, new) + d(new, next) - d(prev, next); маршрут открытый,
+от текущей точки курьера) и выбирает курьера с наименьшим крюком.
+Расстояния между клиниками — из services.clinic_matrix (если загружена),
+от точки курьера — по прямой: она меняется с каждой трансляцией геолокации.
+Отрезки маршрута и расстояния до новой клиники всегда из одного источника:
+когда матрица загружается или меняется строка клиники, отрезки
+пересчитываются; маршрут, для которого в матрице нет пар, сравнивается
+по прямой целиком.
+
+Хранится в памяти процесса, принимающего апдейты Telegram (он один:
+getUpdates не допускает параллельных потребителей), как и
+services.courier_locations. После перезапуска маршруты восстанавливаются
+из БД (restore_routes — заказы в статусе DELIVERING), удаление
+доставленных приходит и от других процессов через order_bus.
+"""
+from __future__ import annotations
+
+import logging
+import time
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import contains_eager
+
+from config import config
+from database.models import Order, OrderSla, OrderStatus, User
+from services.clinic_matrix import clinic_matrix
+from services.courier_locations import courier_locations
+from services.order_bus import OrderChange, subscribe
+from services.routing import haversine_matrix, haversine_pairs
+
+logger = logging.getLogger(__name__)
+
+
+class RouteStop(NamedTuple):
+    """Остановка маршрута: заказ и его клиника."""
+    order_id: int
+    clinic_id: int
+    lat: float
+    lon: float
+
+    @classmethod
+    def from_order(cls, order: Order) -> "RouteStop":
+        return cls(order.id, order.clinic_id, order.clinic.geo_lat, order.clinic.geo_lon)
+
+
+class Insertion(NamedTuple):
+    """Лучшая вставка заказа в маршрут курьера."""
+    telegram_id: int
+    position: int               # индекс новой остановки в маршруте (0 — первой)
+    detour_km: float
+    stops: List[RouteStop]      # маршрут после вставки
+
+
+def _leg_km(stops: Sequence[RouteStop]) -> Tuple[np.ndarray, bool]:
+    """Км между соседними остановками и True, если по матрице клиник (иначе по прямой)."""
+    if len(stops) < 2:
+        # Одна остановка: отрезков нет, сравнивать можно с любым источником
+        return np.zeros(0), clinic_matrix.loaded
+    sub = clinic_matrix.submatrix([s.clinic_id for s in stops])
+    if sub is not None:
+        return sub[np.arange(len(stops) - 1), np.arange(1, len(stops))], True
+    points = np.array([(s.lat, s.lon) for s in stops], dtype=np.float64)
+    return haversine_pairs(points, np.arange(len(stops) - 1), np.arange(1, len(stops))), False
+
+
+class ActiveRoutes:
+    """telegram_id курьера -> оставшиеся остановки по порядку."""
+
+    def __init__(self) -> None:
+        self._routes: Dict[int, List[RouteStop]] = {}
+        # Км между соседними остановками — пересчитываются при изменении маршрута
+        # и матрицы клиник; _road — отрезки по матрице (иначе по прямой)
+        self._legs: Dict[int, np.ndarray] = {}
+        self._road: Dict[int, bool] = {}
+        self._owner: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._routes)
+
+    def get(self, telegram_id: int) -> List[RouteStop]:
+        return list(self._routes.get(telegram_id, []))
+
+    def _set(self, telegram_id: int, stops: List[RouteStop]) -> None:
+        if not stops:
+            self._routes.pop(telegram_id, None)
+            self._legs.pop(telegram_id, None)
+            self._road.pop(telegram_id, None)
+            return
+        self._routes[telegram_id] = stops
+        self._legs[telegram_id], self._road[telegram_id] = _leg_km(stops)
+        for stop in stops:
+            self._owner[stop.order_id] = telegram_id
+
+    def refresh_legs(self) -> None:
+        """Матрица клиник загружена или изменилась — пересчитать отрезки всех маршрутов."""
+        for telegram_id, stops in self._routes.items():
+            self._legs[telegram_id], self._road[telegram_id] = _leg_km(stops)
+
+    def replace_all(self, routes: Dict[int, List[RouteStop]]) -> None:
+        """Заменить все маршруты (восстановление из БД)."""
+        self._routes, self._legs, self._road, self._owner = {}, {}, {}, {}
+        for telegram_id, stops in routes.items():
+            self._set(telegram_id, stops)
+
+    def add(self, telegram_id: int, stops: Sequence[RouteStop]) -> None:
+        """Курьер взял заказы: добавить их в конец его маршрута."""
+        for stop in stops:
+            self.remove_order(stop.order_id)
+        self._set(telegram_id, self.get(telegram_id) + list(stops))
+
+    def remove_order(self, order_id: int) -> None:
+        """Заказ доставлен или больше не в доставке — убрать из маршрута."""
+        telegram_id = self._owner.pop(order_id, None)
+        if telegram_id is None:
+            return
+        self._set(telegram_id, [s for s in self._routes.get(telegram_id, []) if s.order_id != order_id])
+
+    def _best_position(self, telegram_id: int, to_new: np.ndarray, start_delta: float) -> tuple[float, int]:
+        """
+        (крюк км, позиция) лучшей вставки в маршрут; to_new — км от новой точки
+        до остановок, start_delta — насколько длиннее путь курьер -> новая -> первая.
+        """
+        # Позиция p: между stops[p-1] (или курьером) и stops[p] (или концом маршрута)
+        detour = np.empty(len(to_new) + 1)
+        detour[0] = to_new[0] + start_delta
+        detour[1:-1] = to_new[:-1] + to_new[1:] - self._legs[telegram_id]
+        detour[-1] = to_new[-1]
+        p = int(detour.argmin())
+        return float(detour[p]), p
+
+    def best_insertion(
+        self,
+        stop: RouteStop,
+        among: Optional[Sequence[int]] = None,
+        max_stops: Optional[int] = None,
+    ) -> Optional[Insertion]:
+        """
+        Курьер с наименьшим крюком ради stop и место вставки.
+        among — только эти курьеры; max_stops — не предлагать тем,
+        у кого в маршруте уже столько остановок (по умолчанию COURIER_ROUTE_CAPACITY).
+        """
+        t0 = time.perf_counter()
+        max_stops = config.COURIER_ROUTE_CAPACITY if max_stops is None else max_stops
+        allowed = set(among) if among is not None else None
+        candidates = [
+            telegram_id for telegram_id, stops in self._routes.items()
+            if len(stops) < max_stops and (allowed is None or telegram_id in allowed)
+        ]
+        if not candidates:
+            return None
+
+        # Км от новой клиники до всех остановок всех маршрутов — одним запросом;
+        # маршрутам с отрезками по прямой — тоже по прямой
+        flat = [s for telegram_id in candidates for s in self._routes[telegram_id]]
+        road_new = clinic_matrix.row(stop.clinic_id, [s.clinic_id for s in flat])
+        straight_new = None
+        if road_new is None or not all(self._road[telegram_id] for telegram_id in candidates):
+            straight_new = haversine_matrix((stop.lat, stop.lon), [(s.lat, s.lon) for s in flat])[0]
+
+        # Курьер -> новая -> первая вместо курьер -> первая (по прямой);
+        # без точки курьера маршрут считается от первой остановки
+        start_delta = np.zeros(len(candidates))
+        starts = [courier_locations.get(telegram_id) for telegram_id in candidates]
+        known = [k for k, start in enumerate(starts) if start is not None]
+        if known:
+            m = len(known)
+            start_points = np.array([starts[k] for k in known], dtype=np.float64)
+            first = np.array([self._routes[candidates[k]][0][2:] for k in known], dtype=np.float64)  # (lat, lon)
+            to_first = haversine_pairs(np.vstack([start_points, first]), np.arange(m), np.arange(m, 2 * m))
+            start_delta[known] = haversine_matrix((stop.lat, stop.lon), start_points)[0] - to_first
+
+        best: Optional[tuple[float, int, int]] = None
+        offset = 0
+        for k, telegram_id in enumerate(candidates):
+            n = len(self._routes[telegram_id])
+            to_new = road_new if road_new is not None and self._road[telegram_id] else straight_new
+            detour, position = self._best_position(telegram_id, to_new[offset:offset + n], start_delta[k])
+            offset += n
+            if best is None or detour < best[0]:
+                best = (detour, position, telegram_id)
+
+        detour, position, telegram_id = best
+        stops = self.get(telegram_id)
+        stops.insert(position, stop)
+        logger.debug(
+            "Insertion of order #%s: %s routes, best %.2f km (courier %s), %.2f ms",
+            stop.order_id, len(candidates), detour, telegram_id, (time.perf_counter() - t0) * 1000,
+        )
+        return Insertion(telegram_id, position, detour, stops)
+
+    def insert(self, telegram_id: int, stop: RouteStop) -> Insertion:
+        """Курьер принял заказ по пути: вставить в лучшее место его маршрута."""
+        self.remove_order(stop.order_id)
+        insertion = self.best_insertion(stop, among=[telegram_id], max_stops=len(self._routes.get(telegram_id, [])) + 1)
+        if insertion is None:
+            # Маршрута нет (всё доставлено) — заказ становится маршрутом
+            insertion = Insertion(telegram_id, 0, 0.0, [stop])
+        self._set(telegram_id, insertion.stops)
+        return insertion
+
+
+active_routes = ActiveRoutes()
+
+
+async def restore_routes(session_maker) -> None:
+    """
+    Восстановить маршруты из БД после перезапуска (вызывать из main.py):
+    заказы в доставке по курьерам, в порядке взятия.
+    """
+    try:
+        async with session_maker() as session:
+            result = await session.execute(
+                select(Order, User.telegram_id)
+                .join(User, User.id == Order.courier_id)
+                .join(Order.clinic)
+                .outerjoin(OrderSla, OrderSla.order_id == Order.id)
+                .options(contains_eager(Order.clinic))
+                .where(Order.status == OrderStatus.DELIVERING)
+                .order_by(User.telegram_id, OrderSla.pickup_ts.is_(None), OrderSla.pickup_ts, Order.id)
+            )
+            routes: Dict[int, List[RouteStop]] = {}
+            for order, telegram_id in result.all():
+                routes.setdefault(telegram_id, []).append(RouteStop.from_order(order))
+    except Exception:
+        logger.warning("Active routes were not restored from the database", exc_info=True)
+        return
+    active_routes.replace_all(routes)
+    logger.info("Active routes: %s couriers, %s stops restored", len(routes), sum(map(len, routes.values())))
+
+
+def _on_order_change(change: OrderChange) -> None:
+    if change.status != OrderStatus.DELIVERING:
+        active_routes.remove_order(change.order_id)
+
+
+subscribe(_on_order_change)
+clinic_matrix.add_listener(active_routes.refresh_legs)
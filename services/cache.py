@@ -3,17 +3,28 @@
 
 Кешируется CachedUser (dataclass), а НЕ ORM-объект User, чтобы избежать
 DetachedInstanceError при обращении к relationship вне сессии.
+
+Два уровня: MemoryUserCache (LRU в памяти процесса с коротким TTL, проверка
+роли без I/O) перед Redis; без Redis — только память процесса с полным TTL.
+Инвалидации рассылаются другим инстансам через Redis pub/sub, короткий TTL
+страхует от потерянных сообщений.
 """
 from __future__ import annotations
 
+import asyncio
+import heapq
+from collections import Counter, OrderedDict
+from contextvars import ContextVar
 from dataclasses import dataclass
 from typing import Optional
 import json
 import logging
-from datetime import datetime, timedelta
+import time
+import uuid
 
 from database.models import UserRole
 from config import config
+from services import metrics
 
 logger = logging.getLogger(__name__)
 
@@ -108,57 +119,254 @@ class RedisUserCache:
             logger.warning("Cache clear error: %s", e)
 
 
+def _to_cached(user) -> CachedUser:
+    return user if isinstance(user, CachedUser) else CachedUser.from_orm(user)
+
+
 class MemoryUserCache:
-    """In-memory кеш пользователей (fallback если Redis недоступен)."""
+    """
+    In-memory кеш пользователей: LRU с ограничением размера и TTL.
 
-    def __init__(self, ttl_seconds: int = 300):
-        import asyncio
-        self._cache: dict[int, tuple[CachedUser, datetime]] = {}
-        self._ttl = timedelta(seconds=ttl_seconds)
-        self._lock = asyncio.Lock()
+    Без блокировок: бот работает в одном event loop, а методы не отдают
+    управление (внутри нет await), поэтому их шаги не перемежаются. Время —
+    time.monotonic() (не зависит от перевода системных часов). Истёкшие
+    записи удаляются заранее по куче сроков, а не только при чтении.
+    Счётчики hits / misses / evictions / expirations — в self.stats
+    и services.metrics (<name>_hits, ...).
+    """
 
-    async def get(self, telegram_id: int) -> Optional[CachedUser]:
-        async with self._lock:
-            if telegram_id in self._cache:
-                cached, expiry = self._cache[telegram_id]
-                if datetime.now() < expiry:
-                    return cached
+    def __init__(self, ttl_seconds: float = 300, max_size: int = 5000, name: str = "user_cache"):
+        self.ttl = ttl_seconds
+        self.max_size = max_size
+        # telegram_id -> (снимок, когда истекает); порядок — от давно использованных
+        self._cache: OrderedDict[int, tuple[CachedUser, float]] = OrderedDict()
+        # (когда истекает, telegram_id); записи, перезаписанные или удалённые
+        # раньше срока, остаются в куче и пропускаются при извлечении
+        self._expiry: list[tuple[float, int]] = []
+        self.stats: Counter = Counter()
+        self._metric = {key: f"{name}_{key}" for key in ("hits", "misses", "evictions", "expirations")}
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def _count(self, key: str, value: int = 1) -> None:
+        self.stats[key] += value
+        metrics.incr(self._metric[key], value)
+
+    def _expire(self, now: float) -> None:
+        expired = 0
+        heap = self._expiry
+        while heap and heap[0][0] <= now:
+            expires, telegram_id = heapq.heappop(heap)
+            entry = self._cache.get(telegram_id)
+            if entry is not None and entry[1] == expires:
                 del self._cache[telegram_id]
+                expired += 1
+        if expired:
+            self._count("expirations", expired)
+        # Куча разрослась устаревшими записями (частые перезаписи) — перестроить
+        if len(heap) > 2 * len(self._cache) + 64:
+            self._expiry = [(expires, telegram_id) for telegram_id, (_, expires) in self._cache.items()]
+            heapq.heapify(self._expiry)
+
+    def peek(self, telegram_id: int) -> Optional[CachedUser]:
+        """Посмотреть запись без счётчиков и без продвижения в LRU."""
+        entry = self._cache.get(telegram_id)
+        if entry is not None and entry[1] > time.monotonic():
+            return entry[0]
         return None
 
+    def get_nowait(self, telegram_id: int) -> Optional[CachedUser]:
+        now = time.monotonic()
+        self._expire(now)
+        entry = self._cache.get(telegram_id)
+        if entry is None:
+            self._count("misses")
+            return None
+        self._cache.move_to_end(telegram_id)
+        self._count("hits")
+        return entry[0]
+
+    def put(self, telegram_id: int, user) -> Optional[CachedUser]:
+        """Сохранить (ORM User или CachedUser); возвращает прежнее значение (None — не было)."""
+        now = time.monotonic()
+        self._expire(now)
+        cached = _to_cached(user)
+        previous = self._cache.get(telegram_id)
+        expires = now + self.ttl
+        self._cache[telegram_id] = (cached, expires)
+        self._cache.move_to_end(telegram_id)
+        heapq.heappush(self._expiry, (expires, telegram_id))
+        evicted = 0
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+            evicted += 1
+        if evicted:
+            self._count("evictions", evicted)
+        return previous[0] if previous is not None else None
+
+    def pop(self, telegram_id: int) -> None:
+        self._cache.pop(telegram_id, None)
+
+    def purge(self) -> None:
+        self._cache.clear()
+        self._expiry.clear()
+
+    async def get(self, telegram_id: int) -> Optional[CachedUser]:
+        return self.get_nowait(telegram_id)
+
     async def set(self, telegram_id: int, user) -> None:
-        async with self._lock:
-            if isinstance(user, CachedUser):
-                cached = user
-            else:
-                cached = CachedUser.from_orm(user)
-            self._cache[telegram_id] = (cached, datetime.now() + self._ttl)
+        self.put(telegram_id, user)
 
     async def invalidate(self, telegram_id: int) -> None:
-        async with self._lock:
-            self._cache.pop(telegram_id, None)
+        self.pop(telegram_id)
 
     async def clear(self) -> None:
-        async with self._lock:
-            self._cache.clear()
+        self.purge()
+
+
+# Пользователь текущего апдейта (ставит middlewares.auth_middleware.IdentityMiddleware);
+# None — апдейт без пользователя или пользователь не зарегистрирован
+acting_user: ContextVar[Optional[CachedUser]] = ContextVar("acting_user", default=None)
+
+# Канал инвалидаций между инстансами
+CHANNEL = "user_cache_invalidate"
+
+# Уникальный id процесса — чтобы не обрабатывать свои же сообщения из Redis
+_INSTANCE_ID = uuid.uuid4().hex
 
 
-# Глобальный экземпляр кеша (инициализируется в main.py)
-user_cache: Optional[RedisUserCache | MemoryUserCache] = None
+class UserCache:
+    """
+    Двухуровневый кеш пользователей: MemoryUserCache в памяти процесса перед
+    общим хранилищем (shared, Redis). Экземпляр один на процесс, поэтому его
+    можно импортировать до init_cache; без Redis работает только память.
 
+    Запись в общее хранилище — только если значение изменилось: повторные
+    чтения пользователя из БД не переписывают Redis.
+    """
 
-async def init_cache(redis_client=None) -> RedisUserCache | MemoryUserCache:
-    """Инициализировать кеш пользователей."""
-    global user_cache
+    def __init__(self, local_size: int = 5000, local_ttl: float = 30):
+        self.shared: Optional[RedisUserCache] = None
+        # Запись в памяти есть — значит, это же значение лежит и в shared
+        self.local = MemoryUserCache(ttl_seconds=local_ttl, max_size=local_size, name="user_cache_local")
+
+    def drop_local(self, telegram_id: Optional[int] = None) -> None:
+        """Забыть пользователя (None — всех) только в памяти этого процесса."""
+        if telegram_id is None:
+            self.local.purge()
+        else:
+            self.local.pop(telegram_id)
+
+    def peek(self, telegram_id: int) -> Optional[CachedUser]:
+        """Пользователь из памяти процесса (без общего хранилища и счётчиков); None — нет или истёк."""
+        return self.local.peek(telegram_id)
+
+    async def get(self, telegram_id: int) -> Optional[CachedUser]:
+        """Получить кешированного пользователя (из памяти — без I/O)."""
+        cached = self.local.get_nowait(telegram_id)
+        if cached is not None or self.shared is None:
+            return cached
+        cached = await self.shared.get(telegram_id)
+        if cached is not None:
+            self.local.put(telegram_id, cached)
+        return cached
+
+    async def set(self, telegram_id: int, user) -> None:
+        """Сохранить пользователя (ORM User или CachedUser); без изменений — только продлить в памяти."""
+        cached = _to_cached(user)
+        if self.local.put(telegram_id, cached) == cached:
+            return
+        if self.shared is not None:
+            await self.shared.set(telegram_id, cached)
+
+    async def invalidate(self, telegram_id: int) -> None:
+        """Удалить пользователя везде, включая память других инстансов."""
+        self.local.pop(telegram_id)
+        if self.shared is not None:
+            await self.shared.invalidate(telegram_id)
+        await _publish(telegram_id)
+
+    async def clear(self) -> None:
+        self.local.purge()
+        if self.shared is not None:
+            await self.shared.clear()
+        await _publish(None)
+
+
+# Глобальный экземпляр кеша (хранилище подключается в main.py)
+user_cache = UserCache(local_size=config.USER_CACHE_LOCAL_SIZE, local_ttl=config.USER_CACHE_LOCAL_TTL)
+
+_redis = None
+_listener_task: Optional[asyncio.Task] = None
+
+
+async def _publish(telegram_id: Optional[int]) -> None:
+    if _redis is None:
+        return
+    try:
+        await _redis.publish(CHANNEL, json.dumps({"src": _INSTANCE_ID, "telegram_id": telegram_id}))
+    except Exception as e:
+        logger.warning("User cache invalidation publish failed: %s", e)
+
+
+async def _listen_loop() -> None:
+    pubsub = _redis.pubsub()
+    await pubsub.subscribe(CHANNEL)
+    try:
+        while True:
+            try:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=5.0)
+                if message is None:
+                    continue
+                data = json.loads(message["data"])
+                if data.get("src") == _INSTANCE_ID:
+                    continue
+                telegram_id = data.get("telegram_id")
+                user_cache.drop_local(int(telegram_id) if telegram_id is not None else None)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("User cache invalidation receive error: %s", e)
+                # Сообщения могли потеряться — не доверяем памяти процесса
+                user_cache.drop_local()
+                await asyncio.sleep(1)
+    finally:
+        try:
+            await pubsub.unsubscribe(CHANNEL)
+            await pubsub.aclose()
+        except Exception:
+            pass
+
+
+async def init_cache(redis_client=None) -> UserCache:
+    """Подключить общее хранилище кеша пользователей (Redis или память) и инвалидации."""
+    global _redis, _listener_task
     if redis_client:
         try:
             await redis_client.ping()
-            user_cache = RedisUserCache(redis_client, ttl_seconds=config.REDIS_CACHE_TTL)
-            logger.info("Using Redis cache for users")
+            user_cache.shared = RedisUserCache(redis_client, ttl_seconds=config.REDIS_CACHE_TTL)
+            _redis = redis_client
+            _listener_task = asyncio.create_task(_listen_loop())
+            logger.info(
+                "Using Redis cache for users (local LRU %s, TTL %ss)",
+                user_cache.local.max_size, user_cache.local.ttl,
+            )
             return user_cache
         except Exception as e:
             logger.warning("Redis not available for cache, using memory: %s", e)
 
-    user_cache = MemoryUserCache(ttl_seconds=config.REDIS_CACHE_TTL)
+    # Один процесс — инвалидировать память других инстансов не нужно, TTL полный
+    user_cache.shared = None
+    user_cache.local.ttl = config.REDIS_CACHE_TTL
     logger.info("Using memory cache for users")
     return user_cache
+
+
+def stop_cache() -> None:
+    """Остановить приём инвалидаций (при shutdown)."""
+    global _redis, _listener_task
+    if _listener_task and not _listener_task.done():
+        _listener_task.cancel()
+    _listener_task = None
+    _redis = None
@@ -0,0 +1,389 @@
+"""
+Предрасчитанная матрица расстояний между клиниками и складом.
+
+Клиники статичны: координаты меняются только через create_clinic /
+update_clinic_field. Расстояния (км и минуты в пути) между всеми клиниками
+и складом (узел DEPOT_ID, координаты WAREHOUSE_LAT / WAREHOUSE_LON) хранятся
+в таблице clinic_distances и в памяти процесса. При создании или переносе
+клиники пересчитывается только её строка (N пар) текущим провайдером
+расстояний (services.routing.distance_provider), а маршрутизация берёт
+расстояния между остановками готовыми — в запросе курьера считаются
+только расстояния от курьера до клиник.
+
+Загрузка — clinic_matrix.ensure(session) при старте (в фоне, start_loading):
+недостающие строки (новая таблица, клиники, добавленные в обход бота)
+досчитываются, при смене провайдера расстояний — пересчитывается всё.
+Первый расчёт может идти минуты; клиника, созданная или перенесенная в это
+время, не ждёт его: её старые строки удаляются из таблицы, а пересчёт
+ставится в очередь и выполняется в конце загрузки.
+
+Пересчитанная строка публикуется в Redis (канал clinic_changes): другие
+инстансы перечитывают её из таблицы, не считая расстояния заново.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import uuid
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import delete, insert, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import config
+from database.models import Clinic, ClinicDistance
+from services.routing import distance_provider
+
+logger = logging.getLogger(__name__)
+
+# Узел склада в матрице (id клиник начинаются с 1)
+DEPOT_ID = 0
+# Строк в одном INSERT при пересчёте
+_INSERT_CHUNK = 5000
+# Сколько строк клиник сверять при загрузке
+_CHECK_ROWS = 2
+
+# Канал Redis: строка клиники пересчитана (payload — src, clinic_id)
+CHANNEL = "clinic_changes"
+# Уникальный id процесса — чтобы не обрабатывать свои же сообщения из Redis
+_INSTANCE_ID = uuid.uuid4().hex
+
+
+def _depot() -> Optional[Tuple[float, float]]:
+    if config.WAREHOUSE_LAT is None or config.WAREHOUSE_LON is None:
+        return None
+    return config.WAREHOUSE_LAT, config.WAREHOUSE_LON
+
+
+class ClinicMatrix:
+    """Матрица км / минут по id клиник (и складу) в памяти + таблица clinic_distances."""
+
+    def __init__(self) -> None:
+        self._lock = asyncio.Lock()
+        self._loaded = False
+        self._pos: Dict[int, int] = {}
+        self._points = np.zeros((0, 2))
+        self._km = np.zeros((0, 0))
+        self._minutes = np.zeros((0, 0))
+        # Пока идёт загрузка: клиники к пересчёту (id -> координаты) и к перечитыванию из таблицы
+        self._pending: Dict[int, Tuple[float, float]] = {}
+        self._reload: set[int] = set()
+        # Вызываются после загрузки и после изменения строки клиники (синхронно, без I/O)
+        self._listeners: List[Callable[[], None]] = []
+
+    def add_listener(self, callback: Callable[[], None]) -> None:
+        """Подписаться на загрузку и изменения матрицы (например, пересчёт отрезков маршрутов)."""
+        if callback not in self._listeners:
+            self._listeners.append(callback)
+
+    def _changed(self) -> None:
+        for callback in list(self._listeners):
+            try:
+                callback()
+            except Exception:
+                logger.exception("Clinic matrix listener failed")
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def __len__(self) -> int:
+        return len(self._pos)
+
+    def _resize(self, ids: Sequence[int]) -> None:
+        """Добавить узлы ids (без расстояний — их заполнит _set_row)."""
+        new = [i for i in ids if i not in self._pos]
+        if not new:
+            return
+        n, m = len(self._pos), len(self._pos) + len(new)
+        for k, node in enumerate(new):
+            self._pos[node] = n + k
+        for name in ("_km", "_minutes"):
+            grown = np.full((m, m), np.nan)
+            grown[:n, :n] = getattr(self, name)
+            np.fill_diagonal(grown, 0.0)
+            setattr(self, name, grown)
+        self._points = np.vstack([self._points, np.full((len(new), 2), np.nan)])
+
+    def _set_row(self, node: int, km: np.ndarray, minutes: np.ndarray) -> None:
+        p = self._pos[node]
+        self._km[p, :] = self._km[:, p] = km
+        self._minutes[p, :] = self._minutes[:, p] = minutes
+        self._km[p, p] = self._minutes[p, p] = 0.0
+
+    def _distances(self, lat: float, lon: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Км и минуты от точки до всех узлов. По дорогам туда и обратно путь
+        разный (односторонние улицы) — берётся среднее: маршрутизация
+        (2-opt разворачивает отрезки) рассчитана на симметричную матрицу.
+        """
+        provider = distance_provider()
+        there_km, there_min = provider.row((lat, lon), self._points)
+        back_km, back_min = provider.column(self._points, (lat, lon))
+        return (there_km + back_km) / 2, (there_min + back_min) / 2
+
+    async def _write_row(self, session: AsyncSession, node: int, lat: float, lon: float) -> None:
+        """Пересчитать расстояния узла до всех остальных: в памяти и в таблице."""
+        self._points[self._pos[node]] = (lat, lon)
+        # Дорожный граф считает в Python — не блокируем event loop
+        km, minutes = await asyncio.to_thread(self._distances, lat, lon)
+        self._set_row(node, km, minutes)
+
+        await session.execute(
+            delete(ClinicDistance).where(or_(ClinicDistance.from_id == node, ClinicDistance.to_id == node))
+        )
+        rows = [
+            {
+                "from_id": min(node, other),
+                "to_id": max(node, other),
+                "km": float(km[p]),
+                "minutes": float(minutes[p]),
+            }
+            for other, p in self._pos.items()
+            if other != node and not np.isnan(km[p])
+        ]
+        for start in range(0, len(rows), _INSERT_CHUNK):
+            await session.execute(insert(ClinicDistance), rows[start:start + _INSERT_CHUNK])
+
+    async def ensure(self, session: AsyncSession) -> None:
+        """Загрузить матрицу из таблицы (один раз) и досчитать недостающие строки."""
+        async with self._lock:
+            if self._loaded:
+                return
+            clinics = (await session.execute(select(Clinic.id, Clinic.geo_lat, Clinic.geo_lon))).all()
+            nodes: List[Tuple[int, float, float]] = [(c.id, c.geo_lat, c.geo_lon) for c in clinics]
+            depot = _depot()
+            if depot is not None:
+                nodes.insert(0, (DEPOT_ID, *depot))
+            self._resize([node for node, _, _ in nodes])
+            for node, lat, lon in nodes:
+                self._points[self._pos[node]] = (lat, lon)
+
+            rows = (await session.execute(
+                select(ClinicDistance.from_id, ClinicDistance.to_id, ClinicDistance.km, ClinicDistance.minutes)
+            )).all()
+            if rows:
+                data = np.array(rows, dtype=np.float64)
+                a, b = data[:, 0].astype(np.int64), data[:, 1].astype(np.int64)
+                index = np.full(int(max(a.max(), b.max())) + 1, -1, dtype=np.intp)
+                for node, p in self._pos.items():
+                    if node < len(index):
+                        index[node] = p
+                keep = (index[a] >= 0) & (index[b] >= 0)
+                i, j = index[a[keep]], index[b[keep]]
+                self._km[i, j] = self._km[j, i] = data[keep, 2]
+                self._minutes[i, j] = self._minutes[j, i] = data[keep, 3]
+
+            # Склад пересчитывается всегда (координаты из конфига могли смениться),
+            # клиники — если в строке не хватает пар. Если строка проверочной
+            # клиники не совпала с таблицей (сменился провайдер расстояний или
+            # клиника перенесена в обход бота) — пересчитывается всё.
+            missing = np.isnan(self._km).any(axis=1)
+            if rows and await asyncio.to_thread(self._outdated, nodes):
+                missing[:] = True
+            stale = [
+                (node, lat, lon) for node, lat, lon in nodes
+                if node == DEPOT_ID or missing[self._pos[node]]
+            ]
+            for node, lat, lon in stale:
+                await self._write_row(session, node, lat, lon)
+            if stale:
+                await session.commit()
+
+            # Изменения клиник за время загрузки (update_clinic / другие инстансы);
+            # между последней проверкой и _loaded = True нет await
+            changed = 0
+            while self._pending or self._reload:
+                pending, self._pending = self._pending, {}
+                reload, self._reload = self._reload - pending.keys(), set()
+                for node, (lat, lon) in pending.items():
+                    self._resize([node])
+                    await self._write_row(session, node, lat, lon)
+                if pending:
+                    await session.commit()
+                for node in reload:
+                    await self._read_row(session, node)
+                for node in pending:
+                    await _publish(node)
+                changed += len(pending) + len(reload)
+            self._loaded = True
+            self._changed()
+            logger.info(
+                "Clinic matrix: %s nodes, %s rows loaded, %s recomputed, %s changed while loading",
+                len(self._pos), len(rows), len(stale), changed,
+            )
+
+    def _outdated(self, nodes: Sequence[Tuple[int, float, float]]) -> bool:
+        """Сверить строки нескольких клиник с пересчитанными заново."""
+        clinics = [node for node in nodes if node[0] != DEPOT_ID][:_CHECK_ROWS]
+        for node, lat, lon in clinics:
+            stored = self._km[self._pos[node]]
+            km, _ = self._distances(lat, lon)
+            known = ~np.isnan(stored)
+            if DEPOT_ID in self._pos:
+                known[self._pos[DEPOT_ID]] = False
+            if not np.allclose(stored[known], km[known], rtol=1e-6, atol=1e-6):
+                return True
+        return False
+
+    async def update_clinic(self, session: AsyncSession, clinic_id: int, lat: float, lon: float) -> None:
+        """
+        Клиника создана или перенесена: пересчитать её строку (N пар) и закоммитить.
+        Пока матрица загружается — не ждать: старые строки клиники удаляются
+        (следующая загрузка досчитает их как недостающие), пересчёт — в конце ensure.
+        """
+        if not self._loaded:
+            self._pending[clinic_id] = (lat, lon)
+            await session.execute(
+                delete(ClinicDistance).where(
+                    or_(ClinicDistance.from_id == clinic_id, ClinicDistance.to_id == clinic_id)
+                )
+            )
+            await session.commit()
+            return
+        async with self._lock:
+            self._resize([clinic_id])
+            await self._write_row(session, clinic_id, lat, lon)
+            await session.commit()
+            self._changed()
+        await _publish(clinic_id)
+
+    async def _read_row(self, session: AsyncSession, node: int) -> None:
+        """Перечитать строку узла из таблицы (её пересчитал другой инстанс)."""
+        clinic = (await session.execute(
+            select(Clinic.geo_lat, Clinic.geo_lon).where(Clinic.id == node)
+        )).first()
+        if clinic is None:
+            return
+        rows = (await session.execute(
+            select(ClinicDistance.from_id, ClinicDistance.to_id, ClinicDistance.km, ClinicDistance.minutes)
+            .where(or_(ClinicDistance.from_id == node, ClinicDistance.to_id == node))
+        )).all()
+        self._resize([node])
+        self._points[self._pos[node]] = (clinic.geo_lat, clinic.geo_lon)
+        km = np.full(len(self._pos), np.nan)
+        minutes = np.full(len(self._pos), np.nan)
+        for r in rows:
+            p = self._pos.get(r.to_id if r.from_id == node else r.from_id)
+            if p is not None:
+                km[p], minutes[p] = r.km, r.minutes
+        self._set_row(node, km, minutes)
+
+    async def reload_clinic(self, session: AsyncSession, clinic_id: int) -> None:
+        """Строка клиники изменена другим инстансом: перечитать (или после загрузки)."""
+        if not self._loaded:
+            self._reload.add(clinic_id)
+            return
+        async with self._lock:
+            await self._read_row(session, clinic_id)
+            self._changed()
+
+    def _sub(self, matrix: np.ndarray, ids: Sequence[int]) -> Optional[np.ndarray]:
+        if not self._loaded:
+            return None
+        try:
+            idx = np.fromiter((self._pos[i] for i in ids), dtype=np.intp, count=len(ids))
+        except KeyError:
+            return None
+        sub = matrix[np.ix_(idx, idx)]
+        return None if np.isnan(sub).any() else sub
+
+    def submatrix(self, ids: Sequence[int]) -> Optional[np.ndarray]:
+        """
+        Км между узлами ids (id клиник, DEPOT_ID — склад), в порядке ids;
+        повторы допустимы (несколько заказов в одну клинику).
+        None — матрица не загружена или какого-то узла в ней нет.
+        """
+        return self._sub(self._km, ids)
+
+    def minutes(self, ids: Sequence[int]) -> Optional[np.ndarray]:
+        """То же, что submatrix, но минуты в пути."""
+        return self._sub(self._minutes, ids)
+
+    def row(self, node: int, ids: Sequence[int]) -> Optional[np.ndarray]:
+        """Км от узла node до узлов ids (одна строка, без квадратной подматрицы)."""
+        if not self._loaded or node not in self._pos:
+            return None
+        try:
+            idx = np.fromiter((self._pos[i] for i in ids), dtype=np.intp, count=len(ids))
+        except KeyError:
+            return None
+        row = self._km[self._pos[node], idx]
+        return None if np.isnan(row).any() else row
+
+
+# Глобальный экземпляр (загружается в main.py)
+clinic_matrix = ClinicMatrix()
+
+_load_task: Optional[asyncio.Task] = None
+_listener_task: Optional[asyncio.Task] = None
+_redis = None
+
+
+async def _publish(clinic_id: int) -> None:
+    if _redis is None:
+        return
+    try:
+        await _redis.publish(CHANNEL, json.dumps({"src": _INSTANCE_ID, "clinic_id": clinic_id}))
+    except Exception as e:
+        logger.warning("Clinic matrix publish failed: %s", e)
+
+
+async def _listen_loop(session_maker) -> None:
+    pubsub = _redis.pubsub()
+    await pubsub.subscribe(CHANNEL)
+    try:
+        while True:
+            try:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=5.0)
+                if message is None:
+                    continue
+                data = json.loads(message["data"])
+                if data.get("src") == _INSTANCE_ID:
+                    continue
+                async with session_maker() as session:
+                    await clinic_matrix.reload_clinic(session, int(data["clinic_id"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Clinic matrix receive error: %s", e)
+                await asyncio.sleep(1)
+    finally:
+        try:
+            await pubsub.unsubscribe(CHANNEL)
+            await pubsub.aclose()
+        except Exception:
+            pass
+
+
+async def _load(session_maker) -> None:
+    try:
+        async with session_maker() as session:
+            await clinic_matrix.ensure(session)
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        logger.warning("Clinic distance matrix is not available, routes use on-the-fly distances", exc_info=True)
+
+
+def start_loading(session_maker, redis_client=None) -> None:
+    """
+    Загрузить матрицу в фоне; пока она не готова, маршруты считают расстояния на лету.
+    С Redis — обмениваться пересчитанными строками клиник с другими инстансами.
+    """
+    global _load_task, _listener_task, _redis
+    if redis_client is not None:
+        _redis = redis_client
+        _listener_task = asyncio.create_task(_listen_loop(session_maker))
+    _load_task = asyncio.create_task(_load(session_maker))
+
+
+def stop_loading() -> None:
+    global _load_task, _listener_task, _redis
+    for task in (_load_task, _listener_task):
+        if task is not None:
+            task.cancel()
+    _load_task = _listener_task = None
+    _redis = None
@@ -0,0 +1,88 @@
+"""
+Последние известные геолокации курьеров.
+
+Точка обновляется, когда курьер отправляет геолокацию для поиска заказов
+и при каждом обновлении трансляции (live location). Хранится в памяти
+процесса в services.spatial_grid; устаревшие точки (старше
+COURIER_LOCATION_TTL) не участвуют в поиске и вычищаются лениво.
+
+Модель развёртывания: апдейты Telegram принимает один процесс polling
+(getUpdates не допускает параллельных потребителей, см.
+main.acquire_single_instance_lock), и только он читает и пишет точки и
+маршруты (services.active_routes). Через Redis между процессами идёт то,
+что переживает перезапуск или нужно dashboard: события заказов, очередь
+уведомлений, кеш, счётчики. Точки в Redis не сохраняются: после
+перезапуска трансляции курьеров присылают их заново в течение минуты,
+а маршруты восстанавливаются из БД.
+"""
+from __future__ import annotations
+
+import time
+from typing import Iterable, List, Optional, Tuple
+
+from config import config
+from services.spatial_grid import GridIndex
+
+# Ячейка сетки ~2 км: поиск K ближайших в городе просматривает несколько ячеек
+GRID_CELL_KM = 2.0
+# Широта Ташкента — ячейки примерно квадратные
+GRID_REF_LAT = 41.3
+
+
+class CourierLocations:
+    """telegram_id курьера -> последняя точка и время её получения."""
+
+    def __init__(self) -> None:
+        self._grid: GridIndex[int] = GridIndex(GRID_CELL_KM, ref_lat=GRID_REF_LAT)
+        self._seen: dict[int, float] = {}
+        self._pruned_at = 0.0
+
+    def __len__(self) -> int:
+        return len(self._grid)
+
+    def update(self, telegram_id: int, lat: float, lon: float) -> None:
+        self._grid.put(telegram_id, lat, lon)
+        self._seen[telegram_id] = time.monotonic()
+
+    def forget(self, telegram_id: int) -> None:
+        self._grid.remove(telegram_id)
+        self._seen.pop(telegram_id, None)
+
+    def _is_fresh(self, telegram_id: int, now: float) -> bool:
+        return now - self._seen.get(telegram_id, float("-inf")) <= config.COURIER_LOCATION_TTL
+
+    def get(self, telegram_id: int) -> Optional[Tuple[float, float]]:
+        """Актуальная точка курьера или None."""
+        if not self._is_fresh(telegram_id, time.monotonic()):
+            return None
+        return self._grid.get(telegram_id)
+
+    def prune(self) -> None:
+        now = self._pruned_at = time.monotonic()
+        for telegram_id in [t for t in self._seen if not self._is_fresh(t, now)]:
+            self.forget(telegram_id)
+
+    def nearest(
+        self,
+        lat: float,
+        lon: float,
+        k: int,
+        max_radius_km: float,
+        among: Optional[Iterable[int]] = None,
+    ) -> List[Tuple[float, int]]:
+        """
+        До k ближайших к точке курьеров с актуальной геолокацией.
+        among — ограничить поиск этими telegram_id (например, активными курьерами).
+        """
+        now = time.monotonic()
+        allowed = set(among) if among is not None else None
+        if now - self._pruned_at > config.COURIER_LOCATION_TTL:
+            self.prune()
+
+        def _eligible(telegram_id: int) -> bool:
+            return (allowed is None or telegram_id in allowed) and self._is_fresh(telegram_id, now)
+
+        return self._grid.nearest(lat, lon, k, max_radius_km, predicate=_eligible)
+
+
+courier_locations = CourierLocations()
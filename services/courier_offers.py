@@ -0,0 +1,120 @@
+"""
+Адресная рассылка курьерам о готовых заказах.
+
+Готовый заказ сначала предлагается K ближайшим к клинике курьерам
+(по services.courier_locations). Если за COURIER_NOTIFY_WIDEN_AFTER секунд
+заказ никто не взял — уведомление получают остальные активные курьеры.
+Взятие заказа (смена статуса) приходит через services.order_bus и отменяет
+расширение. Срочные заказы и заказы без известных курьеров рядом
+рассылаются всем сразу.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional, Sequence
+
+from config import config
+from database.models import OrderStatus
+from services.courier_locations import courier_locations
+from services.order_bus import OrderChange, subscribe
+
+logger = logging.getLogger(__name__)
+
+# order_id -> отложенное расширение рассылки
+_widen_tasks: dict[int, asyncio.Task] = {}
+
+
+def _on_order_change(change: OrderChange) -> None:
+    if change.status == OrderStatus.READY_FOR_PICKUP:
+        return
+    task = _widen_tasks.pop(change.order_id, None)
+    if task is not None:
+        task.cancel()
+        logger.debug("Order #%s taken (%s), widening canceled", change.order_id, change.status.name)
+
+
+subscribe(_on_order_change)
+
+
+def split_nearest(
+    lat: Optional[float],
+    lon: Optional[float],
+    courier_ids: Sequence[int],
+    k: int,
+) -> tuple[list[int], list[int]]:
+    """
+    (первая волна, остальные): до k ближайших к точке курьеров с актуальной
+    геолокацией. Если таких нет — первая волна — все курьеры.
+    """
+    if k <= 0 or lat is None or lon is None:
+        return list(courier_ids), []
+    nearest = courier_locations.nearest(lat, lon, k, config.COURIER_NOTIFY_RADIUS_KM, among=courier_ids)
+    if not nearest:
+        return list(courier_ids), []
+    first = [telegram_id for _, telegram_id in nearest]
+    chosen = set(first)
+    return first, [telegram_id for telegram_id in courier_ids if telegram_id not in chosen]
+
+
+async def _send_all(telegram_ids: Sequence[int], send: Callable[[int], Awaitable[bool]]) -> int:
+    sent = 0
+    for telegram_id in telegram_ids:
+        if await send(telegram_id):
+            sent += 1
+    return sent
+
+
+async def _widen_later(order_id: int, rest: list[int], send: Callable[[int], Awaitable[bool]]) -> None:
+    try:
+        await asyncio.sleep(config.COURIER_NOTIFY_WIDEN_AFTER)
+        sent = await _send_all(rest, send)
+        logger.info("Order #%s not taken, widened to %s more couriers", order_id, sent)
+    finally:
+        if _widen_tasks.get(order_id) is asyncio.current_task():
+            del _widen_tasks[order_id]
+
+
+async def offer_order(
+    order_id: int,
+    lat: Optional[float],
+    lon: Optional[float],
+    courier_ids: Sequence[int],
+    send: Callable[[int], Awaitable[bool]],
+    *,
+    urgent: bool = False,
+) -> int:
+    """
+    Предложить заказ курьерам волнами.
+
+    Args:
+        order_id: Заказ
+        lat, lon: Точка клиники
+        courier_ids: telegram_id активных курьеров
+        send: Отправка уведомления одному курьеру (telegram_id) -> поставлено ли в очередь
+        urgent: Срочный заказ — всем сразу
+
+    Returns:
+        Сколько курьеров уведомлено сейчас (первой волной)
+    """
+    k = 0 if urgent else config.COURIER_NOTIFY_NEAREST_K
+    first, rest = split_nearest(lat, lon, courier_ids, k)
+    sent = await _send_all(first, send)
+
+    old = _widen_tasks.pop(order_id, None)
+    if old is not None:
+        old.cancel()
+    if rest:
+        _widen_tasks[order_id] = asyncio.create_task(_widen_later(order_id, rest, send))
+    logger.info(
+        "Order #%s offered to %s nearest couriers, %s more after %ss",
+        order_id, sent, len(rest), config.COURIER_NOTIFY_WIDEN_AFTER if rest else 0,
+    )
+    return sent
+
+
+def cancel_pending_offers() -> None:
+    """Отменить отложенные расширения (при shutdown)."""
+    for task in _widen_tasks.values():
+        task.cancel()
+    _widen_tasks.clear()
@@ -1,41 +1,39 @@
+import logging
 from typing import Any, Optional
 from sqlalchemy import select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload, joinedload
 from database.models import User, Clinic, UserRole, Order, OrderItem
-from services.cache import user_cache
+from services.cache import CachedUser, acting_user, user_cache
+from services.pagination import invalidate_count
+from services.clinic_matrix import clinic_matrix
 from config import config
 
+logger = logging.getLogger(__name__)
+
 # --- User Services ---
 
 
 async def check_role(session: AsyncSession, telegram_id: int, required_role: UserRole) -> bool:
     """
     Универсальная проверка роли пользователя.
-    Использует кеш (CachedUser) для быстрой проверки без ORM.
+    Пользователь текущего апдейта уже найден IdentityMiddleware — берётся
+    из acting_user без обращения к кешу. Иначе — кеш (CachedUser) без ORM:
+    при попадании в память процесса без I/O, в БД идёт только промах.
     Админы из ADMIN_IDS имеют доступ ко всем панелям.
     """
     if telegram_id in config.ADMIN_IDS_LIST:
         return True
-    # Сначала проверяем кеш (возвращает CachedUser, не ORM)
-    if user_cache is not None:
-        try:
-            cached = await user_cache.get(telegram_id)
-            if cached is not None:
-                return cached.role == required_role and cached.is_active
-        except Exception:
-            pass
-    # Fallback на БД
-    user = await get_user_by_telegram_id(session, telegram_id, use_cache=False)
-    if user is None:
-        return False
-    # Сохраняем в кеш для следующих проверок
-    if user_cache is not None:
-        try:
-            await user_cache.set(telegram_id, user)
-        except Exception:
-            pass
-    return user.role == required_role and user.is_active
+    cached = acting_user.get()
+    if cached is None or cached.telegram_id != telegram_id:
+        cached = await user_cache.get(telegram_id)
+    if cached is None:
+        # Fallback на БД (get_user_by_telegram_id сам положит пользователя в кеш)
+        user = await get_user_by_telegram_id(session, telegram_id)
+        if user is None:
+            return False
+        cached = CachedUser.from_orm(user)
+    return cached.role == required_role and cached.is_active
 
 
 async def get_user_by_telegram_id(session: AsyncSession, telegram_id: int, use_cache: bool = False) -> User | None:
@@ -48,12 +46,9 @@ async def get_user_by_telegram_id(session: AsyncSession, telegram_id: int, use_c
     result = await session.execute(stmt)
     user = result.scalar_one_or_none()
 
-    # Обновляем кеш при каждом успешном чтении из БД
-    if user and user_cache is not None:
-        try:
-            await user_cache.set(telegram_id, user)
-        except Exception:
-            pass
+    # Обновляем кеш по прочитанному из БД (Redis переписывается, только если данные изменились)
+    if user:
+        await user_cache.set(telegram_id, user)
 
     return user
 
@@ -80,6 +75,7 @@ async def create_user(
     session.add(user)
     await session.commit()
     await session.refresh(user)
+    invalidate_count("admin_users")
     return user
 
 async def approve_user_role(session: AsyncSession, user_id: int, role: UserRole) -> User | None:
@@ -93,12 +89,8 @@ async def approve_user_role(session: AsyncSession, user_id: int, role: UserRole)
         user.is_active = True
         await session.commit()
         await session.refresh(user)
-        # Инвалидируем кеш при изменении данных пользователя (если инициализирован)
-        if user_cache is not None:
-            try:
-                await user_cache.invalidate(user_id)
-            except Exception:
-                pass  # При ошибке кеша просто пропускаем
+        # Инвалидируем кеш при изменении данных пользователя (и на других инстансах)
+        await user_cache.invalidate(user_id)
     
     return user
 
@@ -123,6 +115,7 @@ async def create_clinic(session: AsyncSession, name: str, doctor_name: str,
     session.add(clinic)
     await session.commit()
     await session.refresh(clinic)
+    await _update_clinic_distances(session, clinic)
     return clinic
 
 async def get_clinic_by_id(session: AsyncSession, clinic_id: int) -> Clinic | None:
@@ -135,6 +128,16 @@ async def get_all_clinics(session: AsyncSession) -> list[Clinic]:
     result = await session.execute(stmt)
     return list(result.scalars().all())
 
+async def _update_clinic_distances(session: AsyncSession, clinic: Clinic) -> None:
+    """Пересчитать строку клиники в матрице расстояний (ошибка не мешает сохранению клиники)."""
+    try:
+        await clinic_matrix.update_clinic(session, clinic.id, clinic.geo_lat, clinic.geo_lon)
+    except Exception:
+        logger.warning("Clinic #%s: distance matrix update failed", clinic.id, exc_info=True)
+        await session.rollback()
+        await session.refresh(clinic)
+
+
 _CLINIC_ALLOWED_FIELDS = frozenset({
     "name", "doctor_name", "phone_number", "address",
     "geo_lat", "geo_lon", "telegram_chat_id",
@@ -159,6 +162,8 @@ async def update_clinic_field(session: AsyncSession, clinic_id: int, field: str,
 
     await session.commit()
     await session.refresh(clinic)
+    if field in ("geo_lat", "geo_lon"):
+        await _update_clinic_distances(session, clinic)
     return clinic
 
 # --- Order Services ---
@@ -0,0 +1,91 @@
+"""
+Счётчики работы бота для дашборда.
+
+incr() только увеличивает число в памяти процесса (без I/O, можно звать на
+каждом апдейте). Фоновая задача раз в FLUSH_SECONDS прибавляет накопленное
+к Redis-хешу metrics:bot (HINCRBY — счётчики всех инстансов суммируются),
+откуда их читает dashboard (/api/metrics). Без Redis счётчики есть только
+в памяти процесса (snapshot()).
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections import Counter
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Хеш со счётчиками в Redis
+REDIS_KEY = "metrics:bot"
+# Как часто сбрасывать приращения в Redis, секунд
+FLUSH_SECONDS = 10.0
+
+_totals: Counter = Counter()
+_pending: Counter = Counter()
+_redis = None
+_flush_task: Optional[asyncio.Task] = None
+
+
+def incr(name: str, value: int = 1) -> None:
+    """Увеличить счётчик name."""
+    _totals[name] += value
+    _pending[name] += value
+
+
+def snapshot() -> Dict[str, int]:
+    """Счётчики этого процесса с момента запуска."""
+    return dict(_totals)
+
+
+async def flush() -> None:
+    """Прибавить накопленные приращения к хешу в Redis."""
+    global _pending
+    if _redis is None or not _pending:
+        return
+    pending, _pending = _pending, Counter()
+    try:
+        pipe = _redis.pipeline()
+        for name, value in pending.items():
+            pipe.hincrby(REDIS_KEY, name, value)
+        await pipe.execute()
+    except Exception as e:
+        # Не теряем приращения — уйдут со следующим сбросом
+        _pending.update(pending)
+        logger.warning("Metrics flush failed: %s", e)
+
+
+async def read(redis_client) -> Dict[str, int]:
+    """Счётчики всех инстансов из Redis (для дашборда)."""
+    data = await redis_client.hgetall(REDIS_KEY)
+    return {
+        (k.decode() if isinstance(k, bytes) else k): int(v)
+        for k, v in data.items()
+    }
+
+
+async def _flush_loop() -> None:
+    while True:
+        await asyncio.sleep(FLUSH_SECONDS)
+        await flush()
+
+
+def start_metrics(redis_client=None) -> None:
+    """Сбрасывать счётчики в Redis (вызывать из main.py). Без Redis — только в памяти."""
+    global _redis, _flush_task
+    if redis_client is None:
+        logger.info("Metrics: in-process only (no Redis)")
+        return
+    _redis = redis_client
+    _flush_task = asyncio.create_task(_flush_loop())
+    logger.info("Metrics: Redis hash %s", REDIS_KEY)
+
+
+async def stop_metrics() -> None:
+    """Остановка (при shutdown): последний сброс в Redis."""
+    global _redis, _flush_task
+    if _flush_task and not _flush_task.done():
+        _flush_task.cancel()
+    _flush_task = None
+    await flush()
+    _redis = None
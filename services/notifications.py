@@ -6,6 +6,7 @@ from typing import Optional
 from aiogram import Bot
 
 from services.telegram_utils import escape_markdown
+from services.notify_digest import notify_digest
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
 from sqlalchemy import select
@@ -33,7 +34,7 @@ async def notify_manager_about_order_status(
         session: Сессия БД
         
     Returns:
-        True если уведомление отправлено успешно, False в противном случае
+        True если уведомление поставлено в очередь (или отправлено), False в противном случае
     """
     # Не уведомляем только при отмене
     if new_status == OrderStatus.CANCELED:
@@ -79,22 +80,21 @@ async def notify_manager_about_order_status(
     if order.is_urgent:
         notification_text += "\n🔥 *СРОЧНЫЙ ЗАКАЗ*"
     
-    # Отправляем уведомление
-    try:
-        await bot.send_message(
-            chat_id=order.manager.telegram_id,
-            text=notification_text,
-            parse_mode="Markdown"
-        )
+    # Несрочные обновления склеиваются в дайджест (services.notify_digest),
+    # срочные уходят сразу; хендлер не ждёт сеть
+    queued = await notify_digest(
+        bot,
+        order.manager.telegram_id,
+        "order_status",
+        "📦 *Обновление статусов заказов*",
+        f"#{order.id} {clinic_name}: {old_status_name} → {new_status_name}",
+        notification_text,
+        parse_mode="Markdown",
+        urgent=order.is_urgent,
+    )
+    if queued:
         logger.info(
-            f"Manager {order.manager.telegram_id} notified about order {order.id} "
+            f"Manager {order.manager.telegram_id} notification queued for order {order.id} "
             f"status change: {old_status} -> {new_status}"
         )
-        return True
-    except Exception as e:
-        logger.error(
-            f"Failed to notify manager {order.manager.telegram_id} about order {order.id}: {e}",
-            exc_info=True
-        )
-        return False
-
+    return queued
@@ -0,0 +1,160 @@
+"""
+Склейка уведомлений в дайджесты.
+
+Несрочные события для одного получателя и одной темы (например, «заказы готовы
+к доставке» для курьера) копятся NOTIFY_DIGEST_WINDOW секунд и уходят одним
+сообщением. Если по теме недавно уже был отправлен дайджест — он
+редактируется (дополняется новыми строками) вместо отправки нового сообщения.
+Срочные события отправляются сразу, без склейки.
+
+Накопленные за окно события живут в памяти (несколько секунд); дальше
+доставку обеспечивает services.notify_dispatcher. message_id отправленного
+дайджеста приходит позже (on_sent) и принимается, только если это ответ на
+последнюю отправку дайджеста (номер поколения в digest_key): иначе
+следующий дайджест отредактировал бы не то сообщение.
+"""
+from __future__ import annotations
+
+import asyncio
+import itertools
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+from aiogram import Bot
+
+from config import config
+from services.notify_dispatcher import enqueue_message, on_sent
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class _Digest:
+    title: str
+    parse_mode: Optional[str]
+    # (строка дайджеста, полный текст одиночного уведомления)
+    pending: list[tuple[str, str]] = field(default_factory=list)
+    # Строки, уже показанные в последнем дайджесте
+    lines: list[str] = field(default_factory=list)
+    message_id: Optional[int] = None
+    # Номер последней отправки: on_sent от предыдущих отправок игнорируется
+    generation: int = 0
+    sent_at: float = 0.0
+    task: Optional[asyncio.Task] = None
+
+
+# (chat_id, topic) -> _Digest
+_digests: dict[tuple[int, str], _Digest] = {}
+# Поколения отправок — сквозные, чтобы пересозданный дайджест не принял чужой ответ
+_generations = itertools.count(1)
+
+
+def _digest_key(topic: str, generation: int) -> str:
+    return f"{topic}#{generation}"
+
+
+def _remember_message_id(chat_id: int, digest_key: str, message_id: int) -> None:
+    topic, _, generation = digest_key.rpartition("#")
+    digest = _digests.get((chat_id, topic))
+    if digest is not None and generation.isdigit() and digest.generation == int(generation):
+        digest.message_id = message_id
+
+
+on_sent(_remember_message_id)
+
+
+def _render(title: str, lines: list[str]) -> str:
+    limit = config.NOTIFY_DIGEST_MAX_LINES
+    shown = lines[-limit:]
+    text = f"{title}\n\n" + "\n".join(shown)
+    if len(lines) > len(shown):
+        text += f"\n…и ещё {len(lines) - len(shown)}"
+    return text
+
+
+def _prune(now: float) -> None:
+    stale = [
+        key for key, d in _digests.items()
+        if d.task is None and not d.pending and now - d.sent_at > config.NOTIFY_DIGEST_EDIT_WINDOW
+    ]
+    for key in stale:
+        del _digests[key]
+
+
+async def _flush_later(bot: Bot, chat_id: int, topic: str) -> None:
+    await asyncio.sleep(config.NOTIFY_DIGEST_WINDOW)
+    digest = _digests.get((chat_id, topic))
+    if digest is None:
+        return
+    pending, digest.pending, digest.task = digest.pending, [], None
+    if not pending:
+        return
+
+    now = time.monotonic()
+    new_lines = [line for line, _ in pending]
+    can_edit = (
+        digest.message_id is not None
+        and now - digest.sent_at < config.NOTIFY_DIGEST_EDIT_WINDOW
+        and len(digest.lines) + len(new_lines) <= config.NOTIFY_DIGEST_MAX_LINES
+    )
+    if can_edit:
+        digest.lines = digest.lines + new_lines
+        text = _render(digest.title, digest.lines)
+        edit_message_id = digest.message_id
+    else:
+        digest.lines = new_lines
+        digest.message_id = None
+        edit_message_id = None
+        # Одно событие за окно — обычное сообщение, без заголовка дайджеста
+        text = pending[0][1] if len(pending) == 1 else _render(digest.title, new_lines)
+    digest.sent_at = now
+    digest.generation = next(_generations)
+
+    await enqueue_message(
+        bot, chat_id, text,
+        parse_mode=digest.parse_mode,
+        edit_message_id=edit_message_id,
+        digest_key=_digest_key(topic, digest.generation),
+    )
+    logger.debug(
+        "Digest chat=%s topic=%s events=%s edit=%s", chat_id, topic, len(pending), edit_message_id is not None
+    )
+
+
+async def notify_digest(
+    bot: Bot,
+    chat_id: int,
+    topic: str,
+    title: str,
+    line: str,
+    text: str,
+    *,
+    parse_mode: Optional[str] = None,
+    urgent: bool = False,
+) -> bool:
+    """
+    Уведомление с возможной склейкой.
+
+    Args:
+        chat_id: Получатель
+        topic: Тема дайджеста (склеиваются события одной темы)
+        title: Заголовок дайджеста
+        line: Строка события в дайджесте
+        text: Полный текст, если событие за окно одно (или срочное)
+        urgent: Отправить сразу, без склейки
+    """
+    if urgent or config.NOTIFY_DIGEST_WINDOW <= 0:
+        return await enqueue_message(bot, chat_id, text, parse_mode=parse_mode, urgent=urgent)
+
+    key = (chat_id, topic)
+    digest = _digests.get(key)
+    if digest is None:
+        if len(_digests) > 1000:
+            _prune(time.monotonic())
+        digest = _digests[key] = _Digest(title=title, parse_mode=parse_mode)
+    digest.pending.append((line, text))
+    if digest.task is None:
+        digest.task = asyncio.create_task(_flush_later(bot, chat_id, topic))
+    return True
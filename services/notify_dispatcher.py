@@ -0,0 +1,484 @@
+"""
+Очередь исходящих уведомлений Telegram.
+
+Хендлеры кладут сообщение в очередь и сразу возвращаются; отправляет пул
+воркеров с учётом лимитов Telegram: общий token bucket на бота (~30 сообщений/с)
+и по одному на чат (~1/с). TelegramRetryAfter приостанавливает отправку на
+указанное Telegram время. Срочные заказы идут отдельной приоритетной очередью.
+
+Воркеры только берут сообщения из очереди и передают их отправителю чата:
+у каждого чата с исходящими сообщениями одна задача-отправитель со своей
+очередью (deque), она отправляет их строго по порядку (повторы после сетевых
+ошибок и RetryAfter — на месте). Пачка в один чат не занимает воркеров,
+срочные сообщения другим чатам берутся сразу. Когда взятых, но не
+отправленных сообщений NOTIFY_MAX_INFLIGHT, воркеры берут только срочные.
+
+Очередь хранится в Redis (переживает перезапуск), без Redis — в памяти.
+Взятые из Redis сообщения лежат в общем для всех инстансов наборе
+«в обработке» со сроком (visibility timeout), который взявший инстанс
+продлевает, пока держит их у себя; сообщения с истёкшим сроком
+(инстанс упал или перезапущен с другим hostname) любой инстанс возвращает
+в очередь — при старте и периодически.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import time
+import uuid
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field, asdict
+from typing import Callable, Optional
+
+from aiogram import Bot
+from aiogram.types import InlineKeyboardMarkup
+from aiogram.exceptions import (
+    TelegramRetryAfter,
+    TelegramForbiddenError,
+    TelegramBadRequest,
+    TelegramNetworkError,
+    TelegramServerError,
+)
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Сколько почтовых корзин (чатов) держать; дольше всех не писавшие вытесняются
+CHAT_BUCKETS_MAX = 10_000
+
+
+@dataclass(slots=True)
+class Notification:
+    """Исходящее сообщение (сериализуется в JSON для Redis)."""
+    chat_id: int
+    text: str
+    parse_mode: Optional[str] = None
+    urgent: bool = False
+    attempts: int = 0
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    # Отредактировать ранее отправленное сообщение вместо нового (дайджесты)
+    edit_message_id: Optional[int] = None
+    # Ключ дайджеста: после отправки message_id передаётся подписчикам on_sent
+    digest_key: Optional[str] = None
+    # Inline-клавиатура (InlineKeyboardMarkup в виде JSON-словаря)
+    reply_markup: Optional[dict] = None
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self), ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, raw) -> Notification:
+        return cls(**json.loads(raw))
+
+
+class TokenBucket:
+    """Token bucket: rate токенов в секунду, не больше capacity."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def reserve(self) -> float:
+        """Взять токен; вернуть, сколько секунд подождать перед отправкой (0 — сразу)."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+
+# Подписчики на успешную отправку сообщений с digest_key: (chat_id, digest_key, message_id)
+_sent_listeners: list[Callable[[int, str, int], None]] = []
+
+
+def on_sent(callback: Callable[[int, str, int], None]) -> None:
+    """Подписаться на отправку сообщений с digest_key (см. services.notify_digest)."""
+    if callback not in _sent_listeners:
+        _sent_listeners.append(callback)
+
+
+async def _deliver(bot: Bot, n: Notification) -> None:
+    """Отправить (или отредактировать) сообщение и сообщить message_id подписчикам."""
+    message_id = None
+    markup = InlineKeyboardMarkup.model_validate(n.reply_markup) if n.reply_markup else None
+    if n.edit_message_id:
+        try:
+            await bot.edit_message_text(
+                n.text, chat_id=n.chat_id, message_id=n.edit_message_id,
+                parse_mode=n.parse_mode, reply_markup=markup,
+            )
+            message_id = n.edit_message_id
+        except TelegramBadRequest as e:
+            if "not modified" in str(e).lower():
+                message_id = n.edit_message_id
+            else:
+                # Сообщение удалено или слишком старое — отправляем новое
+                logger.info("Notify: edit failed for chat %s, sending new: %s", n.chat_id, e)
+    if message_id is None:
+        message = await bot.send_message(n.chat_id, n.text, parse_mode=n.parse_mode, reply_markup=markup)
+        message_id = getattr(message, "message_id", None)
+    if n.digest_key and message_id is not None:
+        for callback in list(_sent_listeners):
+            try:
+                callback(n.chat_id, n.digest_key, message_id)
+            except Exception:
+                logger.exception("Notify: on_sent listener failed")
+
+
+async def _sleep_until(at: float) -> None:
+    """Спать до момента at по time.monotonic() (часы цикла asyncio)."""
+    loop = asyncio.get_running_loop()
+    if at <= loop.time():
+        return
+    fut = loop.create_future()
+    handle = loop.call_at(at, lambda: fut.done() or fut.set_result(None))
+    try:
+        await fut
+    finally:
+        handle.cancel()
+
+
+class MemoryNotificationQueue:
+    """Очередь в памяти (fallback если Redis недоступен)."""
+
+    def __init__(self):
+        self._urgent: deque[Notification] = deque()
+        self._normal: deque[Notification] = deque()
+
+    async def push(self, n: Notification, front: bool = False) -> None:
+        lane = self._urgent if n.urgent else self._normal
+        if front:
+            lane.appendleft(n)
+        else:
+            lane.append(n)
+
+    async def pop(self, urgent_only: bool = False) -> Optional[Notification]:
+        if self._urgent:
+            return self._urgent.popleft()
+        if self._normal and not urgent_only:
+            return self._normal.popleft()
+        return None
+
+    async def ack(self, n: Notification) -> None:
+        pass
+
+    async def heartbeat(self) -> None:
+        pass
+
+    async def recover(self) -> int:
+        return 0
+
+
+# Взять сообщение из очереди и отметить «в обработке до ARGV[1]» — атомарно
+_POP_LUA = """
+local raw = redis.call('LPOP', KEYS[1])
+if raw then
+    redis.call('ZADD', KEYS[2], ARGV[1], raw)
+end
+return raw
+"""
+
+
+class RedisNotificationQueue:
+    """
+    Очередь на Redis-списках: notify:q:urgent, notify:q:normal.
+    Взятое сообщение атомарно (Lua) переносится в общий ZSET notify:processing
+    со сроком обработки и удаляется оттуда после отправки. Сообщения с истёкшим
+    сроком возвращает в начало очереди recover(); ZREM гарантирует, что одно
+    сообщение вернёт только один инстанс.
+    """
+
+    def __init__(self, redis_client, prefix: str = "notify:", visibility_timeout: float = 120.0):
+        self.redis = redis_client
+        self.visibility_timeout = visibility_timeout
+        self._prefix = prefix
+        self._urgent = f"{prefix}q:urgent"
+        self._normal = f"{prefix}q:normal"
+        self._processing = f"{prefix}processing"
+        self._pop_script = redis_client.register_script(_POP_LUA)
+        # id -> сырое значение в наборе «в обработке» (для ZREM)
+        self._raw: dict[str, bytes | str] = {}
+
+    def _deadline(self) -> float:
+        # Время стены, а не monotonic: срок читают другие инстансы
+        return time.time() + self.visibility_timeout
+
+    async def push(self, n: Notification, front: bool = False) -> None:
+        key = self._urgent if n.urgent else self._normal
+        # Воркеры берут слева (LPOP): в конец — RPUSH, в начало — LPUSH
+        if front:
+            await self.redis.lpush(key, n.to_json())
+        else:
+            await self.redis.rpush(key, n.to_json())
+
+    async def pop(self, urgent_only: bool = False) -> Optional[Notification]:
+        for key in (self._urgent,) if urgent_only else (self._urgent, self._normal):
+            raw = await self._pop_script(keys=[key, self._processing], args=[self._deadline()])
+            if raw is not None:
+                n = Notification.from_json(raw)
+                self._raw[n.id] = raw
+                return n
+        return None
+
+    async def ack(self, n: Notification) -> None:
+        raw = self._raw.pop(n.id, None)
+        if raw is not None:
+            await self.redis.zrem(self._processing, raw)
+
+    async def heartbeat(self) -> None:
+        """Продлить срок обработки всех взятых этим процессом (ждут в очередях чатов, повторы)."""
+        if self._raw:
+            deadline = self._deadline()
+            await self.redis.zadd(self._processing, {raw: deadline for raw in self._raw.values()}, xx=True)
+
+    async def recover(self) -> int:
+        """Вернуть в очередь сообщения с истёкшим сроком обработки."""
+        count = 0
+        for raw in await self.redis.zrangebyscore(self._processing, "-inf", time.time()):
+            if await self.redis.zrem(self._processing, raw):
+                await self.push(Notification.from_json(raw), front=True)
+                count += 1
+        # Списки «в обработке» по hostname от прежних версий
+        async for key in self.redis.scan_iter(match=f"{self._processing}:*"):
+            while (raw := await self.redis.rpop(key)) is not None:
+                await self.push(Notification.from_json(raw), front=True)
+                count += 1
+        return count
+
+
+class NotificationDispatcher:
+    """Пул воркеров отправки с глобальным и почтовым (по чату) rate limit."""
+
+    def __init__(self, bot: Bot, queue, workers: int = 4, max_inflight: int = 100):
+        self.bot = bot
+        self.queue = queue
+        self.workers = workers
+        self._global = TokenBucket(config.NOTIFY_GLOBAL_RATE, config.NOTIFY_GLOBAL_RATE)
+        # LRU: последний использованный чат — в конце
+        self._chats: OrderedDict[int, TokenBucket] = OrderedDict()
+        # chat_id -> сообщения, ждущие отправителя чата (есть, пока он работает)
+        self._chat_queues: dict[int, deque[Notification]] = {}
+        self._senders: set[asyncio.Task] = set()
+        # Взято из очереди и не отправлено; при max_inflight берутся только срочные
+        self.max_inflight = max_inflight
+        self._inflight = 0
+        self._paused_until = 0.0
+        self._wakeup = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []
+        self.sent = 0
+        self.failed = 0
+
+    async def enqueue(self, n: Notification) -> None:
+        await self.queue.push(n)
+        self._wakeup.set()
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(config.NOTIFY_CHAT_RATE, config.NOTIFY_CHAT_BURST)
+            self._chats[chat_id] = bucket
+            while len(self._chats) > CHAT_BUCKETS_MAX:
+                # Дольше всех не писавший чат; его корзина давно полная — пересоздастся
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    async def _send(self, n: Notification) -> None:
+        # Сначала корзина чата, потом общий токен: пока чат ждёт своей
+        # очереди, общий лимит достаётся другим чатам
+        await _sleep_until(time.monotonic() + self._chat_bucket(n.chat_id).reserve())
+        await _sleep_until(max(time.monotonic() + self._global.reserve(), self._paused_until))
+        await _deliver(self.bot, n)
+
+    async def _send_with_retries(self, n: Notification) -> None:
+        while True:
+            try:
+                await self._send(n)
+                self.sent += 1
+                return
+            except TelegramRetryAfter as e:
+                # Telegram просит подождать — приостанавливаем всю отправку и повторяем
+                retry_after = float(getattr(e, "retry_after", 1))
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+                logger.warning("Notify: RetryAfter %.1fs (chat=%s)", retry_after, n.chat_id)
+            except (TelegramForbiddenError, TelegramBadRequest) as e:
+                # Бот заблокирован / чат не найден / ошибка разметки — повтор не поможет
+                self.failed += 1
+                logger.error("Notify: dropped message to chat %s: %s", n.chat_id, e)
+                return
+            except (TelegramNetworkError, TelegramServerError, asyncio.TimeoutError, OSError) as e:
+                n.attempts += 1
+                if n.attempts >= config.NOTIFY_MAX_ATTEMPTS:
+                    self.failed += 1
+                    logger.error("Notify: giving up on chat %s after %s attempts: %s", n.chat_id, n.attempts, e)
+                    return
+                # Повтор на месте: следующие сообщения чата ждут его (порядок не меняется)
+                await asyncio.sleep(min(30.0, 2 ** n.attempts))
+
+    async def _process(self, n: Notification) -> None:
+        try:
+            await self._send_with_retries(n)
+        except asyncio.CancelledError:
+            # Остановка: не ack — из Redis сообщение вернёт recover() по сроку
+            raise
+        except Exception as e:
+            self.failed += 1
+            logger.error("Notify: unexpected error for chat %s: %s", n.chat_id, e, exc_info=True)
+        try:
+            await self.queue.ack(n)
+        except Exception as e:
+            logger.warning("Notify: ack failed for chat %s: %s", n.chat_id, e)
+        finally:
+            self._inflight -= 1
+            if self._inflight == self.max_inflight - 1:
+                self._wakeup.set()
+
+    async def _chat_sender(self, n: Notification) -> None:
+        """Отправитель чата: n и всё, что воркеры добавят в очередь чата, по порядку."""
+        chat_id = n.chat_id
+        pending = self._chat_queues[chat_id]
+        try:
+            while True:
+                await self._process(n)
+                if not pending:
+                    break
+                n = pending.popleft()
+        finally:
+            # Между проверкой очереди и удалением нет await — воркер не добавит в «мёртвую» очередь
+            del self._chat_queues[chat_id]
+
+    def _hand_off(self, n: Notification) -> None:
+        pending = self._chat_queues.get(n.chat_id)
+        if pending is not None:
+            pending.append(n)
+            return
+        self._chat_queues[n.chat_id] = deque()
+        task = asyncio.create_task(self._chat_sender(n))
+        self._senders.add(task)
+        task.add_done_callback(self._senders.discard)
+
+    async def _worker(self) -> None:
+        while True:
+            try:
+                n = await self.queue.pop(urgent_only=self._inflight >= self.max_inflight)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Notify: queue pop failed: %s", e)
+                n = None
+                await asyncio.sleep(1)
+            if n is None:
+                # Пусто (или лимит): ждём локальный enqueue / освободившееся место или опрашиваем раз в секунду
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=1.0)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._inflight += 1
+            self._hand_off(n)
+
+    async def _recover(self) -> None:
+        recovered = await self.queue.recover()
+        if recovered:
+            logger.info("Notify: recovered %s unsent messages", recovered)
+            self._wakeup.set()
+
+    async def _recover_loop(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                # Сначала продлить свои (ждут в очередях чатов), потом вернуть чужие просроченные
+                await self.queue.heartbeat()
+                await self._recover()
+            except Exception as e:
+                logger.warning("Notify: recover failed: %s", e)
+
+    async def start(self) -> None:
+        await self._recover()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        timeout = getattr(self.queue, "visibility_timeout", None)
+        if timeout:
+            # Сообщения упавших инстансов возвращаются и без перезапуска этого
+            self._tasks.append(asyncio.create_task(self._recover_loop(timeout / 2)))
+
+    async def stop(self) -> None:
+        tasks = self._tasks + list(self._senders)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+
+
+# Глобальный диспетчер (инициализируется в main.py)
+dispatcher: Optional[NotificationDispatcher] = None
+
+
+async def init_dispatcher(bot: Bot, redis_client=None) -> NotificationDispatcher:
+    """Инициализировать и запустить диспетчер уведомлений."""
+    global dispatcher
+    queue = None
+    if redis_client:
+        try:
+            await redis_client.ping()
+            queue = RedisNotificationQueue(redis_client, visibility_timeout=config.NOTIFY_VISIBILITY_TIMEOUT)
+            logger.info("Using Redis queue for notifications")
+        except Exception as e:
+            logger.warning("Redis not available for notifications, using memory: %s", e)
+    if queue is None:
+        queue = MemoryNotificationQueue()
+        logger.info("Using memory queue for notifications")
+    dispatcher = NotificationDispatcher(
+        bot, queue, workers=config.NOTIFY_WORKERS, max_inflight=config.NOTIFY_MAX_INFLIGHT
+    )
+    await dispatcher.start()
+    return dispatcher
+
+
+async def stop_dispatcher() -> None:
+    """Остановка воркеров (при shutdown). Неотправленное остаётся в Redis."""
+    if dispatcher is not None:
+        await dispatcher.stop()
+
+
+async def enqueue_message(
+    bot: Bot,
+    chat_id: int,
+    text: str,
+    *,
+    parse_mode: Optional[str] = None,
+    urgent: bool = False,
+    edit_message_id: Optional[int] = None,
+    digest_key: Optional[str] = None,
+    reply_markup: Optional[InlineKeyboardMarkup] = None,
+) -> bool:
+    """
+    Поставить сообщение в очередь отправки и сразу вернуться.
+    Если диспетчер не запущен (скрипты, отдельные утилиты) — отправляет напрямую.
+    """
+    n = Notification(
+        chat_id, text, parse_mode, urgent,
+        edit_message_id=edit_message_id, digest_key=digest_key,
+        reply_markup=reply_markup.model_dump(mode="json", exclude_none=True) if reply_markup else None,
+    )
+    if dispatcher is not None:
+        try:
+            await dispatcher.enqueue(n)
+            return True
+        except Exception as e:
+            logger.warning("Notify: enqueue failed, sending directly: %s", e)
+    try:
+        await _deliver(bot, n)
+        return True
+    except Exception as e:
+        logger.error("Failed to send message to %s: %s", chat_id, e)
+        return False
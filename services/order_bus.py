@@ -0,0 +1,164 @@
+"""
+Шина событий заказов (создание, смена статуса, изменение позиций).
+
+События копятся в session.info и публикуются только после успешного COMMIT
+(при ROLLBACK — отбрасываются), поэтому подписчики никогда не видят
+изменений, которых нет в БД. Локальные подписчики вызываются синхронно,
+другие инстансы бота получают события через Redis pub/sub (если Redis есть).
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from database.models import OrderStatus
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "order_changes"
+_SESSION_KEY = "order_changes"
+
+# Уникальный id процесса — чтобы не обрабатывать свои же сообщения из Redis
+_INSTANCE_ID = uuid.uuid4().hex
+
+_listeners: list[Callable[["OrderChange"], None]] = []
+_redis = None
+_listener_task: Optional[asyncio.Task] = None
+
+
+def to_ts(value: Optional[datetime]) -> float:
+    """datetime -> epoch seconds (naive считается UTC, как в SQLite)."""
+    if value is None:
+        return datetime.now(timezone.utc).timestamp()
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+@dataclass(frozen=True, slots=True)
+class OrderChange:
+    """Снимок заказа после изменения — достаточно для очередей и кешей без БД."""
+    order_id: int
+    status: OrderStatus
+    is_urgent: bool
+    created_ts: float
+    version: int = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "order_id": self.order_id,
+            "status": self.status.value,
+            "is_urgent": self.is_urgent,
+            "created_ts": self.created_ts,
+            "version": self.version,
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict) -> OrderChange:
+        return cls(
+            order_id=int(d["order_id"]),
+            status=OrderStatus(d["status"]),
+            is_urgent=bool(d["is_urgent"]),
+            created_ts=float(d["created_ts"]),
+            version=int(d.get("version", 0)),
+        )
+
+
+def subscribe(callback: Callable[[OrderChange], None]) -> None:
+    """Подписаться на события (callback синхронный и быстрый, без I/O)."""
+    if callback not in _listeners:
+        _listeners.append(callback)
+
+
+def emit(session, change: OrderChange) -> None:
+    """Поставить событие в очередь сессии; уйдёт подписчикам после COMMIT."""
+    session.info.setdefault(_SESSION_KEY, []).append(change)
+
+
+def _dispatch_local(changes: list[OrderChange]) -> None:
+    for change in changes:
+        for callback in list(_listeners):
+            try:
+                callback(change)
+            except Exception:
+                logger.exception("Order change listener failed for order %s", change.order_id)
+
+
+async def _publish(changes: list[OrderChange]) -> None:
+    try:
+        payload = json.dumps({"src": _INSTANCE_ID, "changes": [c.to_dict() for c in changes]})
+        await _redis.publish(CHANNEL, payload)
+    except Exception as e:
+        logger.warning("Order bus publish failed: %s", e)
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session: Session) -> None:
+    changes = session.info.pop(_SESSION_KEY, None)
+    if not changes:
+        return
+    _dispatch_local(changes)
+    if _redis is not None:
+        try:
+            asyncio.get_running_loop().create_task(_publish(changes))
+        except RuntimeError:
+            pass
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session: Session) -> None:
+    session.info.pop(_SESSION_KEY, None)
+
+
+async def _listen_loop() -> None:
+    pubsub = _redis.pubsub()
+    await pubsub.subscribe(CHANNEL)
+    try:
+        while True:
+            try:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=5.0)
+                if message is None:
+                    continue
+                data = json.loads(message["data"])
+                if data.get("src") == _INSTANCE_ID:
+                    continue
+                _dispatch_local([OrderChange.from_dict(d) for d in data.get("changes", [])])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Order bus receive error: %s", e)
+                await asyncio.sleep(1)
+    finally:
+        try:
+            await pubsub.unsubscribe(CHANNEL)
+            await pubsub.aclose()
+        except Exception:
+            pass
+
+
+async def init_order_bus(redis_client=None) -> None:
+    """Подключить Redis pub/sub (вызывать из main.py). Без Redis — только локальные события."""
+    global _redis, _listener_task
+    if redis_client is None:
+        logger.info("Order bus: local only (no Redis)")
+        return
+    _redis = redis_client
+    _listener_task = asyncio.create_task(_listen_loop())
+    logger.info("Order bus: Redis channel %s", CHANNEL)
+
+
+def stop_order_bus() -> None:
+    """Остановка (при shutdown)."""
+    global _redis, _listener_task
+    if _listener_task and not _listener_task.done():
+        _listener_task.cancel()
+    _listener_task = None
+    _redis = None
@@ -2,16 +2,35 @@
 Сервис для работы с заказами.
 """
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterable, Sequence
 from datetime import datetime, timezone
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from database.models import Order, OrderItem, OrderStatus, DeliveryType, User, Clinic
+from sqlalchemy import select, update, insert, func, or_
+from sqlalchemy.orm import selectinload
+from database.models import Order, OrderItem, OrderStatus, DeliveryType, User, Clinic, OrderEvent, OrderSla
 from services.catalog_db import get_qty as db_get_qty, subtract_qty as db_subtract
+from services.pagination import invalidate_count
+from services.order_bus import OrderChange, emit as emit_order_change, to_ts
 from config import config
 
 logger = logging.getLogger(__name__)
 
+# Этап SLA для каждого целевого статуса: (колонка метки, колонка длительности,
+# метки начала этапа — первая заполненная). TAXI идёт ASSEMBLY -> DELIVERED
+# без READY_FOR_PICKUP / DELIVERING: его delivery_s — от начала сборки
+# до отправки такси (в dashboard — отдельной строкой).
+_SLA_STAGES = {
+    OrderStatus.ASSEMBLY: ("assembly_started_ts", "queue_wait_s", ("created_ts",)),
+    OrderStatus.READY_FOR_PICKUP: ("ready_ts", "assembly_s", ("assembly_started_ts",)),
+    OrderStatus.DELIVERING: ("pickup_ts", "pickup_wait_s", ("ready_ts",)),
+    OrderStatus.DELIVERED: ("delivered_ts", "delivery_s", ("pickup_ts", "ready_ts", "assembly_started_ts")),
+}
+
+
+def manager_orders_count_key(manager_id: int) -> str:
+    """Ключ кешированного количества заказов менеджера (см. services.pagination)."""
+    return f"manager_orders:{manager_id}"
+
 
 class OrderService:
     """Сервис для создания и управления заказами."""
@@ -86,6 +105,21 @@ class OrderService:
             session.add(new_order)
             await session.flush()
 
+            now = datetime.now(timezone.utc)
+            session.add(OrderEvent(
+                order_id=new_order.id,
+                from_status=None,
+                to_status=OrderStatus.NEW,
+                created_at=now,
+            ))
+            session.add(OrderSla(
+                order_id=new_order.id,
+                is_urgent=is_urgent,
+                delivery_type=delivery_type,
+                created_ts=now.timestamp(),
+            ))
+            emit_order_change(session, OrderChange(new_order.id, OrderStatus.NEW, is_urgent, now.timestamp(), 1))
+
             for item in cart:
                 order_item = OrderItem(
                     order_id=new_order.id,
@@ -108,6 +142,7 @@ class OrderService:
 
             await session.commit()
             await session.refresh(new_order)
+            invalidate_count(manager_orders_count_key(manager_id))
 
             logger.info(
                 "Order created: id=%s, manager=%s, clinic=%s, items=%s",
@@ -135,7 +170,6 @@ class OrderService:
         Returns:
             Order или None
         """
-        from sqlalchemy.orm import selectinload
         stmt = (
             select(Order)
             .options(
@@ -174,13 +208,12 @@ class OrderService:
                 return False, "Заказ не найден"
             
             old_status = order.status
-            order.status = status
-            
-            # Обновляем временные метки
-            if status == OrderStatus.ASSEMBLY:
-                order.assembled_at = datetime.now(timezone.utc)
-            elif status == OrderStatus.DELIVERED:
-                order.delivered_at = datetime.now(timezone.utc)
+            # Через общий переход: временные метки, журнал событий и SLA
+            changed = await OrderService.transition_many(
+                session, [order_id], old_status, status
+            )
+            if not changed:
+                return False, "Статус заказа изменился"
             
             await session.commit()
             await session.refresh(order)
@@ -196,3 +229,229 @@ class OrderService:
             await session.rollback()
             return False, f"Ошибка обновления статуса: {e}"
 
+    @staticmethod
+    async def transition_many(
+        session: AsyncSession,
+        order_ids: Optional[Iterable[int]],
+        from_statuses: OrderStatus | Sequence[OrderStatus],
+        to_status: OrderStatus,
+        *,
+        courier_id: Optional[int] = None,
+        actor_telegram_id: Optional[int] = None,
+        where: Sequence[Any] = (),
+        values: Optional[Dict[str, Any]] = None,
+    ) -> List[int]:
+        """
+        Массовый переход статуса одним UPDATE ... WHERE id IN (...) AND status IN (...) RETURNING id.
+
+        На PostgreSQL строки отбираются подзапросом с FOR UPDATE SKIP LOCKED:
+        два курьера, одновременно берущие пересекающиеся маршруты, никогда не получат
+        один и тот же заказ — второй просто не увидит заблокированные строки.
+        На SQLite FOR UPDATE не генерируется (запись и так сериализуется).
+
+        Args:
+            session: Сессия БД (commit делает вызывающий код)
+            order_ids: ID заказов; None — все заказы в статусах from_statuses
+            from_statuses: Допустимые исходные статусы
+            to_status: Новый статус
+            courier_id: Назначить курьера
+            actor_telegram_id: Кто выполняет переход (для журнала order_events)
+            where: Дополнительные условия WHERE
+            values: Дополнительные колонки для SET
+
+        Returns:
+            ID заказов, которые действительно перешли в новый статус
+        """
+        if order_ids is not None:
+            order_ids = list(order_ids)
+            if not order_ids:
+                return []
+        if isinstance(from_statuses, OrderStatus):
+            from_statuses = (from_statuses,)
+
+        conditions = [Order.status.in_(from_statuses), *where]
+        if order_ids is not None:
+            conditions.append(Order.id.in_(order_ids))
+
+        locked_ids = (
+            select(Order.id)
+            .where(*conditions)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+
+        new_values: Dict[str, Any] = dict(values or {})
+        new_values["status"] = to_status
+        new_values["version"] = Order.version + 1
+        if courier_id is not None:
+            new_values["courier_id"] = courier_id
+        now = datetime.now(timezone.utc)
+        if to_status == OrderStatus.READY_FOR_PICKUP:
+            new_values.setdefault("assembled_at", now)
+        elif to_status == OrderStatus.DELIVERED:
+            new_values.setdefault("delivered_at", now)
+
+        stmt = (
+            update(Order)
+            .where(Order.id.in_(locked_ids), *conditions)
+            .values(**new_values)
+            .returning(Order.id, Order.is_urgent, Order.created_at, Order.version)
+            .execution_options(synchronize_session="fetch")
+        )
+        result = await session.execute(stmt)
+        rows = result.all()
+        changed = [row.id for row in rows]
+        for row in rows:
+            emit_order_change(
+                session, OrderChange(row.id, to_status, bool(row.is_urgent), to_ts(row.created_at), row.version)
+            )
+
+        if changed:
+            from_status = from_statuses[0] if len(from_statuses) == 1 else None
+            await OrderService._record_transitions(
+                session, changed, from_status, to_status, actor_telegram_id, now
+            )
+
+        logger.info(
+            "Orders transitioned: %s -> %s, requested=%s, changed=%s",
+            [s.value for s in from_statuses], to_status.value,
+            len(order_ids) if order_ids is not None else "all", len(changed)
+        )
+        return changed
+
+    @staticmethod
+    async def bump_version(session: AsyncSession, order_id: int) -> Optional[int]:
+        """
+        Увеличить версию заказа после изменения позиций (нет в наличии, замена),
+        чтобы закешированные карточки заказа перестроились. Commit — у вызывающего.
+        """
+        result = await session.execute(
+            update(Order)
+            .where(Order.id == order_id)
+            .values(version=Order.version + 1)
+            .returning(Order.id, Order.status, Order.is_urgent, Order.created_at, Order.version)
+            .execution_options(synchronize_session="fetch")
+        )
+        row = result.first()
+        if row is None:
+            return None
+        emit_order_change(
+            session, OrderChange(row.id, row.status, bool(row.is_urgent), to_ts(row.created_at), row.version)
+        )
+        return row.version
+
+    @staticmethod
+    async def _record_transitions(
+        session: AsyncSession,
+        order_ids: List[int],
+        from_status: Optional[OrderStatus],
+        to_status: OrderStatus,
+        actor_telegram_id: Optional[int],
+        now: datetime,
+    ) -> None:
+        """
+        Журнал + SLA-rollup для уже выполненного перехода, в той же транзакции.
+        Без чтений: один многострочный INSERT в order_events и один UPDATE order_sla,
+        длительность этапа считается в SQL (ts - метка начала этапа).
+        """
+        await session.execute(
+            insert(OrderEvent),
+            [
+                {
+                    "order_id": order_id,
+                    "from_status": from_status,
+                    "to_status": to_status,
+                    "actor_telegram_id": actor_telegram_id,
+                    "created_at": now,
+                }
+                for order_id in order_ids
+            ],
+        )
+
+        stage = _SLA_STAGES.get(to_status)
+        if stage is None:
+            return
+        ts_col, duration_col, start_cols = stage
+        ts = now.timestamp()
+        starts = [getattr(OrderSla, c) for c in start_cols]
+        sla_values: Dict[str, Any] = {
+            ts_col: ts,
+            duration_col: ts - (func.coalesce(*starts) if len(starts) > 1 else starts[0]),
+        }
+        if to_status == OrderStatus.DELIVERED:
+            sla_values["total_s"] = ts - OrderSla.created_ts
+        await session.execute(
+            update(OrderSla)
+            .where(OrderSla.order_id.in_(order_ids))
+            .values(**sla_values)
+            .execution_options(synchronize_session=False)
+        )
+
+    @staticmethod
+    async def claim_for_courier(
+        session: AsyncSession,
+        order_ids: Iterable[int],
+        courier_id: int,
+        actor_telegram_id: Optional[int] = None
+    ) -> List[int]:
+        """
+        Взять заказы в доставку (READY_FOR_PICKUP -> DELIVERING) одним запросом.
+        Возвращает ID заказов, которые достались этому курьеру.
+        """
+        return await OrderService.transition_many(
+            session,
+            order_ids,
+            OrderStatus.READY_FOR_PICKUP,
+            OrderStatus.DELIVERING,
+            courier_id=courier_id,
+            actor_telegram_id=actor_telegram_id,
+        )
+
+    @staticmethod
+    async def mark_delivered_by_courier(
+        session: AsyncSession,
+        order_ids: Iterable[int],
+        courier_id: int,
+        actor_telegram_id: Optional[int] = None
+    ) -> List[int]:
+        """
+        Отметить заказы курьера доставленными (DELIVERING -> DELIVERED) одним запросом.
+        Заказы, назначенные другому курьеру, не затрагиваются; свободным назначается текущий.
+        """
+        return await OrderService.transition_many(
+            session,
+            order_ids,
+            OrderStatus.DELIVERING,
+            OrderStatus.DELIVERED,
+            actor_telegram_id=actor_telegram_id,
+            where=(or_(Order.courier_id.is_(None), Order.courier_id == courier_id),),
+            values={"courier_id": func.coalesce(Order.courier_id, courier_id)},
+        )
+
+    @staticmethod
+    async def load_orders(
+        session: AsyncSession,
+        order_ids: Iterable[int],
+        *,
+        with_items: bool = False
+    ) -> List[Order]:
+        """
+        Загрузить заказы (с клиникой и менеджером) одним SELECT, в порядке order_ids.
+        Для уведомлений и карточек после массового перехода.
+        """
+        order_ids = list(order_ids)
+        if not order_ids:
+            return []
+        options = [selectinload(Order.clinic), selectinload(Order.manager)]
+        if with_items:
+            options.append(selectinload(Order.items))
+        # populate_existing — статусы в identity map могли устареть после UPDATE без ORM
+        stmt = (
+            select(Order)
+            .options(*options)
+            .where(Order.id.in_(order_ids))
+            .execution_options(populate_existing=True)
+        )
+        result = await session.execute(stmt)
+        by_id = {o.id: o for o in result.scalars().all()}
+        return [by_id[oid] for oid in order_ids if oid in by_id]
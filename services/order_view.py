@@ -0,0 +1,170 @@
+"""
+Проекция заказа для карточек (склад, менеджер) и кеш отрисованных карточек.
+
+OrderView — неизменяемый снимок заказа со всем, что нужно для текста карточки
+(клиника, менеджер, позиции с заменами). Отрисованный текст и клавиатура
+кешируются по ключу (order_id, version, audience): orders.version растёт при
+каждой смене статуса и изменении позиций, новая версия приходит через
+services.order_bus — повторный показ той же карточки не обращается к БД.
+"""
+from __future__ import annotations
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Callable, NamedTuple, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from database.models import DeliveryType, Order, OrderStatus
+from services.order_bus import OrderChange, subscribe
+
+# Сколько отрисованных карточек держать в памяти
+CARD_CACHE_SIZE = 1000
+
+
+@dataclass(frozen=True, slots=True)
+class OrderItemView:
+    """Позиция заказа (поля совпадают с OrderItem — подходит для клавиатур)."""
+    id: int
+    item_name: str
+    quantity: int
+    need_replacement: bool
+    replacement_sku: Optional[str]
+    replacement_name: Optional[str]
+
+    @property
+    def display_name(self) -> str:
+        return self.replacement_name or self.item_name
+
+    @property
+    def waiting_replacement(self) -> bool:
+        return self.need_replacement and not self.replacement_sku
+
+
+@dataclass(frozen=True, slots=True)
+class OrderView:
+    """Неизменяемый снимок заказа для отображения."""
+    id: int
+    version: int
+    status: OrderStatus
+    is_urgent: bool
+    delivery_type: Optional[DeliveryType]
+    taxi_link: Optional[str]
+    created_at: Optional[datetime]
+    assembled_at: Optional[datetime]
+    delivered_at: Optional[datetime]
+    manager_id: int
+    manager_name: Optional[str]
+    manager_telegram_id: Optional[int]
+    clinic_name: Optional[str]
+    doctor_name: Optional[str]
+    items: tuple[OrderItemView, ...]
+
+    @classmethod
+    def from_orm(cls, order: Order) -> OrderView:
+        """Создать из Order с загруженными clinic, manager, items."""
+        return cls(
+            id=order.id,
+            version=order.version or 0,
+            status=order.status,
+            is_urgent=bool(order.is_urgent),
+            delivery_type=order.delivery_type,
+            taxi_link=order.taxi_link,
+            created_at=order.created_at,
+            assembled_at=order.assembled_at,
+            delivered_at=order.delivered_at,
+            manager_id=order.manager_id,
+            manager_name=order.manager.full_name if order.manager else None,
+            manager_telegram_id=order.manager.telegram_id if order.manager else None,
+            clinic_name=order.clinic.name if order.clinic else None,
+            doctor_name=order.clinic.doctor_name if order.clinic else None,
+            items=tuple(
+                OrderItemView(
+                    id=item.id,
+                    item_name=item.item_name,
+                    quantity=item.quantity,
+                    need_replacement=bool(item.need_replacement),
+                    replacement_sku=item.replacement_sku,
+                    replacement_name=item.replacement_name,
+                )
+                for item in order.items or []
+            ),
+        )
+
+
+class OrderCard(NamedTuple):
+    """Отрисованная карточка: снимок заказа, текст (Markdown), клавиатура."""
+    view: OrderView
+    text: str
+    reply_markup: Any
+
+
+# (order_id, version, audience) -> OrderCard, LRU
+_cards: OrderedDict[tuple[int, int, str], OrderCard] = OrderedDict()
+# order_id -> последняя известная версия
+_versions: OrderedDict[int, int] = OrderedDict()
+
+
+def _remember_version(order_id: int, version: int) -> None:
+    if _versions.get(order_id, 0) > version:
+        return
+    _versions[order_id] = version
+    _versions.move_to_end(order_id)
+    while len(_versions) > CARD_CACHE_SIZE:
+        _versions.popitem(last=False)
+
+
+def _on_order_change(change: OrderChange) -> None:
+    if change.version:
+        _versions.pop(change.order_id, None)
+        _remember_version(change.order_id, change.version)
+    else:
+        # Событие без версии — версию не знаем, следующий показ перечитает БД
+        _versions.pop(change.order_id, None)
+
+
+subscribe(_on_order_change)
+
+
+async def load_order_view(session: AsyncSession, order_id: int) -> Optional[OrderView]:
+    """Прочитать заказ из БД (одна выборка + selectinload связей) и построить снимок."""
+    result = await session.execute(
+        select(Order)
+        .options(selectinload(Order.clinic), selectinload(Order.manager), selectinload(Order.items))
+        .where(Order.id == order_id)
+        .execution_options(populate_existing=True)
+    )
+    order = result.scalar_one_or_none()
+    return OrderView.from_orm(order) if order is not None else None
+
+
+async def get_order_card(
+    session: AsyncSession,
+    order_id: int,
+    audience: str,
+    render: Callable[[OrderView], tuple[str, Any]],
+) -> Optional[OrderCard]:
+    """
+    Карточка заказа для аудитории (например, "warehouse", "manager").
+    render(view) -> (text, reply_markup) вызывается только при промахе кеша.
+    """
+    version = _versions.get(order_id)
+    if version is not None:
+        card = _cards.get((order_id, version, audience))
+        if card is not None:
+            _cards.move_to_end((order_id, version, audience))
+            return card
+
+    view = await load_order_view(session, order_id)
+    if view is None:
+        return None
+    text, reply_markup = render(view)
+    card = OrderCard(view, text, reply_markup)
+    _remember_version(view.id, view.version)
+    _cards[(view.id, view.version, audience)] = card
+    while len(_cards) > CARD_CACHE_SIZE:
+        _cards.popitem(last=False)
+    return card
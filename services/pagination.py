@@ -0,0 +1,206 @@
+"""
+Курсорная (keyset) пагинация списков.
+
+Вместо LIMIT/OFFSET страница выбирается условием по ключу сортировки
+(например, (created_at, id)) — стоимость запроса не растёт с глубиной
+истории. Курсор — компактная base64-строка, помещается в callback_data
+(лимит Telegram 64 байта). Общее количество считается COUNT(*) один раз
+и кешируется на короткое время (приблизительный итог для шапки списка).
+"""
+from __future__ import annotations
+
+import base64
+import struct
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional, Sequence
+
+from sqlalchemy import ColumnElement, Select, String, and_, func, literal, select, tuple_, type_coerce
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+# Время жизни закешированного COUNT(*), секунды
+COUNT_CACHE_TTL = 60.0
+
+# Формат, в котором SQLAlchemy пишет DateTime в SQLite (server_default
+# CURRENT_TIMESTAMP пишет без дробной части: "YYYY-MM-DD HH:MM:SS")
+_SQLITE_STAMP = "%Y-%m-%d %H:%M:%S.%f"
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# key -> (count, expires_at)
+_count_cache: dict[str, tuple[int, float]] = {}
+
+
+@dataclass(slots=True)
+class Page:
+    """Страница keyset-пагинации."""
+    rows: list
+    page: int
+    next_cursor: Optional[str]
+    prev_cursor: Optional[str]
+
+
+def _to_int(value: Any) -> int:
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        delta = value - _EPOCH
+        return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+    return int(value)
+
+
+def _from_int(value: int, sample_col) -> Any:
+    python_type = None
+    try:
+        python_type = sample_col.type.python_type
+    except (NotImplementedError, AttributeError):
+        pass
+    if python_type is datetime:
+        return _EPOCH + timedelta(microseconds=value)
+    return value
+
+
+def encode_cursor(values: Sequence[Any], page: int) -> str:
+    """Упаковать значения ключа сортировки и номер страницы в строку."""
+    ints = [_to_int(v) for v in values]
+    raw = struct.pack(f">{len(ints)}qH", *ints, max(0, min(page, 0xFFFF)))
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def decode_cursor(cursor: str, key_cols: Sequence) -> Optional[tuple[tuple, int]]:
+    """Распаковать курсор. Возвращает (значения ключа, номер страницы) или None."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        *ints, page = struct.unpack(f">{len(key_cols)}qH", raw)
+    except (ValueError, struct.error):
+        return None
+    values = tuple(_from_int(v, col) for v, col in zip(ints, key_cols))
+    return values, page
+
+
+def _sqlite_stamp(col) -> ColumnElement:
+    """
+    Значение DateTime в SQLite как строка единого вида "…SS.ffffff":
+    строки без дробной части дополняются ".000000". Иначе параметр
+    "…SS.000000" больше хранимого "…SS", и строки той же секунды
+    (включая строку курсора) снова попадают на следующую страницу.
+    """
+    return func.substr(type_coerce(col, String).concat(".000000"), 1, 26)
+
+
+def keyset_condition(
+    key_cols: Sequence,
+    values: Sequence[Any],
+    backward: bool = False,
+    sqlite: bool = False,
+) -> ColumnElement:
+    """
+    Условие «ключ строго после курсора» (по убыванию; backward — до курсора).
+
+    На SQLite DateTime хранится строкой, и форматы хранимого значения и
+    параметра различаются — сравнение идёт по нормализованной строке, а
+    диапазон по самой колонке (с запасом до конца секунды) оставлен, чтобы
+    работал индекс.
+    """
+    if not sqlite:
+        key, bound = tuple_(*key_cols), tuple_(*values)
+        return key > bound if backward else key < bound
+
+    cols, bounds, ranges = [], [], []
+    for col, value in zip(key_cols, values):
+        if isinstance(value, datetime):
+            value = value.replace(tzinfo=None)
+            second = value.strftime("%Y-%m-%d %H:%M:%S")
+            if not ranges:
+                raw = type_coerce(col, String)
+                ranges.append(raw >= second if backward else raw <= second + ".999999")
+            cols.append(_sqlite_stamp(col))
+            bounds.append(literal(value.strftime(_SQLITE_STAMP), String))
+        else:
+            cols.append(col)
+            bounds.append(value)
+    key, bound = tuple_(*cols), tuple_(*bounds)
+    return and_(*ranges, key > bound if backward else key < bound)
+
+
+async def keyset_page(
+    session: AsyncSession,
+    stmt: Select,
+    key_cols: Sequence,
+    *,
+    per_page: int,
+    cursor: Optional[str] = None,
+    backward: bool = False,
+) -> Page:
+    """
+    Загрузить страницу по курсору.
+
+    stmt — SELECT с фильтрами (без ORDER BY/LIMIT), key_cols — колонки ключа
+    сортировки, они же должны быть в списке выборки. Сортировка по убыванию
+    (новые сверху). cursor=None — первая страница; backward=True — курсор
+    указывает на первую строку текущей страницы, грузим предыдущую.
+    """
+    base_stmt = stmt
+    page = 0
+    decoded = decode_cursor(cursor, key_cols) if cursor else None
+    if decoded is not None:
+        values, page = decoded
+        sqlite = session.bind is not None and session.bind.dialect.name == "sqlite"
+        stmt = stmt.where(keyset_condition(key_cols, values, backward, sqlite=sqlite))
+    else:
+        backward = False
+
+    if backward:
+        stmt = stmt.order_by(*(c.asc() for c in key_cols))
+    else:
+        stmt = stmt.order_by(*(c.desc() for c in key_cols))
+    # Берём на одну строку больше — чтобы знать, есть ли ещё страница
+    result = await session.execute(stmt.limit(per_page + 1))
+    rows = list(result.all())
+    if not rows and decoded is not None:
+        # Строки под курсором исчезли (удалены/сменили фильтр) — первая страница
+        return await keyset_page(session, base_stmt, key_cols, per_page=per_page)
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backward:
+        rows.reverse()
+
+    def _key_of(row) -> tuple:
+        return tuple(row._mapping[c] for c in key_cols)
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if backward:
+            # Назад: страница «вперёд» есть всегда, «назад» — если строки остались
+            next_cursor = encode_cursor(_key_of(rows[-1]), page + 1)
+            if has_more:
+                prev_cursor = encode_cursor(_key_of(rows[0]), max(page - 1, 0))
+        else:
+            if has_more:
+                next_cursor = encode_cursor(_key_of(rows[-1]), page + 1)
+            if decoded is not None:
+                prev_cursor = encode_cursor(_key_of(rows[0]), max(page - 1, 0))
+    return Page(rows=rows, page=page, next_cursor=next_cursor, prev_cursor=prev_cursor)
+
+
+async def cached_count(session: AsyncSession, cache_key: str, stmt: Select, ttl: float = COUNT_CACHE_TTL) -> int:
+    """
+    Приблизительное количество строк: COUNT(*) по stmt, кешируется на ttl секунд.
+    Для шапки списка точность до минуты достаточна, а COUNT по всей истории
+    на каждое перелистывание — нет.
+    """
+    now = time.monotonic()
+    cached = _count_cache.get(cache_key)
+    if cached is not None and cached[1] > now:
+        return cached[0]
+    count_stmt = select(func.count()).select_from(stmt.order_by(None).subquery())
+    total = int(await session.scalar(count_stmt) or 0)
+    _count_cache[cache_key] = (total, now + ttl)
+    return total
+
+
+def invalidate_count(cache_key: str) -> None:
+    """Сбросить закешированное количество (после создания/удаления строк)."""
+    _count_cache.pop(cache_key, None)
@@ -141,7 +141,9 @@ async def generate_report_data(orders):
     Prepares detailed report data with manager, clinic, timestamps, and products.
     Каждая строка = один товар в заказе, что позволяет легко фильтровать в Excel.
     Headers: ID заказа, Менеджер, Клиника, Врач, Дата создания, Время создания, 
-             Статус, Время сборки, Время доставки, SKU товара, Название товара, Количество
+             Статус, Тип доставки, Время сборки, Время доставки, SLA-этапы (мин), SKU товара, Название товара, Количество
+    SLA берётся из предрассчитанной order_sla (o.sla должен быть загружен через selectinload).
+    У такси нет ожидания курьера, «Доставка» — от начала сборки до отправки такси.
     """
     # Заголовки с раздельными столбцами для товаров
     rows = [[
@@ -152,8 +154,13 @@ async def generate_report_data(orders):
         "Дата создания",
         "Время создания",
         "Статус",
+        "Тип доставки",
         "Время сборки",
         "Время доставки",
+        "Ожидание сборки, мин",
+        "Сборка, мин",
+        "Ожидание курьера, мин",
+        "Доставка, мин",
         "SKU товара",
         "Название товара",
         "Количество"
@@ -173,6 +180,7 @@ async def generate_report_data(orders):
         
         # Статус
         status = o.status.value if hasattr(o.status, 'value') else str(o.status)
+        delivery_type = o.delivery_type.value if hasattr(o.delivery_type, 'value') else str(o.delivery_type)
         
         # Время сборки
         assembly_time = o.assembled_at.strftime("%Y-%m-%d %H:%M:%S") if o.assembled_at else "-"
@@ -180,6 +188,16 @@ async def generate_report_data(orders):
         # Время доставки
         delivery_time = o.delivered_at.strftime("%Y-%m-%d %H:%M:%S") if o.delivered_at else "-"
         
+        # SLA-этапы (предрассчитаны при переходах статусов)
+        sla = getattr(o, "sla", None)
+        sla_minutes = [
+            round(value / 60, 1) if value is not None else "-"
+            for value in (
+                (sla.queue_wait_s, sla.assembly_s, sla.pickup_wait_s, sla.delivery_s)
+                if sla else (None, None, None, None)
+            )
+        ]
+        
         # Общие данные заказа (будут повторяться для каждого товара)
         order_base_data = [
             o.id,
@@ -189,8 +207,10 @@ async def generate_report_data(orders):
             created_date,
             created_time,
             status,
+            delivery_type,
             assembly_time,
-            delivery_time
+            delivery_time,
+            *sla_minutes
         ]
         
         # Товары в заказе - каждый товар в отдельной строке
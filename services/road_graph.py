@@ -0,0 +1,279 @@
+"""
+Офлайн-граф дорог: время и длина пути по улицам вместо прямой (haversine).
+
+Граф готовится заранее скриптом build_road_graph.py из выгрузки OSM
+и хранится в компактном .npz (CSR, без сети во время работы):
+
+    lat, lon          — координаты узлов (float32)
+    indptr            — начало исходящих рёбер узла в indices (int64, n + 1)
+    indices           — конец ребра (int32)
+    length_m, time_s  — длина и время проезда ребра (float32)
+
+Рёбра направленные (односторонние улицы). Запросы:
+- shortest(u, v) — двунаправленный Dijkstra по времени (прямой граф от u,
+  обратный от v) — для одной-двух пар;
+- one_to_many(u, targets) — Dijkstra от u до всех targets с остановкой,
+  когда все они достигнуты (reverse=True — по обратному графу: «до u»).
+
+RoadGraphProvider — провайдер расстояний для services.routing
+(set_distance_provider): точки привязываются к ближайшему узлу (не дальше
+ROAD_SNAP_MAX_KM), результаты кешируются по паре узлов; для точек вне графа
+и недостижимых пар — haversine.
+"""
+from __future__ import annotations
+
+import heapq
+import logging
+import math
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from services.routing import EARTH_RADIUS_KM, HaversineProvider, haversine_matrix, travel_minutes
+
+logger = logging.getLogger(__name__)
+
+# Формат файла графа (поле version в .npz)
+ROAD_GRAPH_VERSION = 1
+# Сколько целей считать парами (двунаправленный Dijkstra), больше — один проход one_to_many
+BIDIRECTIONAL_MAX_TARGETS = 2
+
+
+class RoadGraph:
+    """Направленный граф дорог в CSR + обратный граф + сетка для привязки точек."""
+
+    def __init__(
+        self,
+        lat: np.ndarray,
+        lon: np.ndarray,
+        indptr: np.ndarray,
+        indices: np.ndarray,
+        length_m: np.ndarray,
+        time_s: np.ndarray,
+        snap_km: float = 0.5,
+    ):
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        n = len(self.lat)
+        indptr = np.asarray(indptr, dtype=np.int64)
+        indices = np.asarray(indices, dtype=np.int64)
+        if len(indptr) != n + 1 or indptr[-1] != len(indices):
+            raise ValueError("Повреждённый граф: indptr не соответствует узлам / рёбрам")
+
+        # Обратный граф: рёбра, отсортированные по концу
+        sources = np.repeat(np.arange(n), np.diff(indptr))
+        order = np.argsort(indices, kind="stable")
+        rev_indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(indices, minlength=n), out=rev_indptr[1:])
+
+        # Внутренние циклы Dijkstra на списках Python быстрее, чем на NumPy
+        self._fwd = (indptr.tolist(), indices.tolist(), np.asarray(time_s).tolist(), np.asarray(length_m).tolist())
+        self._rev = (
+            rev_indptr.tolist(),
+            sources[order].tolist(),
+            np.asarray(time_s)[order].tolist(),
+            np.asarray(length_m)[order].tolist(),
+        )
+
+        # Сетка привязки: ячейка = snap_km, поиск в 3x3 ячейках
+        self.snap_km = snap_km
+        self._ref_lat = float(np.mean(self.lat)) if n else 0.0
+        step_lat = math.degrees(snap_km / EARTH_RADIUS_KM)
+        step_lon = step_lat / max(math.cos(math.radians(self._ref_lat)), 1e-6)
+        self._step = np.array([step_lat, step_lon])
+        cells = np.floor(np.column_stack([self.lat, self.lon]) / self._step).astype(np.int64)
+        self._code_order = np.lexsort((cells[:, 1], cells[:, 0]))
+        self._cells = cells[self._code_order]
+
+    def __len__(self) -> int:
+        return len(self.lat)
+
+    @property
+    def edges(self) -> int:
+        return len(self._fwd[1])
+
+    @classmethod
+    def load(cls, path: str, snap_km: float = 0.5) -> "RoadGraph":
+        with np.load(path) as data:
+            version = int(data["version"]) if "version" in data else 0
+            if version != ROAD_GRAPH_VERSION:
+                raise ValueError(f"Формат графа {version}, ожидается {ROAD_GRAPH_VERSION}")
+            return cls(
+                data["lat"], data["lon"], data["indptr"], data["indices"],
+                data["length_m"], data["time_s"], snap_km=snap_km,
+            )
+
+    # --- Привязка точек ---
+
+    def _cell_range(self, cell_lat: int, cell_lon: int) -> Tuple[int, int]:
+        lo = np.searchsorted(self._cells[:, 0], cell_lat, side="left")
+        hi = np.searchsorted(self._cells[:, 0], cell_lat, side="right")
+        row = self._cells[lo:hi, 1]
+        return lo + int(np.searchsorted(row, cell_lon, side="left")), lo + int(np.searchsorted(row, cell_lon, side="right"))
+
+    def snap(self, points: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Ближайший узел для каждой точки (-1 — дальше snap_km) и расстояние до него, км."""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        nodes = np.full(len(points), -1, dtype=np.int64)
+        offsets = np.full(len(points), np.inf)
+        cells = np.floor(points / self._step).astype(np.int64)
+        for k, (cell_lat, cell_lon) in enumerate(cells.tolist()):
+            candidates = []
+            for da in (-1, 0, 1):
+                lo, hi = self._cell_range(cell_lat + da, cell_lon - 1)
+                _, hi = self._cell_range(cell_lat + da, cell_lon + 1)
+                candidates.append(self._code_order[lo:hi])
+            found = np.concatenate(candidates)
+            if not found.size:
+                continue
+            dist = haversine_matrix(points[k], np.column_stack([self.lat[found], self.lon[found]]))[0]
+            best = int(np.argmin(dist))
+            if dist[best] <= self.snap_km:
+                nodes[k], offsets[k] = found[best], dist[best]
+        return nodes, offsets
+
+    # --- Кратчайшие пути (по времени) ---
+
+    def one_to_many(self, source: int, targets: Sequence[int], reverse: bool = False) -> Dict[int, Tuple[float, float]]:
+        """
+        Dijkstra от source: {цель: (время с, длина м)} для достижимых targets.
+        reverse=True — по обратному графу (пути от целей до source).
+        Останавливается, как только все цели достигнуты.
+        """
+        indptr, indices, times, lengths = self._rev if reverse else self._fwd
+        left = set(targets)
+        found: Dict[int, Tuple[float, float]] = {}
+        best = {source: 0.0}
+        heap = [(0.0, 0.0, source)]
+        settled = set()
+        while heap and left:
+            t, length, u = heapq.heappop(heap)
+            if u in settled:
+                continue
+            settled.add(u)
+            if u in left:
+                left.discard(u)
+                found[u] = (t, length)
+            for e in range(indptr[u], indptr[u + 1]):
+                v = indices[e]
+                nt = t + times[e]
+                if nt < best.get(v, math.inf):
+                    best[v] = nt
+                    heapq.heappush(heap, (nt, length + lengths[e], v))
+        return found
+
+    def shortest(self, source: int, target: int) -> Optional[Tuple[float, float]]:
+        """
+        Двунаправленный Dijkstra: (время с, длина м) самого быстрого пути
+        source -> target или None, если недостижимо.
+        """
+        if source == target:
+            return 0.0, 0.0
+        graphs = (self._fwd, self._rev)
+        dist: Tuple[Dict[int, Tuple[float, float]], ...] = ({source: (0.0, 0.0)}, {target: (0.0, 0.0)})
+        settled: Tuple[set, set] = (set(), set())
+        heaps = ([(0.0, 0.0, source)], [(0.0, 0.0, target)])
+        best: Optional[Tuple[float, float]] = None
+        while heaps[0] and heaps[1]:
+            if best is not None and heaps[0][0][0] + heaps[1][0][0] >= best[0]:
+                break
+            # Растим ту сторону, у которой фронт ближе
+            side = 0 if heaps[0][0][0] <= heaps[1][0][0] else 1
+            t, length, u = heapq.heappop(heaps[side])
+            if u in settled[side]:
+                continue
+            settled[side].add(u)
+            indptr, indices, times, lengths = graphs[side]
+            other = dist[1 - side]
+            for e in range(indptr[u], indptr[u + 1]):
+                v = indices[e]
+                nt, nl = t + times[e], length + lengths[e]
+                if nt < dist[side].get(v, (math.inf, 0.0))[0]:
+                    dist[side][v] = (nt, nl)
+                    heapq.heappush(heaps[side], (nt, nl, v))
+                if v in other:
+                    total = (nt + other[v][0], nl + other[v][1])
+                    if best is None or total[0] < best[0]:
+                        best = total
+        return best
+
+
+class RoadGraphProvider:
+    """
+    Провайдер расстояний по дорожному графу (интерфейс HaversineProvider):
+    км — длина самого быстрого пути, минуты — время по графу; плюс подъезд
+    от точки до узла по прямой. Результаты кешируются по паре узлов (LRU).
+    """
+
+    name = "road"
+
+    def __init__(self, graph: RoadGraph, cache_size: int = 200_000):
+        self.graph = graph
+        self.fallback = HaversineProvider()
+        self._cache: "OrderedDict[Tuple[int, int], Optional[Tuple[float, float]]]" = OrderedDict()
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+
+    def _pairs(self, source: int, targets: List[int], reverse: bool) -> Dict[int, Optional[Tuple[float, float]]]:
+        """(время с, длина м) между source и узлами targets; None — недостижимо."""
+        key = (lambda v: (v, source)) if reverse else (lambda v: (source, v))
+        result: Dict[int, Optional[Tuple[float, float]]] = {}
+        missing = []
+        with self._lock:
+            for v in targets:
+                if key(v) in self._cache:
+                    self._cache.move_to_end(key(v))
+                    result[v] = self._cache[key(v)]
+                else:
+                    missing.append(v)
+        if len(missing) <= BIDIRECTIONAL_MAX_TARGETS:
+            computed = {
+                v: self.graph.shortest(v, source) if reverse else self.graph.shortest(source, v)
+                for v in missing
+            }
+        else:
+            found = self.graph.one_to_many(source, missing, reverse=reverse)
+            computed = {v: found.get(v) for v in missing}
+        with self._lock:
+            for v, value in computed.items():
+                self._cache[key(v)] = value
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        result.update(computed)
+        return result
+
+    def _query(self, point, points: np.ndarray, reverse: bool) -> Tuple[np.ndarray, np.ndarray]:
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        km, minutes = self.fallback.row(point, points)
+        (source,), (source_offset,) = self.graph.snap(np.asarray(point, dtype=np.float64))
+        if source < 0 or not len(points):
+            return km, minutes
+        nodes, offsets = self.graph.snap(points)
+        valid = nodes >= 0
+        found = self._pairs(int(source), sorted(set(nodes[valid].tolist())), reverse)
+        for k in np.flatnonzero(valid):
+            value = found.get(int(nodes[k]))
+            # Тот же узел или недостижимо — остаётся прямая
+            if value is None or nodes[k] == source:
+                continue
+            access_km = source_offset + offsets[k]
+            km[k] = value[1] / 1000 + access_km
+            minutes[k] = value[0] / 60 + travel_minutes(access_km)
+        return km, minutes
+
+    def row(self, point: Tuple[float, float], points: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """От point до каждой из points: (км, минуты)."""
+        return self._query(point, points, reverse=False)
+
+    def column(self, points: np.ndarray, point: Tuple[float, float]) -> Tuple[np.ndarray, np.ndarray]:
+        """От каждой из points до point: (км, минуты)."""
+        return self._query(point, points, reverse=True)
+
+
+def load_provider(path: str, snap_km: float, cache_size: int) -> RoadGraphProvider:
+    """Загрузить граф и собрать провайдер (main.py, при заданном ROAD_GRAPH_PATH)."""
+    graph = RoadGraph.load(path, snap_km=snap_km)
+    logger.info("Road graph loaded: %s nodes, %s edges (%s)", len(graph), graph.edges, path)
+    return RoadGraphProvider(graph, cache_size=cache_size)
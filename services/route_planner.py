@@ -0,0 +1,255 @@
+"""
+Планировщик маршрутов для всех курьеров сразу (диспетчерская сторона).
+
+Берёт готовые к выдаче заказы (курьерская доставка), точки активных курьеров
+и лимит заказов на курьера и распределяет заказы так, чтобы маршруты не
+пересекались и были сбалансированы. Цель — суммарный пробег плюс штраф
+за самый длинный маршрут (ROUTE_PLAN_BALANCE_WEIGHT): один курьер не
+получает всё, если соседний стоит рядом.
+
+1. Построение — вставка с сожалением (regret-2): заказ, для которого разница
+   между лучшим и вторым по стоимости курьером наибольшая, вставляется первым
+   в лучшее место своего лучшего маршрута.
+2. Локальный поиск в пределах бюджета времени: перенос заказа в другой
+   маршрут (relocate) и 2-opt / Or-opt внутри маршрута (services.routing).
+
+Маршруты открытые: от текущей точки курьера до последней клиники.
+Готовые маршруты предлагаются курьерам кнопкой; предложение хранится
+в services.route_store.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from services.routing import distance_matrix, distance_provider, improve_path, path_length
+
+# Вес самого длинного маршрута в цели (0 — только суммарный пробег)
+ROUTE_PLAN_BALANCE_WEIGHT = 1.0
+# Бюджет времени на локальный поиск
+ROUTE_PLAN_BUDGET_S = 0.3
+# Улучшения меньше этого (км) не считаются
+_EPS = 1e-9
+
+
+class PlanStop(NamedTuple):
+    """Заказ для планирования."""
+    order_id: int
+    lat: float
+    lon: float
+    is_urgent: bool = False
+
+
+class PlanCourier(NamedTuple):
+    """Курьер: текущая точка и сколько ещё заказов может взять."""
+    telegram_id: int
+    lat: float
+    lon: float
+    capacity: int
+
+
+class CourierRoute(NamedTuple):
+    telegram_id: int
+    order_ids: List[int]
+    km: float
+
+
+class DispatchPlan(NamedTuple):
+    routes: List[CourierRoute]      # только непустые маршруты
+    unassigned: List[int]           # заказы сверх общей вместимости курьеров
+    total_km: float
+    longest_km: float
+    elapsed_ms: float
+
+
+class _Solution:
+    """Маршруты (индексы заказов в матрице) и их длины."""
+
+    def __init__(self, dist: np.ndarray, starts: List[int], capacity: List[int], weight: float):
+        self.dist = dist
+        self.starts = starts
+        self.capacity = capacity
+        self.weight = weight
+        self.routes: List[List[int]] = [[] for _ in starts]
+        self.lengths = np.zeros(len(starts))
+
+    def objective(self, lengths: Optional[np.ndarray] = None) -> float:
+        lengths = self.lengths if lengths is None else lengths
+        return float(lengths.sum() + self.weight * (lengths.max() if len(lengths) else 0.0))
+
+    def insertion(self, r: int, stops: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Лучшая вставка каждого из stops в маршрут r: (прирост км, позиция)."""
+        route = self.routes[r]
+        prev = np.array([self.starts[r]] + route, dtype=np.intp)
+        nxt = np.array(route + [-1], dtype=np.intp)
+        tail = nxt < 0
+        nxt_safe = np.where(tail, prev, nxt)
+        base = np.where(tail, 0.0, self.dist[prev, nxt_safe])
+        delta = (
+            self.dist[np.ix_(stops, prev)]
+            + np.where(tail, 0.0, self.dist[np.ix_(stops, nxt_safe)])
+            - base
+        )
+        pos = delta.argmin(axis=1)
+        return delta[np.arange(len(stops)), pos], pos
+
+    def insert(self, r: int, stop: int, pos: int) -> None:
+        self.routes[r].insert(pos, stop)
+        self.lengths[r] = path_length(self.dist, [self.starts[r]] + self.routes[r])
+
+
+def _construct(sol: _Solution, n: int, urgent: np.ndarray) -> List[int]:
+    """Вставка с сожалением (regret-2). Возвращает заказы, которым не хватило места."""
+    k = len(sol.starts)
+    # Прирост км лучшей вставки заказа в маршрут и её позиция; штраф за самый
+    # длинный маршрут добавляется при выборе (зависит от текущих длин)
+    delta = np.full((n, k), np.inf)
+    pos = np.zeros((n, k), dtype=np.intp)
+    everyone = np.arange(n)
+    for r in range(k):
+        if sol.capacity[r] > 0:
+            delta[:, r], pos[:, r] = sol.insertion(r, everyone)
+
+    left = np.ones(n, dtype=bool)
+    while left.any():
+        idx = np.flatnonzero(left)
+        d = delta[idx]
+        if not np.isfinite(d).any():
+            break
+        current_max = sol.lengths.max()
+        c = d + sol.weight * (np.maximum(current_max, sol.lengths + d) - current_max)
+        if k > 1:
+            two = np.partition(c, 1, axis=1)[:, :2]
+            regret = np.where(np.isfinite(two[:, 1]), two[:, 1] - two[:, 0], np.inf)
+        else:
+            regret = np.zeros(len(idx))
+        best = c.min(axis=1)
+        regret[~np.isfinite(best)] = -np.inf
+        # Срочные — раньше, дальше наибольшее сожаление, затем самая дешёвая вставка
+        choice = np.lexsort((best, -regret, ~urgent[idx]))[0]
+        s = int(idx[choice])
+        r = int(c[choice].argmin())
+        sol.insert(r, s, int(pos[s, r]))
+        left[s] = False
+
+        rest = np.flatnonzero(left)
+        if len(sol.routes[r]) >= sol.capacity[r]:
+            delta[:, r] = np.inf
+        elif rest.size:
+            delta[rest, r], pos[rest, r] = sol.insertion(r, rest)
+    return np.flatnonzero(left).tolist()
+
+
+def _relocate_pass(sol: _Solution, deadline: float) -> bool:
+    """Перенос заказа в другой маршрут, если цель уменьшается. True — было улучшение."""
+    improved = False
+    k = len(sol.starts)
+    for a in range(k):
+        i = 0
+        while i < len(sol.routes[a]):
+            if time.perf_counter() > deadline:
+                return improved
+            route = sol.routes[a]
+            stop = route[i]
+            without = route[:i] + route[i + 1:]
+            len_a = path_length(sol.dist, [sol.starts[a]] + without)
+            best = None
+            for b in range(k):
+                if b == a or len(sol.routes[b]) >= sol.capacity[b]:
+                    continue
+                delta, p = sol.insertion(b, np.array([stop]))
+                lengths = sol.lengths.copy()
+                lengths[a], lengths[b] = len_a, sol.lengths[b] + delta[0]
+                value = sol.objective(lengths)
+                if best is None or value < best[0]:
+                    best = (value, b, int(p[0]))
+            if best is not None and best[0] < sol.objective() - _EPS:
+                _, b, p = best
+                sol.routes[a] = without
+                sol.lengths[a] = len_a
+                sol.insert(b, stop, p)
+                improved = True
+            else:
+                i += 1
+    return improved
+
+
+def _improve_routes(sol: _Solution, deadline: float) -> bool:
+    """2-opt / Or-opt внутри каждого маршрута."""
+    improved = False
+    for r, route in enumerate(sol.routes):
+        if len(route) < 2 or time.perf_counter() > deadline:
+            continue
+        path = improve_path(sol.dist, [sol.starts[r]] + route, deadline)
+        length = path_length(sol.dist, path)
+        if length < sol.lengths[r] - _EPS:
+            sol.routes[r], sol.lengths[r] = path[1:], length
+            improved = True
+    return improved
+
+
+def plan_dispatch_sync(
+    couriers: Sequence[PlanCourier],
+    stops: Sequence[PlanStop],
+    *,
+    balance_weight: float = ROUTE_PLAN_BALANCE_WEIGHT,
+    budget_s: float = ROUTE_PLAN_BUDGET_S,
+    stop_dist: Optional[np.ndarray] = None,
+) -> DispatchPlan:
+    """
+    Распределить заказы по курьерам и упорядочить маршруты.
+    stop_dist — готовая матрица км между заказами (services.clinic_matrix);
+    без неё расстояния между остановками считаются здесь.
+    """
+    t0 = time.perf_counter()
+    n, k = len(stops), len(couriers)
+    if not n or not k:
+        return DispatchPlan([], [s.order_id for s in stops], 0.0, 0.0, 0.0)
+
+    stop_points = np.array([(s.lat, s.lon) for s in stops], dtype=np.float64)
+    courier_points = np.array([(c.lat, c.lon) for c in couriers], dtype=np.float64)
+    if stop_dist is None:
+        dist = distance_matrix(np.vstack([stop_points, courier_points]))
+    else:
+        # Считаются только расстояния от курьеров (по дорогам, если граф загружен)
+        dist = np.zeros((n + k, n + k))
+        dist[:n, :n] = stop_dist
+        provider = distance_provider()
+        for r, point in enumerate(courier_points):
+            dist[n + r, :n] = provider.row(point, stop_points)[0]
+        dist[:n, n:] = dist[n:, :n].T
+        dist[n:, n:] = distance_matrix(courier_points)
+    sol = _Solution(dist, list(range(n, n + k)), [c.capacity for c in couriers], balance_weight)
+    urgent = np.array([s.is_urgent for s in stops], dtype=bool)
+    unassigned = _construct(sol, n, urgent)
+
+    deadline = t0 + budget_s
+    while time.perf_counter() < deadline:
+        changed = _improve_routes(sol, deadline)
+        changed = _relocate_pass(sol, deadline) or changed
+        if not changed:
+            break
+
+    routes = [
+        CourierRoute(couriers[r].telegram_id, [stops[i].order_id for i in route], float(sol.lengths[r]))
+        for r, route in enumerate(sol.routes) if route
+    ]
+    return DispatchPlan(
+        routes=routes,
+        unassigned=[stops[i].order_id for i in unassigned],
+        total_km=float(sol.lengths.sum()),
+        longest_km=float(sol.lengths.max()),
+        elapsed_ms=(time.perf_counter() - t0) * 1000,
+    )
+
+
+async def plan_dispatch(
+    couriers: Sequence[PlanCourier],
+    stops: Sequence[PlanStop],
+    **kwargs,
+) -> DispatchPlan:
+    """plan_dispatch_sync в отдельном потоке (не блокирует event loop)."""
+    return await asyncio.to_thread(plan_dispatch_sync, couriers, stops, **kwargs)
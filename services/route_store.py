@@ -0,0 +1,191 @@
+"""
+Хранилище предложенных курьерам маршрутов.
+
+В FSM курьера лежит только route_id — сами остановки хранятся здесь
+компактными кортежами (order_id, lat, lon, clinic_id, urgent): ORM-объекты
+не сериализуются в Redis-хранилище FSM и раздували бы каждую запись
+состояния. В Redis маршрут — хеш route:<telegram_id>:<route_id> с полями
+grouped / distant (JSON) и TTL; без Redis — в памяти процесса.
+
+Маршрут привязан к курьеру: чужой route_id (кнопка, пересланная другому)
+не найдётся. Сюда же кладутся маршруты, построенные складом
+(services.route_planner), — ключ идёт в callback_data кнопки. У курьера
+действует только последнее предложение склада: route_id запоминается
+(route:<telegram_id>:offer), и новое распределение удаляет прежнее.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import secrets
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Сколько живёт маршрут (предложение курьеру), секунд
+ROUTE_TTL = 3600
+_PREFIX = "route:"
+# route_id последнего предложения склада курьеру
+_OFFER = "offer"
+
+
+class StoredStop(NamedTuple):
+    """Остановка маршрута без ORM: хватает для кнопок, карты и взятия заказов."""
+    order_id: int
+    lat: float
+    lon: float
+    clinic_id: int
+    urgent: bool
+
+    @classmethod
+    def from_item(cls, item: dict) -> "StoredStop":
+        """Из элемента маршрута handlers.courier (ключи id / lat / lon / obj)."""
+        order = item['obj']
+        return cls(item['id'], item['lat'], item['lon'], order.clinic_id, bool(order.is_urgent))
+
+
+class StoredRoute(NamedTuple):
+    grouped: List[StoredStop]   # групповой маршрут по порядку
+    distant: List[StoredStop]   # отдельные заказы вдали
+
+    @property
+    def stops(self) -> List[StoredStop]:
+        return self.grouped + self.distant
+
+    def order_ids(self) -> List[int]:
+        return [s.order_id for s in self.stops]
+
+    def urgency(self) -> Dict[int, bool]:
+        """{order_id: is_urgent} — для иконок в клавиатурах."""
+        return {s.order_id: s.urgent for s in self.stops}
+
+    def without(self, order_ids: Iterable[int]) -> "StoredRoute":
+        drop = set(order_ids)
+        return StoredRoute(
+            [s for s in self.grouped if s.order_id not in drop],
+            [s for s in self.distant if s.order_id not in drop],
+        )
+
+
+def _pack(stops: List[StoredStop]) -> str:
+    return json.dumps([[s.order_id, s.lat, s.lon, s.clinic_id, int(s.urgent)] for s in stops], separators=(",", ":"))
+
+
+def _unpack(raw) -> List[StoredStop]:
+    if not raw:
+        return []
+    return [StoredStop(int(o), float(lat), float(lon), int(c), bool(u)) for o, lat, lon, c, u in json.loads(raw)]
+
+
+class RouteStore:
+    """
+    Маршруты по (курьер, route_id) с TTL: в Redis (хеш на маршрут), если он
+    подключён init_route_store, иначе — в памяти процесса. Экземпляр один
+    на процесс, поэтому его можно импортировать до init_route_store.
+    """
+
+    def __init__(self, ttl_seconds: int = ROUTE_TTL):
+        self.ttl = ttl_seconds
+        self.redis = None
+        self._memory: Dict[Tuple[int, str], Tuple[StoredRoute, float]] = {}
+        self._offers: Dict[int, str] = {}
+
+    @staticmethod
+    def _key(telegram_id: int, route_id: str) -> str:
+        return f"{_PREFIX}{telegram_id}:{route_id}"
+
+    def _prune(self, now: float) -> None:
+        for key in [key for key, (_, expires) in self._memory.items() if expires < now]:
+            del self._memory[key]
+
+    async def save(self, telegram_id: int, route: StoredRoute, route_id: Optional[str] = None) -> str:
+        """Сохранить маршрут (новый или под тем же route_id); возвращает route_id."""
+        route_id = route_id or secrets.token_urlsafe(6)
+        if self.redis is not None:
+            key = self._key(telegram_id, route_id)
+            try:
+                pipe = self.redis.pipeline()
+                pipe.hset(key, mapping={"grouped": _pack(route.grouped), "distant": _pack(route.distant)})
+                pipe.expire(key, self.ttl)
+                await pipe.execute()
+                return route_id
+            except Exception as e:
+                logger.warning("Route store save error for courier %s, keeping in memory: %s", telegram_id, e)
+        now = time.monotonic()
+        self._prune(now)
+        self._memory[(telegram_id, route_id)] = (route, now + self.ttl)
+        return route_id
+
+    async def get(self, telegram_id: int, route_id: Optional[str]) -> Optional[StoredRoute]:
+        """Маршрут курьера или None (нет, истёк или чужой)."""
+        if not route_id:
+            return None
+        entry = self._memory.get((telegram_id, route_id))
+        if entry is not None:
+            return entry[0] if entry[1] >= time.monotonic() else None
+        if self.redis is None:
+            return None
+        try:
+            data = await self.redis.hgetall(self._key(telegram_id, route_id))
+        except Exception as e:
+            logger.warning("Route store get error for courier %s: %s", telegram_id, e)
+            return None
+        if not data:
+            return None
+        data = {(k.decode() if isinstance(k, bytes) else k): v for k, v in data.items()}
+        return StoredRoute(_unpack(data.get("grouped")), _unpack(data.get("distant")))
+
+    async def pop(self, telegram_id: int, route_id: Optional[str]) -> Optional[StoredRoute]:
+        """Забрать маршрут один раз (предложение склада)."""
+        route = await self.get(telegram_id, route_id)
+        if route is not None:
+            await self.delete(telegram_id, route_id)
+        return route
+
+    async def delete(self, telegram_id: int, route_id: str) -> None:
+        self._memory.pop((telegram_id, route_id), None)
+        if self.redis is not None:
+            try:
+                await self.redis.delete(self._key(telegram_id, route_id))
+            except Exception as e:
+                logger.debug("Route store delete error for courier %s: %s", telegram_id, e)
+
+    async def revoke_offer(self, telegram_id: int) -> None:
+        """Удалить последнее предложение склада курьеру (кнопка «Взять» устареет)."""
+        route_id = self._offers.pop(telegram_id, None)
+        if self.redis is not None:
+            try:
+                key = self._key(telegram_id, _OFFER)
+                pipe = self.redis.pipeline()
+                pipe.get(key)
+                pipe.delete(key)
+                raw, _ = await pipe.execute()
+                if raw is not None:
+                    route_id = raw.decode() if isinstance(raw, bytes) else raw
+            except Exception as e:
+                logger.warning("Route store offer revoke error for courier %s: %s", telegram_id, e)
+        if route_id:
+            await self.delete(telegram_id, route_id)
+
+    async def save_offer(self, telegram_id: int, route: StoredRoute) -> str:
+        """Сохранить предложение склада вместо прежнего; возвращает route_id."""
+        await self.revoke_offer(telegram_id)
+        route_id = await self.save(telegram_id, route)
+        self._offers[telegram_id] = route_id
+        if self.redis is not None:
+            try:
+                await self.redis.set(self._key(telegram_id, _OFFER), route_id, ex=self.ttl)
+            except Exception as e:
+                logger.warning("Route store offer save error for courier %s: %s", telegram_id, e)
+        return route_id
+
+
+# Глобальный экземпляр (Redis подключается в main.py)
+route_store = RouteStore()
+
+
+def init_route_store(redis_client=None) -> None:
+    """Хранить маршруты в Redis (если доступен), иначе в памяти."""
+    route_store.redis = redis_client
+    logger.info("Route store: %s", "Redis" if redis_client is not None else "memory")
@@ -1,21 +1,41 @@
+import asyncio
+import logging
 import math
-from typing import List, Tuple, Dict
-from functools import lru_cache
+import time
+from typing import List, NamedTuple, Tuple, Dict, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
 
 # Параметры кластеризации
 CLUSTER_RADIUS_KM = 3.0   # точки в пределах 3 км друг от друга = один кластер
 DISTANT_THRESHOLD_KM = 8.0  # точка > 8 км от кластера = отдельная
 
-# Haversine formula to calculate distance between two lat/lon points
-# Кешируем результаты для часто используемых координат
-@lru_cache(maxsize=1000)
+EARTH_RADIUS_KM = 6371.0
+
+# Бюджет времени на улучшение маршрута (2-opt / Or-opt) после Nearest Neighbor
+ROUTE_IMPROVE_BUDGET_S = 0.05
+# Улучшения меньше этого (км) не считаются — защита от зацикливания на округлении
+IMPROVE_EPS_KM = 1e-9
+
+# Оценка времени прибытия: средняя скорость по городу и время на точке
+AVG_SPEED_KMH = 25.0
+STOP_SERVICE_MIN = 5.0
+# Цена ожидания заказа с приоритетом 1.0: км объезда за минуту более раннего
+# прибытия (0.1 — ради 10 минут курьер сделает крюк до 1 км)
+PRIORITY_KM_PER_MIN = 0.1
+# Цена опоздания к окну доставки: км за минуту опоздания
+LATENESS_KM_PER_MIN = 0.5
+# Бюджет времени на перестановку приоритетных заказов
+ROUTE_PRIORITY_BUDGET_S = 0.05
+
+
 def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     """
     Вычисляет расстояние между двумя точками на Земле по формуле Haversine.
-    Результаты кешируются для оптимизации.
+    Для одной пары точек; для многих точек — haversine_matrix.
     """
-    R = 6371  # Earth radius in kilometers
-
     phi1, phi2 = math.radians(lat1), math.radians(lat2)
     dphi = math.radians(lat2 - lat1)
     dlambda = math.radians(lon2 - lon1)
@@ -23,7 +43,360 @@ def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> fl
     a = math.sin(dphi / 2)**2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2)**2
     c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
 
-    return R * c
+    return EARTH_RADIUS_KM * c
+
+
+def bounding_box(lat: float, lon: float, radius_km: float) -> Tuple[float, float, float, float]:
+    """
+    (lat_min, lat_max, lon_min, lon_max) — наименьший прямоугольник в градусах,
+    содержащий круг radius_km вокруг точки: префильтр по индексу координат в БД,
+    точное расстояние считается потом. Без перехода через 180-й меридиан.
+    """
+    angle = radius_km / EARTH_RADIUS_KM
+    dlat = math.degrees(angle)
+    cos_lat = math.cos(math.radians(lat))
+    if math.sin(angle) >= cos_lat:
+        # Круг накрывает полюс — по долготе без ограничений
+        return max(lat - dlat, -90.0), min(lat + dlat, 90.0), -180.0, 180.0
+    dlon = math.degrees(math.asin(math.sin(angle) / cos_lat))
+    return lat - dlat, lat + dlat, lon - dlon, lon + dlon
+
+
+def _haversine(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Haversine (км) для массивов в радианах, с broadcasting."""
+    h = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    np.clip(h, 0.0, 1.0, out=h)
+    return 2 * EARTH_RADIUS_KM * np.arctan2(np.sqrt(h), np.sqrt(1 - h))
+
+
+def haversine_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    Попарные расстояния (км) между точками a (n, 2) и b (m, 2) в градусах
+    (lat, lon) — одним векторным проходом. Возвращает матрицу (n, m).
+    """
+    a = np.radians(np.asarray(a, dtype=np.float64).reshape(-1, 2))
+    b = np.radians(np.asarray(b, dtype=np.float64).reshape(-1, 2))
+    return _haversine(a[:, 0:1], a[:, 1:2], b[:, 0], b[:, 1])
+
+
+def haversine_pairs(coords: np.ndarray, i: np.ndarray, j: np.ndarray) -> np.ndarray:
+    """Расстояния (км) для пар точек coords[i] — coords[j]."""
+    rad = np.radians(coords)
+    return _haversine(rad[i, 0], rad[i, 1], rad[j, 0], rad[j, 1])
+
+
+def distance_matrix(points: np.ndarray) -> np.ndarray:
+    """Квадратная матрица расстояний (км) между точками (n, 2)."""
+    dist = haversine_matrix(points, points)
+    np.fill_diagonal(dist, 0.0)
+    return dist
+
+
+class HaversineProvider:
+    """
+    Провайдер расстояний по прямой (haversine) — по умолчанию и запасной
+    для точек, которых нет в дорожном графе (services.road_graph).
+    row / column возвращают (км, минуты в пути) — массивы длины len(points).
+    """
+
+    name = "haversine"
+
+    def row(self, point: Tuple[float, float], points: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """От point до каждой из points."""
+        km = haversine_matrix(np.asarray(point, dtype=np.float64), points)[0]
+        return km, travel_minutes(km)
+
+    def column(self, points: np.ndarray, point: Tuple[float, float]) -> Tuple[np.ndarray, np.ndarray]:
+        """От каждой из points до point."""
+        return self.row(point, points)
+
+
+_provider = HaversineProvider()
+
+
+def distance_provider():
+    """Текущий провайдер расстояний (HaversineProvider или дорожный граф)."""
+    return _provider
+
+
+def set_distance_provider(provider) -> None:
+    """Сменить провайдер расстояний (main.py при загрузке дорожного графа)."""
+    global _provider
+    _provider = provider
+
+
+def _with_entry(points: np.ndarray, known: Optional[np.ndarray], idx: Sequence[int], entry: int) -> np.ndarray:
+    """
+    Матрица точек points[idx] + точка въезда points[entry] (последняя
+    строка/столбец). Если известна матрица known (готовые расстояния между
+    всеми points) — берётся срез, иначе считается haversine.
+    """
+    sel = np.append(np.asarray(idx, dtype=np.intp), entry)
+    if known is not None:
+        return known[np.ix_(sel, sel)]
+    return distance_matrix(points[sel])
+
+
+def _coords(orders_data: Sequence[Dict]) -> np.ndarray:
+    """Координаты заказов (n, 2) из ключей 'lat', 'lon'."""
+    return np.array([(o['lat'], o['lon']) for o in orders_data], dtype=np.float64).reshape(-1, 2)
+
+
+def _components(within: np.ndarray) -> np.ndarray:
+    """
+    Связные компоненты графа «расстояние <= порога» по булевой матрице смежности.
+    Метка компоненты — наименьший индекс в ней (порядок как у прежнего Union-Find).
+    Компонента растёт волнами: за шаг — все соседи текущего фронта одной операцией.
+    """
+    n = within.shape[0]
+    labels = np.full(n, -1, dtype=np.intp)
+    for i in range(n):
+        if labels[i] >= 0:
+            continue
+        labels[i] = i
+        frontier = np.array([i])
+        while frontier.size:
+            reached = within[frontier].any(axis=0)
+            reached &= labels < 0
+            frontier = np.flatnonzero(reached)
+            labels[frontier] = i
+    return labels
+
+
+# Соседние ячейки «вперёд» (сама ячейка + 4 соседа): каждая пара ячеек
+# просматривается один раз
+_HALF_NEIGHBOURS = ((0, 0), (0, 1), (1, -1), (1, 0), (1, 1))
+_ALL_NEIGHBOURS = tuple((da, db) for da in (-1, 0, 1) for db in (-1, 0, 1))
+
+
+def _grid_pairs(
+    coords: np.ndarray,
+    radius_km: float,
+    sources: Optional[np.ndarray] = None,
+) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Пары-кандидаты (i, j) для проверки «расстояние <= radius_km» по сетке.
+
+    Ячейки подобраны так, что любые две точки не дальше radius_km лежат в одной
+    или соседних ячейках (шаг по долготе — точная полуширина ограничивающего
+    прямоугольника на самой высокой широте). Без sources — каждая неупорядоченная
+    пара соседних точек ровно один раз; с sources — для каждой точки из sources
+    все точки 3x3 ячеек вокруг (кроме неё самой).
+    Возвращает None, если сетка неприменима (окрестность полюса).
+    """
+    ang = radius_km / EARTH_RADIUS_KM
+    # Запас на округление: пара ровно на пороге не должна разъехаться через ячейку
+    lat_step = math.degrees(ang) * (1 + 1e-9)
+    max_abs_lat = float(np.abs(coords[:, 0]).max()) + lat_step
+    if radius_km <= 0 or max_abs_lat >= 90.0:
+        return None
+    ratio = math.sin(ang) / math.cos(math.radians(max_abs_lat))
+    if ratio >= 1.0:
+        return None
+    lon_step = math.degrees(math.asin(ratio)) * (1 + 1e-9)
+
+    # Номер ячейки одним int64: строки по широте, в строке — по долготе
+    keys = np.floor(coords / np.array([lat_step, lon_step])).astype(np.int64)
+    keys -= keys.min(axis=0) - 1
+    width = int(keys[:, 1].max()) + 2
+    code = keys[:, 0] * width + keys[:, 1]
+    order = np.argsort(code, kind="stable")
+    sorted_code = code[order]
+    # pos[i] — место точки i в отсортированном порядке
+    pos = np.empty_like(order)
+    pos[order] = np.arange(len(order))
+
+    src = np.arange(len(coords)) if sources is None else np.asarray(sources, dtype=np.intp)
+    offsets = _HALF_NEIGHBOURS if sources is None else _ALL_NEIGHBOURS
+    starts, ends, owners = [], [], []
+    for da, db in offsets:
+        target = code[src] + da * width + db
+        lo = np.searchsorted(sorted_code, target, side="left")
+        hi = np.searchsorted(sorted_code, target, side="right")
+        if sources is None and (da, db) == (0, 0):
+            # Своя ячейка — только точки после себя (каждая пара один раз)
+            lo = pos[src] + 1
+        starts.append(lo)
+        ends.append(hi)
+        owners.append(src)
+    starts, ends, owners = np.concatenate(starts), np.concatenate(ends), np.concatenate(owners)
+    counts = np.maximum(ends - starts, 0)
+
+    # Развернуть диапазоны [start, end) в плоский список пар без циклов Python
+    total = int(counts.sum())
+    run = np.repeat(np.arange(len(counts)), counts)
+    step = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    i = owners[run]
+    j = order[starts[run] + step]
+    if sources is not None:
+        keep = i != j
+        i, j = i[keep], j[keep]
+    return i, j
+
+
+def _union_find(n: int, i: np.ndarray, j: np.ndarray) -> np.ndarray:
+    """
+    Union-Find по списку рёбер (i, j), векторно: корни подвешиваются к
+    меньшему корню, затем сжатие путей; повтор, пока рёбра соединяют разные корни.
+    Корень компоненты — её наименьший индекс (как метки _components).
+    """
+    parent = np.arange(n)
+    while i.size:
+        ri, rj = parent[i], parent[j]
+        linked = ri != rj
+        if not linked.any():
+            break
+        i, j, ri, rj = i[linked], j[linked], ri[linked], rj[linked]
+        np.minimum.at(parent, np.maximum(ri, rj), np.minimum(ri, rj))
+        # Сжатие путей: каждый узел указывает прямо на корень
+        while True:
+            up = parent[parent]
+            if np.array_equal(up, parent):
+                break
+            parent = up
+    return parent
+
+
+def _grid_components(coords: np.ndarray, radius_km: float, stop_dist: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    То же, что _components(distance_matrix(coords) <= radius_km), но расстояния
+    считаются только для точек соседних ячеек сетки — почти линейно по числу точек.
+    stop_dist — готовые расстояния (по дорогам не короче прямой, поэтому
+    кандидатов по сетке достаточно).
+    """
+    pairs = _grid_pairs(coords, radius_km) if len(coords) else None
+    if pairs is None:
+        dist = distance_matrix(coords) if stop_dist is None else stop_dist
+        return _components(dist <= radius_km)
+    i, j = pairs
+    close = (haversine_pairs(coords, i, j) if stop_dist is None else stop_dist[i, j]) <= radius_km
+    return _union_find(len(coords), i[close], j[close])
+
+
+def _group(items: Sequence, labels: np.ndarray) -> List[List]:
+    """Разложить элементы по меткам: кластеры по первому вхождению, внутри — исходный порядок."""
+    groups: Dict[int, List] = {}
+    for item, label in zip(items, labels.tolist()):
+        groups.setdefault(label, []).append(item)
+    return list(groups.values())
+
+
+def _nearest_neighbour(dist: np.ndarray, start: int, nodes: Sequence[int]) -> Tuple[List[int], float]:
+    """
+    Nearest Neighbor по готовой матрице: обход nodes из строки start.
+    При равных расстояниях берётся узел, стоящий раньше в nodes.
+    Returns (порядок узлов, длина пути км).
+    """
+    nodes = np.asarray(nodes, dtype=np.intp)
+    sub = dist[np.ix_(nodes, nodes)]
+    from_start = dist[start, nodes]
+    left = np.ones(len(nodes), dtype=bool)
+    order: List[int] = []
+    total = 0.0
+    row = from_start
+    for _ in range(len(nodes)):
+        masked = np.where(left, row, np.inf)
+        k = int(np.argmin(masked))
+        total += float(masked[k])
+        left[k] = False
+        order.append(int(nodes[k]))
+        row = sub[k]
+    return order, total
+
+
+def path_length(dist: np.ndarray, path: Sequence[int]) -> float:
+    """Длина открытого пути по матрице (сумма последовательных рёбер)."""
+    if len(path) < 2:
+        return 0.0
+    p = np.asarray(path, dtype=np.intp)
+    return float(dist[p[:-1], p[1:]].sum())
+
+
+def _two_opt_pass(dist: np.ndarray, p: np.ndarray, deadline: float) -> bool:
+    """
+    Один проход 2-opt по открытому пути p (p[0] — старт, не двигается):
+    разворот отрезка p[i..j], если он укорачивает путь. True — было улучшение.
+    """
+    m = len(p)
+    improved = False
+    for i in range(1, m - 1):
+        if time.perf_counter() > deadline:
+            break
+        a, b = p[i - 1], p[i]
+        js = np.arange(i + 1, m)
+        c = p[js]
+        delta = dist[a, c] - dist[a, b]
+        inner = js < m - 1
+        nxt = p[js[inner] + 1]
+        delta[inner] += dist[b, nxt] - dist[c[inner], nxt]
+        k = int(np.argmin(delta))
+        if delta[k] < -IMPROVE_EPS_KM:
+            j = int(js[k])
+            p[i:j + 1] = p[i:j + 1][::-1].copy()
+            improved = True
+    return improved
+
+
+def _or_opt_pass(dist: np.ndarray, p: np.ndarray, deadline: float) -> bool:
+    """
+    Один проход Or-opt: перенос отрезка из 1–3 точек (как есть или развёрнутого)
+    в лучшее место пути. p меняется на месте. True — было улучшение.
+    """
+    improved = False
+    for seg in (1, 2, 3):
+        i = 1
+        while i + seg <= len(p):
+            if time.perf_counter() > deadline:
+                return improved
+            m = len(p)
+            prev, first, last = p[i - 1], p[i], p[i + seg - 1]
+            has_next = i + seg < m
+            gain = dist[prev, first]
+            if has_next:
+                nxt = p[i + seg]
+                gain += dist[last, nxt] - dist[prev, nxt]
+            rest = np.concatenate([p[:i], p[i + seg:]])
+            # Вставка после rest[k]: между rest[k] и rest[k + 1] (или в конец)
+            u = rest
+            v = np.append(rest[1:], -1)
+            tail = v < 0
+            v_safe = np.where(tail, 0, v)
+            uv = np.where(tail, 0.0, dist[u, v_safe])
+            fwd = dist[u, first] + np.where(tail, 0.0, dist[last, v_safe]) - uv
+            rev = dist[u, last] + np.where(tail, 0.0, dist[first, v_safe]) - uv
+            # Исходное место отрезка (после p[i - 1]) не считаем ходом
+            fwd[i - 1] = rev[i - 1] = np.inf
+            best_fwd, best_rev = int(np.argmin(fwd)), int(np.argmin(rev))
+            reverse = rev[best_rev] < fwd[best_fwd]
+            k = best_rev if reverse else best_fwd
+            cost = (rev if reverse else fwd)[k]
+            if cost - gain < -IMPROVE_EPS_KM:
+                segment = p[i:i + seg][::-1] if reverse else p[i:i + seg]
+                p[:] = np.concatenate([rest[:k + 1], segment, rest[k + 1:]])
+                improved = True
+            else:
+                i += 1
+    return improved
+
+
+def improve_path(dist: np.ndarray, path: Sequence[int], deadline: float) -> List[int]:
+    """
+    Улучшение открытого пути (path[0] — старт) 2-opt и Or-opt до локального
+    минимума или до deadline (time.perf_counter()). Путь не становится длиннее.
+    """
+    p = np.asarray(path, dtype=np.intp).copy()
+    if len(p) < 3:
+        return p.tolist()
+    while time.perf_counter() < deadline:
+        changed = _two_opt_pass(dist, p, deadline)
+        changed = _or_opt_pass(dist, p, deadline) or changed
+        if not changed:
+            break
+    return p.tolist()
+
 
 def _optimize_route_sync(current_location: Tuple[float, float], orders_data: List[Dict]) -> Tuple[List[Dict], float]:
     """
@@ -31,25 +404,13 @@ def _optimize_route_sync(current_location: Tuple[float, float], orders_data: Lis
     orders_data items must have 'lat', 'lon' keys.
     Returns (sorted_orders, total_distance_km).
     """
-    unvisited = orders_data[:]
-    visited = []
-    total_dist = 0.0
-    current_lat, current_lon = current_location
-
-    while unvisited:
-        nearest_order = None
-        min_dist = float('inf')
-        for order in unvisited:
-            dist = haversine_distance(current_lat, current_lon, order['lat'], order['lon'])
-            if dist < min_dist:
-                min_dist = dist
-                nearest_order = order
-        visited.append(nearest_order)
-        unvisited.remove(nearest_order)
-        total_dist += min_dist
-        current_lat = nearest_order['lat']
-        current_lon = nearest_order['lon']
-    return visited, total_dist
+    if not orders_data:
+        return [], 0.0
+    n = len(orders_data)
+    points = np.vstack([_coords(orders_data), np.asarray(current_location, dtype=np.float64)])
+    dist = distance_matrix(points)
+    order, total = _nearest_neighbour(dist, n, range(n))
+    return [orders_data[i] for i in order], total
 
 
 async def optimize_route(current_location: Tuple[float, float], orders_data: List[Dict]) -> Tuple[List[Dict], float]:
@@ -59,39 +420,12 @@ async def optimize_route(current_location: Tuple[float, float], orders_data: Lis
 
 def build_clusters(orders_data: List[Dict], max_dist_km: float) -> List[List[Dict]]:
     """
-    Кластеризация точек методом Union-Find.
+    Кластеризация точек (Union-Find по сетке, см. _grid_components).
     Точки в пределах max_dist_km друг от друга объединяются в один кластер.
     """
-    n = len(orders_data)
-    parent = list(range(n))
-
-    def find(x: int) -> int:
-        if parent[x] != x:
-            parent[x] = find(parent[x])
-        return parent[x]
-
-    def union(x: int, y: int) -> None:
-        px, py = find(x), find(y)
-        if px != py:
-            parent[px] = py
-
-    for i in range(n):
-        for j in range(i + 1, n):
-            dist = haversine_distance(
-                orders_data[i]['lat'], orders_data[i]['lon'],
-                orders_data[j]['lat'], orders_data[j]['lon']
-            )
-            if dist <= max_dist_km:
-                union(i, j)
-
-    clusters_dict: Dict[int, List[Dict]] = {}
-    for i in range(n):
-        root = find(i)
-        if root not in clusters_dict:
-            clusters_dict[root] = []
-        clusters_dict[root].append(orders_data[i])
-
-    return list(clusters_dict.values())
+    if not orders_data:
+        return []
+    return _group(orders_data, _grid_components(_coords(orders_data), max_dist_km))
 
 
 def _cluster_centroid(cluster: List[Dict]) -> Tuple[float, float]:
@@ -103,70 +437,340 @@ def _cluster_centroid(cluster: List[Dict]) -> Tuple[float, float]:
     return lat_sum / len(cluster), lon_sum / len(cluster)
 
 
-def _min_dist_to_clusters(point: Dict, clusters: List[List[Dict]], exclude_cluster_idx: int = -1) -> float:
-    """Минимальное расстояние от точки до любого кластера (кроме exclude_cluster_idx)."""
-    min_d = float('inf')
-    for idx, cluster in enumerate(clusters):
-        if idx == exclude_cluster_idx:
-            continue
-        for o in cluster:
-            d = haversine_distance(point['lat'], point['lon'], o['lat'], o['lon'])
-            min_d = min(min_d, d)
-    return min_d
+def _distant_singletons(
+    coords: np.ndarray,
+    labels: np.ndarray,
+    threshold_km: float,
+    stop_dist: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Маска точек-одиночек, до ближайшей точки других кластеров от которых
+    не меньше threshold_km (если других кластеров нет — тоже вдали).
+    Одиночка сравнивается только с точками соседних ячеек сетки шагом threshold_km.
+    """
+    n = len(labels)
+    sizes = np.bincount(labels, minlength=n)
+    singles = np.flatnonzero(sizes[labels] == 1)
+    distant = np.zeros(n, dtype=bool)
+    if not singles.size:
+        return distant
+    pairs = _grid_pairs(coords, threshold_km, sources=singles)
+    if pairs is None:
+        i = np.repeat(singles, n)
+        j = np.tile(np.arange(n), singles.size)
+        keep = i != j
+        i, j = i[keep], j[keep]
+    else:
+        i, j = pairs
+    # Точка одна в своём кластере — любая другая точка принадлежит другому кластеру
+    has_near = np.zeros(n, dtype=bool)
+    near = (haversine_pairs(coords, i, j) if stop_dist is None else stop_dist[i, j]) < threshold_km
+    has_near[i[near]] = True
+    distant[singles] = ~has_near[singles]
+    return distant
+
+
+def travel_minutes(km: float) -> float:
+    """Время в пути (мин) на km по средней скорости."""
+    return km / AVG_SPEED_KMH * 60
+
+
+def _arrival_minutes(legs: np.ndarray) -> np.ndarray:
+    """
+    Оценка прибытия (мин от старта) по длинам последовательных отрезков пути
+    (последняя ось): дорога плюс STOP_SERVICE_MIN на каждой предыдущей точке.
+    """
+    service = STOP_SERVICE_MIN * np.arange(legs.shape[-1])
+    return travel_minutes(np.cumsum(legs, axis=-1)) + service
 
 
-async def optimize_route_with_clusters(
-    current_location: Tuple[float, float],
-    orders_data: List[Dict],
-    cluster_radius_km: float = CLUSTER_RADIUS_KM,
-    distant_threshold_km: float = DISTANT_THRESHOLD_KM,
-) -> Tuple[List[Dict], List[Dict], float]:
+def _weighted_cost(dist: np.ndarray, paths: np.ndarray, priority: np.ndarray, due: np.ndarray) -> np.ndarray:
     """
-    Разделяет заказы на групповой маршрут (близкие точки) и отдельные (вдали 8+ км).
-    Returns: (grouped_route, distant_orders, total_grouped_distance_km)
+    Цель для пачки путей (км-эквивалент): длина + ожидание приоритетных
+    заказов (PRIORITY_KM_PER_MIN за минуту с весом priority) + опоздания
+    к окнам доставки (LATENESS_KM_PER_MIN за минуту после due).
+    priority и due индексируются номером точки в матрице; due = inf — без окна.
     """
-    if not orders_data:
-        return [], [], 0.0
+    stops = paths[:, 1:]
+    legs = dist[paths[:, :-1], paths[:, 1:]]
+    eta = _arrival_minutes(legs)
+    km = legs.sum(axis=1)
+    waiting = (priority[stops] * eta).sum(axis=1) * PRIORITY_KM_PER_MIN
+    late = np.maximum(eta - due[stops], 0.0).sum(axis=1) * LATENESS_KM_PER_MIN
+    return km + waiting + late
+
+
+def _relocations(path: np.ndarray, i: int, seg: int = 1) -> np.ndarray:
+    """Все варианты пути с отрезком path[i:i + seg], перенесённым на другую позицию (после старта)."""
+    m = len(path)
+    rest = np.delete(path, np.arange(i, i + seg))
+    ks = np.arange(1, m - seg + 1)[:, None]
+    js = np.arange(m)[None, :]
+    before = rest[np.minimum(js, m - seg - 1)]
+    inside = path[i + np.clip(js - ks, 0, seg - 1)]
+    after = rest[np.clip(js - seg, 0, m - seg - 1)]
+    return np.where(js < ks, before, np.where(js < ks + seg, inside, after))
+
+
+def _relocate_priority(
+    dist: np.ndarray,
+    p: np.ndarray,
+    movable: np.ndarray,
+    priority: np.ndarray,
+    due: np.ndarray,
+    deadline: float,
+) -> Tuple[np.ndarray, float]:
+    """
+    Локальный поиск по взвешенной цели: перенос отрезков из 1–3 точек,
+    начинающихся с приоритетного заказа или с окном доставки (так соседние
+    срочные переезжают вместе), пока цель уменьшается или до deadline.
+    """
+    current = float(_weighted_cost(dist, p[None, :], priority, due)[0])
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for stop in [int(s) for s in p[1:] if movable[s]]:
+            for seg in (1, 2, 3):
+                if time.perf_counter() > deadline:
+                    return p, current
+                i = int(np.flatnonzero(p == stop)[0])
+                if i + seg > len(p):
+                    break
+                candidates = _relocations(p, i, seg)
+                cost = _weighted_cost(dist, candidates, priority, due)
+                best = int(np.argmin(cost))
+                if cost[best] < current - IMPROVE_EPS_KM:
+                    p, current = candidates[best].copy(), float(cost[best])
+                    improved = True
+    return p, current
+
+
+def prioritize_path(
+    dist: np.ndarray,
+    path: Sequence[int],
+    priority: np.ndarray,
+    due: np.ndarray,
+    deadline: float,
+) -> List[int]:
+    """
+    Перестановка заказов с приоритетом или окном доставки по взвешенной цели
+    (_weighted_cost). Два старта: исходный путь и «срочные вперёд» (такие
+    заказы первыми в исходном порядке, остальные следом); каждый улучшается
+    переносом отрезков (_relocate_priority), берётся лучший. Старт path[0]
+    не двигается; результат не хуже исходного пути по цели.
+    """
+    p = np.asarray(path, dtype=np.intp).copy()
+    if len(p) < 3:
+        return p.tolist()
+    movable = (priority > 0) | np.isfinite(due)
+    ahead = movable[p[1:]]
+    seeds = [p, np.concatenate([p[:1], p[1:][ahead], p[1:][~ahead]])]
+    budget = (deadline - time.perf_counter()) / len(seeds)
+    best, best_cost = p, float(_weighted_cost(dist, p[None, :], priority, due)[0])
+    for seed in seeds:
+        candidate, cost = _relocate_priority(
+            dist, seed, movable, priority, due, time.perf_counter() + budget,
+        )
+        if cost < best_cost - IMPROVE_EPS_KM:
+            best, best_cost = candidate, cost
+    return best.tolist()
 
-    clusters = build_clusters(orders_data, cluster_radius_km)
 
-    grouped_clusters: List[List[Dict]] = []
-    distant_orders: List[Dict] = []
+def _priorities(orders_data: Sequence[Dict]) -> Tuple[np.ndarray, np.ndarray]:
+    """Вес приоритета ('priority', по умолчанию 0) и окно ('due_min', мин от сейчас) заказов."""
+    priority = np.array([float(o.get('priority') or 0.0) for o in orders_data], dtype=np.float64)
+    due = np.array(
+        [np.inf if o.get('due_min') is None else float(o['due_min']) for o in orders_data],
+        dtype=np.float64,
+    )
+    return priority, due
 
-    for idx, cluster in enumerate(clusters):
-        if len(cluster) == 1:
-            point = cluster[0]
-            min_d = _min_dist_to_clusters(point, clusters, exclude_cluster_idx=idx)
-            if min_d >= distant_threshold_km:
-                distant_orders.append(point)
-            else:
-                grouped_clusters.append(cluster)
-        else:
-            grouped_clusters.append(cluster)
+
+class ClusteredRoute(NamedTuple):
+    """Результат optimize_route_with_clusters."""
+    grouped: List[Dict]        # групповой маршрут по близким точкам, в порядке объезда
+    distant: List[Dict]        # отдельные заказы (вдали), ближайшие первыми
+    total_km: float            # длина группового маршрута от точки курьера
+    saved_km: float            # сколько км срезали 2-opt / Or-opt относительно Nearest Neighbor
+    eta_min: Tuple[float, ...] = ()  # оценка прибытия к точкам grouped, мин от старта
+    late: int = 0                    # сколько заказов grouped не успевают к окну доставки
+
+
+class _Budget:
+    """Общий бюджет времени на улучшение: считается только время самих улучшений."""
+
+    def __init__(self, seconds: float):
+        self.left = seconds
+
+    def improve(self, dist: np.ndarray, path: Sequence[int]) -> List[int]:
+        if self.left <= 0:
+            return list(path)
+        t0 = time.perf_counter()
+        result = improve_path(dist, path, t0 + self.left)
+        self.left -= time.perf_counter() - t0
+        return result
+
+
+def _plan_clusters_sync(
+    current_location: Tuple[float, float],
+    orders_data: List[Dict],
+    cluster_radius_km: float,
+    distant_threshold_km: float,
+    budget_s: float,
+    priority_budget_s: float,
+    stop_dist: Optional[np.ndarray],
+) -> ClusteredRoute:
+    n = len(orders_data)
+    coords = _coords(orders_data)
+    # Точка курьера — последняя (индекс n); known — все расстояния, если
+    # между остановками они уже известны (строка курьера — от провайдера)
+    points = np.vstack([coords, current_location])
+    known = None
+    if stop_dist is not None:
+        known = np.zeros((n + 1, n + 1))
+        known[:n, :n] = stop_dist
+        known[n, :n] = known[:n, n] = distance_provider().row(current_location, coords)[0]
+    labels = _grid_components(coords, cluster_radius_km, stop_dist)
+    distant = _distant_singletons(coords, labels, distant_threshold_km, stop_dist)
+
+    grouped_clusters = _group(
+        [i for i in range(n) if not distant[i]], labels[~distant]
+    )
 
     grouped_route: List[Dict] = []
     total_dist = 0.0
-    curr_lat, curr_lon = current_location
+    nn_dist = 0.0
+    eta = np.zeros(0)
+    late = 0
 
     if grouped_clusters:
-        sorted_clusters = sorted(
-            grouped_clusters,
-            key=lambda c: haversine_distance(curr_lat, curr_lon, *_cluster_centroid(c))
+        budget = _Budget(budget_s)
+        # Порядок кластеров: NN по центроидам от точки курьера
+        k = len(grouped_clusters)
+        centroids = np.array([
+            _cluster_centroid([orders_data[i] for i in c]) for c in grouped_clusters
+        ])
+        centroid_dist = distance_matrix(np.vstack([centroids, current_location]))
+        nn_order, _ = _nearest_neighbour(centroid_dist, k, range(k))
+
+        # 1. Чистый Nearest Neighbor — исходное решение и база для «сэкономлено».
+        # Матрица кластера + точка въезда в него (последняя строка/столбец)
+        matrices: Dict[int, np.ndarray] = {}
+        paths: Dict[int, List[int]] = {}
+        entry = n
+        for c in nn_order:
+            cluster = grouped_clusters[c]
+            dist = _with_entry(points, known, cluster, entry)
+            local, seg = _nearest_neighbour(dist, len(cluster), range(len(cluster)))
+            matrices[c], paths[c] = dist, local
+            nn_dist += seg
+            entry = cluster[local[-1]]
+
+        # 2. Улучшение: порядок кластеров, затем путь внутри каждого (2-opt / Or-opt)
+        order = budget.improve(centroid_dist, [k] + nn_order)[1:]
+        entry = n
+        improved_route: List[int] = []
+        for c in order:
+            cluster, dist = grouped_clusters[c], matrices[c]
+            m = len(cluster)
+            if order != nn_order:
+                dist[m, :m] = dist[:m, m] = (
+                    haversine_matrix(points[entry], coords[cluster])[0] if known is None
+                    else known[entry, cluster]
+                )
+            local = budget.improve(dist, [m] + paths[c])[1:]
+            total_dist += path_length(dist, [m] + local)
+            improved_route.extend(cluster[j] for j in local)
+            entry = cluster[local[-1]]
+
+        if total_dist <= nn_dist:
+            route_idx = improved_route
+        else:
+            # Порядок кластеров по центроидам оказался хуже — остаёмся на NN
+            total_dist = nn_dist
+            route_idx = [grouped_clusters[c][j] for c in nn_order for j in paths[c]]
+
+        # 3. Срочные заказы и окна доставки: перестановка по взвешенной цели
+        # на матрице всего группового маршрута (+ точка курьера последней)
+        priority, due = _priorities([orders_data[i] for i in route_idx])
+        if priority.any() or np.isfinite(due).any():
+            m = len(route_idx)
+            dist = _with_entry(points, known, route_idx, n)
+            path = prioritize_path(
+                dist, [m] + list(range(m)),
+                np.append(priority, 0.0), np.append(due, np.inf),
+                time.perf_counter() + priority_budget_s,
+            )
+            total_dist = path_length(dist, path)
+            route_idx = [route_idx[j] for j in path[1:]]
+            due = due[np.asarray(path[1:], dtype=np.intp)]
+
+        steps = np.array([n] + route_idx, dtype=np.intp)
+        legs = (
+            haversine_pairs(points, steps[:-1], steps[1:]) if known is None
+            else known[steps[:-1], steps[1:]]
         )
+        eta = _arrival_minutes(legs)
+        late = int((eta > due).sum())
+        grouped_route = [orders_data[i] for i in route_idx]
+
+    distant_idx = np.flatnonzero(distant)
+    from_start = (
+        haversine_matrix(np.asarray(current_location, dtype=np.float64), coords[distant_idx])[0]
+        if known is None else known[n, distant_idx]
+    )
+    # Срочные первыми, дальше ближайшие; устойчивая сортировка — при равных
+    # расстояниях сохраняется исходный порядок
+    distant_priority, _ = _priorities([orders_data[int(i)] for i in distant_idx])
+    distant_orders_sorted = [
+        orders_data[int(i)] for i in distant_idx[np.lexsort((from_start, -distant_priority))]
+    ]
+
+    saved = max(nn_dist - total_dist, 0.0)
+    logger.debug(
+        "Route: %s orders, %s clusters, %.2f km (saved %.2f km)",
+        n, len(grouped_clusters), total_dist, saved,
+    )
+    return ClusteredRoute(
+        grouped_route, distant_orders_sorted, total_dist, saved,
+        tuple(float(x) for x in eta), late,
+    )
 
-        for cluster in sorted_clusters:
-            ordered, seg_dist = _optimize_route_sync((curr_lat, curr_lon), cluster)
-            grouped_route.extend(ordered)
-            total_dist += seg_dist
-            curr_lat, curr_lon = ordered[-1]['lat'], ordered[-1]['lon']
 
-    distant_orders_sorted = sorted(
-        distant_orders,
-        key=lambda o: haversine_distance(current_location[0], current_location[1], o['lat'], o['lon'])
+async def optimize_route_with_clusters(
+    current_location: Tuple[float, float],
+    orders_data: List[Dict],
+    cluster_radius_km: float = CLUSTER_RADIUS_KM,
+    distant_threshold_km: float = DISTANT_THRESHOLD_KM,
+    budget_s: float = ROUTE_IMPROVE_BUDGET_S,
+    priority_budget_s: float = ROUTE_PRIORITY_BUDGET_S,
+    stop_dist: Optional[np.ndarray] = None,
+) -> ClusteredRoute:
+    """
+    Разделяет заказы на групповой маршрут (близкие точки) и отдельные (вдали 8+ км).
+    Кластеры и отдельные точки ищутся по сетке (сравниваются только соседние
+    ячейки). Порядок кластеров и порядок внутри кластера — Nearest Neighbor,
+    затем 2-opt / Or-opt; на улучшения всего маршрута — не больше budget_s.
+
+    Необязательные ключи заказа: 'priority' (вес срочности, 0 — обычный) и
+    'due_min' (окно доставки, минут от сейчас). Если они есть, групповой
+    маршрут переставляется по цели «км + ожидание срочных + опоздания»
+    (prioritize_path, не больше priority_budget_s): срочные едут раньше,
+    если крюк не слишком велик. Отдельные заказы — срочные первыми.
+
+    stop_dist — готовая матрица км между заказами (в порядке orders_data,
+    services.clinic_matrix): тогда в запросе считаются только расстояния
+    от точки курьера (через distance_provider — по дорогам, если граф
+    загружен), а кластеры и порядок строятся по этой матрице.
+    Считается в отдельном потоке, чтобы не блокировать event loop.
+    """
+    if not orders_data:
+        return ClusteredRoute([], [], 0.0, 0.0)
+    return await asyncio.to_thread(
+        _plan_clusters_sync, current_location, orders_data,
+        cluster_radius_km, distant_threshold_km, budget_s, priority_budget_s, stop_dist,
     )
 
-    return grouped_route, distant_orders_sorted, total_dist
-
 
 def generate_yandex_maps_url(orders: List[Dict]) -> str:
     """
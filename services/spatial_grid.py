@@ -0,0 +1,159 @@
+"""
+Равномерная сетка для поиска точек рядом (геолокации курьеров, клиники).
+
+Пространство делится на ячейки фиксированного размера в градусах; точка
+хранится в своей ячейке. Поиск в радиусе просматривает только ячейки,
+пересекающие точный ограничивающий прямоугольник круга (формула для
+широты/долготы, без приближений), и уточняет кандидатов по Haversine —
+результат совпадает с полным перебором, но читается лишь окрестность.
+"""
+from __future__ import annotations
+
+import math
+from typing import Callable, Dict, Generic, Hashable, Iterator, List, Optional, Set, Tuple, TypeVar
+
+from services.routing import haversine_distance
+
+EARTH_RADIUS_KM = 6371.0
+# Длина одного градуса меридиана
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180.0
+
+K = TypeVar("K", bound=Hashable)
+Cell = Tuple[int, int]
+
+
+def bounding_box(lat: float, lon: float, radius_km: float) -> Tuple[float, float, float, float]:
+    """
+    Точный прямоугольник (min_lat, max_lat, min_lon, max_lon), содержащий
+    все точки не дальше radius_km от (lat, lon) по Haversine.
+    """
+    ang = radius_km / EARTH_RADIUS_KM
+    dlat = math.degrees(ang)
+    min_lat, max_lat = lat - dlat, lat + dlat
+    if min_lat <= -90.0 or max_lat >= 90.0:
+        # Круг захватывает полюс — по долготе ограничений нет
+        return max(min_lat, -90.0), min(max_lat, 90.0), -180.0, 180.0
+    ratio = math.sin(ang) / math.cos(math.radians(lat))
+    if ratio >= 1.0:
+        return min_lat, max_lat, -180.0, 180.0
+    dlon = math.degrees(math.asin(ratio))
+    return min_lat, max_lat, lon - dlon, lon + dlon
+
+
+class GridIndex(Generic[K]):
+    """
+    Индекс точек key -> (lat, lon) на равномерной сетке.
+
+    cell_km — сторона ячейки по широте; по долготе ячейка растянута на
+    1/cos(ref_lat), чтобы на широте города ячейки были примерно квадратными
+    (на точность поиска ref_lat не влияет, только на число просмотренных ячеек).
+    """
+
+    def __init__(self, cell_km: float, ref_lat: float = 0.0):
+        if cell_km <= 0:
+            raise ValueError("cell_km must be positive")
+        self.cell_km = cell_km
+        self._lat_step = cell_km / KM_PER_DEGREE
+        self._lon_step = self._lat_step / max(math.cos(math.radians(ref_lat)), 0.01)
+        self._cells: Dict[Cell, Set[K]] = {}
+        self._points: Dict[K, Tuple[float, float]] = {}
+
+    def __len__(self) -> int:
+        return len(self._points)
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._points
+
+    def cell_of(self, lat: float, lon: float) -> Cell:
+        return math.floor(lat / self._lat_step), math.floor(lon / self._lon_step)
+
+    def get(self, key: K) -> Optional[Tuple[float, float]]:
+        return self._points.get(key)
+
+    def put(self, key: K, lat: float, lon: float) -> None:
+        """Добавить точку или переместить существующую."""
+        old = self._points.get(key)
+        if old is not None:
+            old_cell = self.cell_of(*old)
+            new_cell = self.cell_of(lat, lon)
+            self._points[key] = (lat, lon)
+            if old_cell == new_cell:
+                return
+            self._discard_from_cell(old_cell, key)
+            self._cells.setdefault(new_cell, set()).add(key)
+            return
+        self._points[key] = (lat, lon)
+        self._cells.setdefault(self.cell_of(lat, lon), set()).add(key)
+
+    def remove(self, key: K) -> None:
+        point = self._points.pop(key, None)
+        if point is not None:
+            self._discard_from_cell(self.cell_of(*point), key)
+
+    def _discard_from_cell(self, cell: Cell, key: K) -> None:
+        bucket = self._cells.get(cell)
+        if bucket is None:
+            return
+        bucket.discard(key)
+        if not bucket:
+            del self._cells[cell]
+
+    def candidates(self, lat: float, lon: float, radius_km: float) -> Iterator[K]:
+        """
+        Ключи из ячеек, пересекающих прямоугольник круга (без проверки
+        расстояния): надмножество точек в радиусе.
+        """
+        min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius_km)
+        lat0, lon0 = self.cell_of(min_lat, min_lon)
+        lat1, lon1 = self.cell_of(max_lat, max_lon)
+        if (lat1 - lat0 + 1) * (lon1 - lon0 + 1) > len(self._cells):
+            # Окрестность больше всей сетки — быстрее пройти по занятым ячейкам
+            for (ci, cj), bucket in self._cells.items():
+                if lat0 <= ci <= lat1 and lon0 <= cj <= lon1:
+                    yield from bucket
+            return
+        for ci in range(lat0, lat1 + 1):
+            for cj in range(lon0, lon1 + 1):
+                bucket = self._cells.get((ci, cj))
+                if bucket:
+                    yield from bucket
+
+    def within(
+        self,
+        lat: float,
+        lon: float,
+        radius_km: float,
+        predicate: Optional[Callable[[K], bool]] = None,
+    ) -> List[Tuple[float, K]]:
+        """Точки не дальше radius_km: [(distance_km, key)] по возрастанию расстояния."""
+        found = []
+        for key in self.candidates(lat, lon, radius_km):
+            if predicate is not None and not predicate(key):
+                continue
+            plat, plon = self._points[key]
+            dist = haversine_distance(lat, lon, plat, plon)
+            if dist <= radius_km:
+                found.append((dist, key))
+        found.sort(key=lambda item: item[0])
+        return found
+
+    def nearest(
+        self,
+        lat: float,
+        lon: float,
+        k: int,
+        max_radius_km: float,
+        predicate: Optional[Callable[[K], bool]] = None,
+    ) -> List[Tuple[float, K]]:
+        """
+        До k ближайших точек не дальше max_radius_km.
+        Радиус поиска удваивается, начиная с размера ячейки, пока не наберётся k.
+        """
+        if k <= 0 or not self._points:
+            return []
+        radius = min(self.cell_km, max_radius_km)
+        while True:
+            found = self.within(lat, lon, radius, predicate)
+            if len(found) >= k or radius >= max_radius_km:
+                return found[:k]
+            radius = min(radius * 2, max_radius_km)
@@ -0,0 +1,140 @@
+"""
+Живая очередь склада в памяти: активные заказы (NEW/ASSEMBLY),
+срочные первыми, дальше по времени создания (FIFO).
+
+Питается событиями services.order_bus (создание заказа, смена статуса),
+периодически сверяется с БД. Пока первая сверка не прошла, ready == False
+и хендлеры читают список из БД как раньше.
+"""
+from __future__ import annotations
+
+import asyncio
+import bisect
+import logging
+from typing import NamedTuple, Optional
+
+from sqlalchemy import select
+
+from database.models import Order, OrderStatus
+from services.order_bus import OrderChange, subscribe, to_ts
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = (OrderStatus.NEW, OrderStatus.ASSEMBLY)
+
+
+class QueueEntry(NamedTuple):
+    """Строка очереди: те же поля, что использует список кнопок склада."""
+    id: int
+    is_urgent: bool
+    status: OrderStatus
+    created_ts: float
+
+
+def _sort_key(entry: QueueEntry) -> tuple:
+    return (0 if entry.is_urgent else 1, entry.created_ts, entry.id)
+
+
+class WarehouseQueue:
+    """Упорядоченная очередь (отсортированный список ключей + словарь по id)."""
+
+    def __init__(self):
+        self._keys: list[tuple] = []
+        self._entries: dict[int, QueueEntry] = {}
+        self.ready = False
+        self._reconciling = False
+        self._pending: list[OrderChange] = []
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _remove(self, order_id: int) -> None:
+        entry = self._entries.pop(order_id, None)
+        if entry is None:
+            return
+        key = _sort_key(entry)
+        i = bisect.bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            del self._keys[i]
+
+    def _upsert(self, entry: QueueEntry) -> None:
+        self._remove(entry.id)
+        self._entries[entry.id] = entry
+        bisect.insort(self._keys, _sort_key(entry))
+
+    def apply(self, change: OrderChange) -> None:
+        """Применить событие заказа."""
+        if self._reconciling:
+            # Повторим после сверки, чтобы снимок из БД не затёр свежее событие
+            self._pending.append(change)
+        if change.status in ACTIVE_STATUSES:
+            self._upsert(QueueEntry(change.order_id, change.is_urgent, change.status, change.created_ts))
+        else:
+            self._remove(change.order_id)
+
+    def snapshot(self) -> list[QueueEntry]:
+        """Все активные заказы в порядке обработки."""
+        entries = self._entries
+        return [entries[key[2]] for key in self._keys]
+
+    def new_count(self) -> int:
+        return sum(1 for e in self._entries.values() if e.status == OrderStatus.NEW)
+
+    async def reconcile(self, session_maker) -> None:
+        """Пересобрать очередь из БД (одна лёгкая выборка без связей)."""
+        self._reconciling = True
+        self._pending = []
+        try:
+            async with session_maker() as session:
+                result = await session.execute(
+                    select(Order.id, Order.is_urgent, Order.status, Order.created_at)
+                    .where(Order.status.in_(ACTIVE_STATUSES))
+                )
+                rows = result.all()
+            drift = len(rows) != len(self._entries) or any(
+                r.id not in self._entries or self._entries[r.id].status != r.status for r in rows
+            )
+            self._keys = []
+            self._entries = {}
+            for r in rows:
+                self._upsert(QueueEntry(r.id, bool(r.is_urgent), r.status, to_ts(r.created_at)))
+            self._reconciling = False
+            for change in self._pending:
+                self.apply(change)
+            if drift and self.ready:
+                logger.warning("Warehouse queue drift corrected on reconcile (active=%s)", len(self._entries))
+            self.ready = True
+        finally:
+            self._reconciling = False
+            self._pending = []
+
+
+warehouse_queue = WarehouseQueue()
+subscribe(warehouse_queue.apply)
+
+_reconcile_task: Optional[asyncio.Task] = None
+
+
+async def _reconcile_loop(session_maker, interval: int) -> None:
+    while True:
+        try:
+            await warehouse_queue.reconcile(session_maker)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Warehouse queue reconcile failed: %s", e)
+        await asyncio.sleep(interval)
+
+
+def start_reconcile(session_maker, interval: int = 60) -> None:
+    """Запуск периодической сверки с БД (вызывать из main.py)."""
+    global _reconcile_task
+    _reconcile_task = asyncio.create_task(_reconcile_loop(session_maker, interval))
+
+
+def stop_reconcile() -> None:
+    """Остановка сверки (при shutdown)."""
+    global _reconcile_task
+    if _reconcile_task and not _reconcile_task.done():
+        _reconcile_task.cancel()
+        _reconcile_task = None
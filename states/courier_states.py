@@ -8,7 +8,6 @@ class CourierState(StatesGroup):
     delivering_combined = State() # Delivering combined route, tracking individual deliveries
 
     # Store prepared route details in state
-    # sorted_order_ids: list[int]
-    # route_data: list[dict] - полные данные о заказах
+    # route_id: str - предложенный маршрут в services.route_store
     # combined_route_ids: list[int] - ID заказов в объединенном маршруте
     # delivered_order_ids: list[int] - ID уже доставленных заказов
\ No newline at end of file